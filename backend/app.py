@@ -1,23 +1,75 @@
-from flask import Flask, jsonify, request, session
+from flask import Flask, Response, jsonify, request, session, stream_with_context
 from flask_cors import CORS
+import sqlite3
+from datetime import date
 from functools import wraps
+import hashlib
+import hmac
 import json
+import os
+import threading
 import time
+import helpers.db as db_module
 from helpers.db import (
     get_db,
     close_db,
     user_info,
     update_by_id,
     is_doctor_enrolled,
+    search_patients,
+    db_pool_stats,
+    profile_cache_stats,
+    PoolExhausted,
+    ASSIGNED_DOCTOR_SQL,
+    ASSIGNED_PATIENTS_SQL,
+    PATIENT_SEARCH_PAGE_SIZE,
 )
 from helpers.auth import login_user, register_user
-from helpers.msg import get_patient_msg_history, append_message_history
+from helpers.passwords import HashingUnavailable
+from helpers.history import patch_patient_history, patient_cohort
+from helpers.msg import (
+    get_patient_msg_page,
+    append_message_history,
+    latest_message_id,
+    wait_for_messages,
+    message_cache_stats,
+    MESSAGE_PAGE_SIZE,
+)
 from helpers.medicine import (
-    fetch_prescription_details,
+    list_prescriptions,
     create_prescription,
+    create_prescriptions,
+    collect_prescriptions,
+    refund_code_attempt,
+    take_code_attempt,
     delete_prescription_if_collectable,
+    find_prescriptions_by_code,
+    latest_prescription_change,
+    prescription_changes,
+    ROLE_PRESCRIPTION_COLUMN,
+    PRESCRIPTION_PAGE_SIZE,
+    PRESCRIPTION_CHANGES_PAGE_SIZE,
+)
+from helpers.audit import append_audit_log, query_audit_log, audit_metrics
+from helpers.migrations import apply_migrations
+from helpers.metrics import start_request, finish_request, render_metrics
+from helpers.versions import (
+    resource_version,
+    profile_resource,
+    prescriptions_resource,
+    patient_list_resource,
 )
-from helpers.audit import append_audit_log
+
+
+def migrate_database() -> None:
+    # Called by the entry points (wsgi.py, __main__), not on import: the
+    # spawned password workers re-import this module as __mp_main__.
+    if os.environ.get("MEDILINK_AUTO_MIGRATE", "1") != "1":
+        return
+    migration_conn = sqlite3.connect(db_module.DB_PATH)
+    apply_migrations(migration_conn)
+    migration_conn.close()
+
 
 app = Flask(__name__)
 CORS(app)
@@ -26,6 +78,55 @@ app.teardown_appcontext(close_db)
 # TODO: move to an env var before production
 app.secret_key = "ThisIsASecretKey"
 
+LONG_POLL_TIMEOUT = 25
+STREAM_DURATION = 300
+STREAM_HEARTBEAT = 15
+# Each open stream holds a request thread, so only this many per worker;
+# past it clients are told to long-poll instead.
+STREAM_LIMIT = int(os.environ.get(
+    "MEDILINK_STREAM_LIMIT", str(max(1, int(os.environ.get("MEDILINK_THREADS", "8")) // 2))
+))
+_stream_slots = threading.BoundedSemaphore(STREAM_LIMIT)
+# Admin routes are disabled unless a token is configured.
+ADMIN_TOKEN = os.environ.get("MEDILINK_ADMIN_TOKEN")
+
+def _int_arg(name, default=None):
+    value = request.args.get(name)
+    if value is None or value == "":
+        return default
+    return int(value)
+
+
+def _etag(*parts):
+    # Strong ETags built from version counters, never from the response body.
+    return "-".join(str(part) for part in parts)
+
+
+def _query_key(*values):
+    # Free-form query values (cursors, filters) go into ETags as a digest:
+    # they may contain characters an ETag cannot.
+    return hashlib.sha256(json.dumps(values).encode("utf-8")).hexdigest()[:16]
+
+
+def _not_modified(tag):
+    if tag not in request.if_none_match:
+        return None
+    response = Response(status=304)
+    return _with_etag(response, tag)
+
+
+def _too_many_code_failures():
+    append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+    return jsonify({"error": "Too many wrong collection codes, try again later"}), 429
+
+
+def _with_etag(response, tag):
+    response.set_etag(tag)
+    # Browsers keep the body but revalidate before each use.
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
 def require_login(roles=None):
     def decorator(f):
         @wraps(f)
@@ -52,6 +153,43 @@ def require_login(roles=None):
     return decorator
 
 
+def require_admin(f):
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        # Also accepts "Authorization: Bearer <token>", which scrapers can send.
+        token = request.headers.get("X-Admin-Token", "")
+        authorization = request.headers.get("Authorization", "")
+        if not token and authorization.startswith("Bearer "):
+            token = authorization[len("Bearer "):]
+        if not ADMIN_TOKEN or not hmac.compare_digest(token, ADMIN_TOKEN):
+            return jsonify({"error": "Unauthorized"}), 403
+        return f(*args, **kwargs)
+    return wrapper
+
+
+@app.before_request
+def record_request_start():
+    start_request()
+
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+    response_bytes = None if response.is_streamed else response.calculate_content_length()
+    finish_request(request.method, route, response.status_code, response_bytes)
+    return response
+
+
+@app.errorhandler(PoolExhausted)
+def handle_pool_exhausted(e):
+    return jsonify({"error": "Server busy, try again"}), 503
+
+
+@app.errorhandler(HashingUnavailable)
+def handle_hashing_unavailable(e):
+    return jsonify({"error": "Server busy, try again"}), 503
+
+
 @app.route('/api/login/<role>', methods=['POST'])
 def login(role):
     data = request.get_json()
@@ -113,15 +251,24 @@ def logout():
 @app.route('/api/me', methods=['GET'])
 @require_login()
 def me():
-    safe_user = user_info(session["UserID"], session["Role"])
+    role = session["Role"]
+    version = resource_version(get_db(), profile_resource(role, session["UserID"]))
+    tag = _etag("me", role, session["UserID"], version)
+    not_modified = _not_modified(tag)
+    if not_modified is not None:
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, True)
+        return not_modified
+
+    # A cached profile from before the tagged version is not used.
+    safe_user = user_info(session["UserID"], role, version)
     if safe_user is None:
         append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
         return jsonify({"error": "User not found"}), 404
     append_audit_log(session.get("Role"), session.get("UserID"), request.path, True)
-    return jsonify({
+    return _with_etag(jsonify({
         "user": safe_user,
-        "role": session["Role"]
-    })
+        "role": role
+    }), tag)
 
 
 @app.route('/api/profile/<TargetRole>/<userID>', methods=['GET'])
@@ -138,7 +285,9 @@ def get_profile(TargetRole, userID):
         append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
         return jsonify({"error": "Invalid Target Role"}), 400
 
-    safe_user = user_info(userID, TargetRole)
+    # Another worker may have changed the profile since it was cached here.
+    version = resource_version(get_db(), profile_resource(TargetRole, userID))
+    safe_user = user_info(userID, TargetRole, version)
     if safe_user is None:
         append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
         return jsonify({"error": "User not found"}), 404
@@ -150,15 +299,13 @@ def get_profile(TargetRole, userID):
 @require_login(roles=["patient"])
 def get_assigned_doctor():
     db = get_db()
-    row = db.execute(
-        "SELECT doctorID FROM DPEnrole WHERE patientID = ? LIMIT 1",
-        (session["UserID"],),
-    ).fetchone()
+    row = db.execute(ASSIGNED_DOCTOR_SQL, (session["UserID"],)).fetchone()
     if row is None:
         append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
         return jsonify({"error": "Doctor not found"}), 404
 
-    safe_user = user_info(row["doctorID"], "doctor")
+    version = resource_version(db, profile_resource("doctor", row["doctorID"]))
+    safe_user = user_info(row["doctorID"], "doctor", version)
     if safe_user is None:
         append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
         return jsonify({"error": "Doctor not found"}), 404
@@ -171,20 +318,45 @@ def get_assigned_doctor():
 @require_login(roles=["doctor"])
 def get_assigned_patients():
     db = get_db()
-    rows = db.execute(
-        """
-        SELECT Patients.patientID, Patients.Name
-        FROM DPEnrole
-        JOIN Patients ON Patients.patientID = DPEnrole.patientID
-        WHERE DPEnrole.doctorID = ?
-        ORDER BY Patients.Name
-        """,
-        (session["UserID"],),
-    ).fetchall()
+    version = resource_version(db, patient_list_resource(session["UserID"]))
+    tag = _etag("patients", session["UserID"], version)
+    not_modified = _not_modified(tag)
+    if not_modified is not None:
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, True)
+        return not_modified
 
+    # Read after the version, and not through the per-process profile cache,
+    # so the body is never older than the tag.
+    rows = db.execute(ASSIGNED_PATIENTS_SQL, (session["UserID"],)).fetchall()
     patients = [dict(row) for row in rows]
     append_audit_log(session.get("Role"), session.get("UserID"), request.path, True)
-    return jsonify({"patients": patients})
+    return _with_etag(jsonify({"patients": patients}), tag)
+
+
+@app.route('/api/doctor/patients/search', methods=['GET'])
+@require_login(roles=["doctor"])
+def search_assigned_patients():
+    query = (request.args.get("q") or "").strip()
+    if not query:
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": "Missing search query"}), 400
+
+    try:
+        limit = _int_arg("limit", PATIENT_SEARCH_PAGE_SIZE)
+        offset = _int_arg("offset", 0)
+        patients, next_offset = search_patients(
+            session["UserID"],
+            query,
+            field=request.args.get("field") or None,
+            limit=limit,
+            offset=offset,
+        )
+    except ValueError:
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": "Invalid field, limit or offset"}), 400
+
+    append_audit_log(session.get("Role"), session.get("UserID"), request.path, True)
+    return jsonify({"patients": patients, "next_offset": next_offset})
 
 
 @app.route('/api/profile/patient/<patientID>', methods=['PUT'])
@@ -214,6 +386,50 @@ def update_patient_history(patientID):
     return jsonify({})
 
 
+@app.route('/api/profile/patient/<patientID>/history', methods=['PATCH'])
+@require_login(roles=["doctor"])
+def patch_patient_history_route(patientID):
+    if not is_doctor_enrolled(session["UserID"], patientID):
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": "Unauthorized"}), 403
+
+    try:
+        patched = patch_patient_history(patientID, request.get_json(silent=True))
+    except ValueError as ve:
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": str(ve)}), 400
+
+    if patched == "not_found":
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": "Patient not found"}), 404
+    if patched == "conflict":
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({
+            "error": "Patch does not apply to the current history: a replace or remove target "
+                     "is missing, or an add names an array index (use - to append)"
+        }), 409
+
+    append_audit_log(session.get("Role"), session.get("UserID"), request.path, True)
+    return jsonify({})
+
+
+@app.route('/api/doctor/patients/cohort', methods=['GET'])
+@require_login(roles=["doctor"])
+def get_patient_cohort():
+    try:
+        patients = patient_cohort(
+            session["UserID"],
+            allergies=request.args.getlist("allergy"),
+            family_history=request.args.getlist("family_history"),
+        )
+    except ValueError as ve:
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": str(ve)}), 400
+
+    append_audit_log(session.get("Role"), session.get("UserID"), request.path, True)
+    return jsonify({"patients": patients})
+
+
 @app.route('/api/messages/<patientID>', methods=['GET'])
 @require_login(roles=["patient", "doctor"])
 def get_messages(patientID):
@@ -225,9 +441,107 @@ def get_messages(patientID):
             append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
             return jsonify({"error": "Unauthorized"}), 403
 
-    histories = get_patient_msg_history(patientID)
+    try:
+        limit = _int_arg("limit", MESSAGE_PAGE_SIZE)
+        before = _int_arg("before")
+        after = _int_arg("after")
+    except ValueError:
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": "limit, before and after must be integers"}), 400
+    if before is not None and after is not None:
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": "Use either before or after, not both"}), 400
+
+    # Sends only ever add messages, so the latest messageID versions the
+    # whole thread; the page parameters pick the slice of it.
+    tag = _etag("messages", patientID, latest_message_id(patientID), limit, before, after)
+    not_modified = _not_modified(tag)
+    if not_modified is not None:
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, True)
+        return not_modified
+
+    messages, next_cursor = get_patient_msg_page(patientID, limit, before, after)
     append_audit_log(session.get("Role"), session.get("UserID"), request.path, True)
-    return jsonify({"messages": histories})
+    return _with_etag(jsonify({"messages": messages, "next_cursor": next_cursor}), tag)
+
+
+@app.route('/api/messages/<patientID>/poll', methods=['GET'])
+@require_login(roles=["patient", "doctor"])
+def poll_messages(patientID):
+    user_role = session["Role"]
+    if user_role == "patient":
+        patientID = session["UserID"]
+    else:
+        if not is_doctor_enrolled(session["UserID"], patientID):
+            append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+            return jsonify({"error": "Unauthorized"}), 403
+
+    try:
+        after = _int_arg("after")
+        timeout = _int_arg("timeout", LONG_POLL_TIMEOUT)
+    except ValueError:
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": "after and timeout must be integers"}), 400
+    if after is None:
+        after = latest_message_id(patientID)
+    timeout = max(0, min(timeout, LONG_POLL_TIMEOUT))
+
+    append_audit_log(session.get("Role"), session.get("UserID"), request.path, True)
+    messages, cursor = wait_for_messages(patientID, after, timeout)
+    return jsonify({"messages": messages, "cursor": cursor})
+
+
+@app.route('/api/messages/<patientID>/stream', methods=['GET'])
+@require_login(roles=["patient", "doctor"])
+def stream_messages(patientID):
+    user_role = session["Role"]
+    if user_role == "patient":
+        patientID = session["UserID"]
+    else:
+        if not is_doctor_enrolled(session["UserID"], patientID):
+            append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+            return jsonify({"error": "Unauthorized"}), 403
+
+    try:
+        after = request.headers.get("Last-Event-ID") or request.args.get("after")
+        after = int(after) if after else None
+        duration = _int_arg("timeout", STREAM_DURATION)
+    except ValueError:
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": "after and timeout must be integers"}), 400
+    if after is None:
+        after = latest_message_id(patientID)
+    duration = max(0, min(duration, STREAM_DURATION))
+
+    # The stream closes after `duration` seconds; EventSource reconnects on
+    # its own and resumes from Last-Event-ID.
+    def events(cursor):
+        deadline = time.monotonic() + duration
+        yield f"retry: 2000\nid: {cursor}\n\n"
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            messages, cursor = wait_for_messages(
+                patientID, cursor, min(remaining, STREAM_HEARTBEAT)
+            )
+            if not messages:
+                yield ": keepalive\n\n"
+            for message in messages:
+                yield f"id: {message['id']}\nevent: message\ndata: {json.dumps(message)}\n\n"
+
+    if not _stream_slots.acquire(blocking=False):
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": "Too many open streams, use /poll"}), 503
+
+    append_audit_log(session.get("Role"), session.get("UserID"), request.path, True)
+    response = Response(
+        stream_with_context(events(after)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    response.call_on_close(_stream_slots.release)
+    return response
 
 
 @app.route('/api/messages/<patientID>', methods=['POST'])
@@ -262,39 +576,79 @@ def send_message(patientID):
 @require_login()
 def get_prescriptions():
     role = session["Role"]
-    role_column_map = {
-        "patient": "patientID",
-        "doctor": "doctorID",
-        "pharmacist": "pharmID",
-    }
-    role_column = role_column_map.get(role)
-    if role_column is None:
+    if role not in ROLE_PRESCRIPTION_COLUMN:
         append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
         return jsonify({"error": "Invalid role"}), 400
 
-    db = get_db()
-    rows = db.execute(
-        f"""
-        SELECT prescriptionID
-        FROM Prescriptions
-        WHERE {role_column} = ?
-        ORDER BY prescriptionID
-        """,
-        (session["UserID"],),
-    ).fetchall()
-
-    prescriptions = []
-    for row in rows:
-        prescription = fetch_prescription_details(
-            session["UserID"],
-            role,
-            row["prescriptionID"],
-        )
-        if prescription is not None:
-            prescriptions.append(prescription)
+    try:
+        limit = _int_arg("limit", PRESCRIPTION_PAGE_SIZE)
+        prescribed_from = request.args.get("DatePrescribedFrom") or None
+        prescribed_to = request.args.get("DatePrescribedTo") or None
+        for value in (prescribed_from, prescribed_to):
+            if value is not None:
+                date.fromisoformat(value)
+    except ValueError:
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": "Invalid limit or date range"}), 400
+
+    cursor = request.args.get("cursor") or None
+    duration_type = request.args.get("DurationType") or None
+    version = resource_version(get_db(), prescriptions_resource(role, session["UserID"]))
+    tag = _etag(
+        "prescriptions", role, session["UserID"], version,
+        _query_key(limit, cursor, duration_type, prescribed_from, prescribed_to),
+    )
+    not_modified = _not_modified(tag)
+    if not_modified is not None:
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, True)
+        return not_modified
+
+    # Read before the listing, so replaying changes after it can only repeat
+    # work, never miss any.
+    change_seq = latest_prescription_change(session["UserID"], role)
+    prescriptions, next_cursor = list_prescriptions(
+        session["UserID"],
+        role,
+        limit=limit,
+        cursor=cursor,
+        duration_type=duration_type,
+        prescribed_from=prescribed_from,
+        prescribed_to=prescribed_to,
+    )
 
     append_audit_log(session.get("Role"), session.get("UserID"), request.path, True)
-    return jsonify({"prescriptions": prescriptions})
+    return _with_etag(jsonify({
+        "prescriptions": prescriptions,
+        "next_cursor": next_cursor,
+        "change_seq": change_seq,
+    }), tag)
+
+
+@app.route('/api/prescriptions/changes', methods=['GET'])
+@require_login()
+def get_prescription_changes():
+    role = session["Role"]
+    if role not in ROLE_PRESCRIPTION_COLUMN:
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": "Invalid role"}), 400
+
+    try:
+        since = _int_arg("since", 0)
+        limit = _int_arg("limit", PRESCRIPTION_CHANGES_PAGE_SIZE)
+    except ValueError:
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": "since and limit must be integers"}), 400
+
+    upserts, deleted, change_seq, has_more = prescription_changes(
+        session["UserID"], role, since, limit
+    )
+    append_audit_log(session.get("Role"), session.get("UserID"), request.path, True)
+    return jsonify({
+        "upserts": upserts,
+        "deleted": deleted,
+        "change_seq": change_seq,
+        "has_more": has_more,
+    })
 
 
 @app.route('/api/prescriptions', methods=['POST'])
@@ -312,6 +666,39 @@ def create_prescription_route():
     return jsonify({}), 201
 
 
+@app.route('/api/prescriptions/batch', methods=['POST'])
+@require_login(roles=["doctor"])
+def create_prescriptions_route():
+    # {"prescriptions": [...], "atomic": true}. Atomic batches create all
+    # items or none; otherwise valid items are created and the rest
+    # reported. 201 if everything was created, 207 if some were, else 400.
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    atomic = data.get("atomic", True)
+    if not isinstance(atomic, bool):
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": "atomic must be a boolean"}), 400
+    try:
+        results, created = create_prescriptions(session["UserID"], data.get("prescriptions"), atomic)
+    except ValueError as e:
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": str(e)}), 400
+    except Exception:
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": "Failed to create prescriptions"}), 400
+
+    append_audit_log(session.get("Role"), session.get("UserID"), request.path, created > 0)
+    if created == len(results):
+        status = 201
+    elif created:
+        status = 207
+    else:
+        status = 400
+    return jsonify({"results": results, "created": created, "atomic": atomic}), status
+
+
 @app.route('/api/prescriptions/<prescriptionID>', methods=['DELETE'])
 @require_login(roles=["pharmacist"])
 def delete_prescription_route(prescriptionID):
@@ -340,5 +727,112 @@ def delete_prescription_route(prescriptionID):
     return jsonify({"status": "Prescription Collected and Deleted"})
 
 
+@app.route('/api/prescriptions/collect', methods=['POST'])
+@require_login(roles=["pharmacist"])
+def collect_prescriptions_route():
+    # {"items": [{"prescriptionID": ..., "CollectionCode": ...}, ...]}; each
+    # result has the status the single DELETE route would have given.
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    items = data.get("items")
+    if (
+        not isinstance(items, list) or not items
+        or not all(
+            isinstance(item, dict)
+            and isinstance(item.get("prescriptionID"), str)
+            and isinstance(item.get("CollectionCode"), str)
+            and item["CollectionCode"]
+            for item in items
+        )
+    ):
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": "items must be a non-empty list of prescriptionID and CollectionCode"}), 400
+    try:
+        statuses = collect_prescriptions(
+            session["UserID"],
+            [(item["prescriptionID"], item["CollectionCode"]) for item in items],
+        )
+    except ValueError as e:
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": str(e)}), 400
+
+    collected = sum(status in ("code_changed", "deleted") for status in statuses)
+    append_audit_log(session.get("Role"), session.get("UserID"), request.path, collected > 0)
+    return jsonify({
+        "results": [
+            {"prescriptionID": item["prescriptionID"], "status": status}
+            for item, status in zip(items, statuses)
+        ],
+        "collected": collected,
+    })
+
+
+@app.route('/api/prescriptions/lookup', methods=['POST'])
+@require_login(roles=["pharmacist"])
+def lookup_prescriptions_route():
+    # The code travels in the body, so it stays out of URLs and access logs.
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    collection_code = data.get("CollectionCode")
+    if not isinstance(collection_code, str) or not collection_code:
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": "Missing CollectionCode"}), 400
+
+    # Codes that match nothing are counted per pharmacy, so the lookup
+    # cannot be used to enumerate codes. The attempt is counted up front and
+    # handed back if the code matches.
+    if not take_code_attempt(session["UserID"]):
+        return _too_many_code_failures()
+    prescriptions = find_prescriptions_by_code(session["UserID"], collection_code)
+    if prescriptions:
+        refund_code_attempt(session["UserID"])
+    else:
+        append_audit_log(session.get("Role"), session.get("UserID"), request.path, False)
+        return jsonify({"error": "No prescription with that collection code"}), 404
+
+    append_audit_log(session.get("Role"), session.get("UserID"), request.path, True)
+    return jsonify({"prescriptions": prescriptions})
+
+
+@app.route('/api/admin/audit/<role>', methods=['GET'])
+@require_admin
+def get_audit_log(role):
+    try:
+        limit = _int_arg("limit", 1000)
+        entries = query_audit_log(
+            role,
+            user_id=request.args.get("userID") or None,
+            route=request.args.get("route") or None,
+            since=request.args.get("since") or None,
+            until=request.args.get("until") or None,
+            limit=max(1, min(limit, 10000)),
+        )
+    except ValueError:
+        return jsonify({"error": "Invalid role, limit or time range"}), 400
+    return jsonify({"entries": entries})
+
+
+@app.route('/api/admin/stats', methods=['GET'])
+@require_admin
+def get_stats():
+    return jsonify({
+        "db_pool": db_pool_stats(),
+        "audit": audit_metrics(),
+        "profile_cache": profile_cache_stats(),
+        "message_cache": message_cache_stats(),
+    })
+
+
+@app.route('/api/_metrics', methods=['GET'])
+@require_admin
+def get_metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
 if __name__ == '__main__':
+    migrate_database()
     app.run(host='0.0.0.0', port=5173)
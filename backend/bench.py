@@ -0,0 +1,305 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Per-route latency benchmark. Builds a synthetic database in a temp
+# directory, logs in a pool of patient, doctor and pharmacist sessions and
+# replays a weighted mix of requests through the Flask test client.
+#
+#   cd backend
+#   python bench.py --patients 10000 --messages-per-conversation 10 --out bench.json
+#   python bench.py ... --compare bench.json   # fail on p95 regressions
+#
+# The data and the request sequence are fixed by --seed, so two runs with
+# the same arguments are comparable.
+
+# (weight, label, method, path template, body)
+PATIENT_MIX = [
+    (2, "GET /api/me", "GET", "/api/me", None),
+    (1, "GET /api/patient/doctor", "GET", "/api/patient/doctor", None),
+    (3, "GET /api/prescriptions", "GET", "/api/prescriptions", None),
+    (3, "GET /api/messages/<patientID>", "GET", "/api/messages/me", None),
+    (1, "POST /api/messages/<patientID>", "POST", "/api/messages/me", "message"),
+]
+DOCTOR_MIX = [
+    (2, "GET /api/doctor/patients", "GET", "/api/doctor/patients", None),
+    (2, "GET /api/profile/<TargetRole>/<userID>", "GET", "/api/profile/patient/{patient}", None),
+    (4, "GET /api/messages/<patientID>", "GET", "/api/messages/{patient}", None),
+    (1, "POST /api/messages/<patientID>", "POST", "/api/messages/{patient}", "message"),
+    (2, "GET /api/prescriptions", "GET", "/api/prescriptions", None),
+]
+PHARMACIST_MIX = [
+    (5, "GET /api/prescriptions", "GET", "/api/prescriptions", None),
+    (1, "GET /api/me", "GET", "/api/me", None),
+]
+SESSION_MIX = [(5, "patient"), (3, "doctor"), (2, "pharmacist")]
+LOGIN_EVERY = 50
+
+
+def build_database(path: Path, args) -> dict:
+    from helpers.synthetic import generate
+
+    conn = sqlite3.connect(path)
+    try:
+        return generate(
+            conn,
+            patients=args.patients,
+            doctors=args.doctors,
+            pharmacies=args.pharmacies,
+            messages_per_conversation=args.messages_per_conversation,
+            prescriptions_per_patient=args.prescriptions_per_patient,
+            seed=args.seed,
+        )
+    finally:
+        conn.close()
+
+
+def _pick(rng: random.Random, weighted):
+    total = sum(weight for weight, *_ in weighted)
+    point = rng.uniform(0, total)
+    for item in weighted:
+        point -= item[0]
+        if point <= 0:
+            return item
+    return weighted[-1]
+
+
+def _login(app, role: str, user_id: str):
+    from helpers.synthetic import GENERATED_PASSWORD, synthetic_email
+
+    client = app.test_client()
+    response = client.post(
+        f"/api/login/{role}",
+        json={"Email": synthetic_email(user_id), "Password": GENERATED_PASSWORD},
+    )
+    if response.status_code != 200:
+        raise RuntimeError(f"Login failed for {role} {user_id}: {response.status_code}")
+    return client
+
+
+def _plan(rng: random.Random, data: dict, count: int, sessions: int):
+    # The whole request sequence is drawn up front so it only depends on the
+    # seed. Requests come from a fixed set of logged-in users per role.
+    doctor_patients = {}
+    for patient, doctor in data["enrolments"].items():
+        doctor_patients.setdefault(doctor, []).append(patient)
+    total_weight = sum(weight for weight, _ in SESSION_MIX)
+    users = {}
+    for weight, role in SESSION_MIX:
+        pool = {
+            "patient": data["patients"],
+            "doctor": [d for d in data["doctors"] if d in doctor_patients],
+            "pharmacist": data["pharmacies"],
+        }[role]
+        wanted = max(1, sessions * weight // total_weight)
+        users[role] = rng.sample(pool, min(wanted, len(pool)))
+    doctors = users["doctor"]
+
+    plan = []
+    for i in range(count):
+        if i % LOGIN_EVERY == LOGIN_EVERY - 1:
+            role = _pick(rng, SESSION_MIX)[1]
+            plan.append(("POST /api/login/<role>", role, rng.choice(users[role]), "POST", f"/api/login/{role}", "login"))
+            continue
+        role = _pick(rng, SESSION_MIX)[1]
+        if role == "patient":
+            user = rng.choice(users["patient"])
+            _, label, method, path, body = _pick(rng, PATIENT_MIX)
+        elif role == "doctor":
+            user = rng.choice(doctors)
+            _, label, method, path, body = _pick(rng, DOCTOR_MIX)
+            path = path.format(patient=rng.choice(doctor_patients[user]))
+        else:
+            user = rng.choice(users["pharmacist"])
+            _, label, method, path, body = _pick(rng, PHARMACIST_MIX)
+        plan.append((label, role, user, method, path, body))
+    return plan
+
+
+def _percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    # Nearest-rank percentile of an already sorted list.
+    index = min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))
+    return values[index]
+
+
+def run(args) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix="medilink-bench-"))
+    try:
+        return _replay(args, workdir)
+    finally:
+        if args.keep:
+            print(f"Benchmark database kept in {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _replay(args, workdir: Path) -> dict:
+    rng = random.Random(args.seed)
+    db_path = workdir / "bench.db"
+    os.environ["MEDILINK_DB_PATH"] = str(db_path)
+    os.environ["MEDILINK_AUDIT_DIR"] = str(workdir / "audit-logs")
+
+    started = time.perf_counter()
+    data = build_database(db_path, args)
+    build_seconds = time.perf_counter() - started
+
+    from app import app
+    from helpers.audit import flush_audit_log
+    from helpers.synthetic import GENERATED_PASSWORD, synthetic_email
+
+    plan = _plan(rng, data, args.requests, args.sessions)
+    sessions = {}
+    sessions_lock = threading.Lock()
+
+    def session_for(role, user):
+        with sessions_lock:
+            client = sessions.get((role, user))
+        if client is None:
+            client = _login(app, role, user)
+            with sessions_lock:
+                sessions[(role, user)] = client
+        return client
+
+    results = {}
+    results_lock = threading.Lock()
+
+    def worker(items):
+        local = {}
+        for label, role, user, method, path, body in items:
+            if body == "login":
+                client = app.test_client()
+                payload = {"Email": synthetic_email(user), "Password": GENERATED_PASSWORD}
+            else:
+                client = session_for(role, user)
+                payload = None
+                if body == "message":
+                    payload = {"message": "Benchmark message", "timestamp": "2025-01-01 12:00:00"}
+            begin = time.perf_counter()
+            response = client.open(path, method=method, json=payload)
+            elapsed = time.perf_counter() - begin
+            response.close()
+            latencies, errors = local.setdefault(label, ([], [0]))
+            latencies.append(elapsed)
+            if response.status_code >= 400:
+                errors[0] += 1
+        with results_lock:
+            for label, (latencies, errors) in local.items():
+                merged = results.setdefault(label, ([], [0]))
+                merged[0].extend(latencies)
+                merged[1][0] += errors[0]
+
+    # Warm up: log every session in before timing starts.
+    for label, role, user, method, path, body in plan:
+        if body != "login":
+            session_for(role, user)
+
+    chunks = [plan[i::args.concurrency] for i in range(args.concurrency)]
+    threads = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    flush_audit_log()
+
+    routes = {}
+    for label, (latencies, errors) in sorted(results.items()):
+        latencies.sort()
+        routes[label] = {
+            "count": len(latencies),
+            "errors": errors[0],
+            "throughput_rps": round(len(latencies) / wall, 2),
+            "mean_ms": round(1000 * sum(latencies) / len(latencies), 3),
+            "p50_ms": round(1000 * _percentile(latencies, 0.50), 3),
+            "p95_ms": round(1000 * _percentile(latencies, 0.95), 3),
+            "p99_ms": round(1000 * _percentile(latencies, 0.99), 3),
+        }
+
+    return {
+        "config": {
+            "seed": args.seed,
+            "patients": args.patients,
+            "doctors": args.doctors,
+            "pharmacies": args.pharmacies,
+            "messages_per_conversation": args.messages_per_conversation,
+            "prescriptions_per_patient": args.prescriptions_per_patient,
+            "requests": args.requests,
+            "sessions": args.sessions,
+            "concurrency": args.concurrency,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+        },
+        "build_seconds": round(build_seconds, 2),
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(plan) / wall, 2),
+        "routes": routes,
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    if result["config"] != baseline.get("config"):
+        regressions.append("config differs from baseline, results are not comparable")
+        return regressions
+    for label, stats in result["routes"].items():
+        before = baseline["routes"].get(label)
+        if before is None or before["p95_ms"] <= 0:
+            continue
+        change = stats["p95_ms"] / before["p95_ms"] - 1
+        if change > tolerance:
+            regressions.append(
+                f"{label}: p95 {before['p95_ms']}ms -> {stats['p95_ms']}ms (+{change:.0%})"
+            )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="MediLink per-route latency benchmark")
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--doctors", type=int, default=20)
+    parser.add_argument("--pharmacies", type=int, default=10)
+    parser.add_argument("--messages-per-conversation", type=int, default=10)
+    parser.add_argument("--prescriptions-per-patient", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--sessions", type=int, default=100, help="logged-in users replaying requests")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="write the JSON report here as well as stdout")
+    parser.add_argument("--compare", help="baseline JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 increase, default 20%%")
+    parser.add_argument("--keep", action="store_true", help="keep the temp directory with the database and audit logs")
+    args = parser.parse_args()
+
+    result = run(args)
+    report = json.dumps(result, indent=2)
+    print(report)
+    if args.out:
+        Path(args.out).write_text(report + "\n", encoding="utf-8")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        regressions = compare(result, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+import os
+
+# Production server settings; run from backend/ with
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#
+#   MEDILINK_BIND              address to listen on
+#   MEDILINK_WORKERS           worker processes
+#   MEDILINK_THREADS           request threads per worker
+#   MEDILINK_GRACEFUL_TIMEOUT  seconds in-flight requests get to finish on
+#                              shutdown or reload before workers are killed
+#
+# The app is imported once in the master (migrations run there, before any
+# worker exists) and the workers are forked from it. SIGHUP replaces the
+# workers gracefully; SIGTERM drains them and exits. With preload, a HUP
+# does not pick up code changes: send USR2 to start a new master instead.
+
+bind = os.environ.get("MEDILINK_BIND", "0.0.0.0:5173")
+workers = int(os.environ.get("MEDILINK_WORKERS", str(min(2 * (os.cpu_count() or 1) + 1, 8))))
+threads = int(os.environ.get("MEDILINK_THREADS", "8"))
+# Read by the app to size the hashing pool and the stream limit.
+os.environ["MEDILINK_WORKERS"] = str(workers)
+os.environ["MEDILINK_THREADS"] = str(threads)
+worker_class = "gthread"
+preload_app = True
+graceful_timeout = float(os.environ.get("MEDILINK_GRACEFUL_TIMEOUT", "30"))
+# Long polls and message streams occupy a thread, not the worker, so they
+# do not trip the worker timeout; streams still open when the graceful
+# timeout runs out are cut and the client reconnects. Streams are capped at
+# MEDILINK_STREAM_LIMIT per worker (half the threads by default) so the rest
+# stay free for ordinary requests.
+timeout = 30
+keepalive = 5
+
+
+def worker_exit(server, worker):
+    # Write out audit entries still queued in the exiting worker and close
+    # its database connections.
+    from helpers.audit import shutdown_audit_log
+    from helpers.db import close_pool
+
+    shutdown_audit_log()
+    close_pool()
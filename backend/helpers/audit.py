@@ -1,35 +1,267 @@
+import atexit
+import os
+import queue
+import threading
+import time
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, List, Optional, Tuple
 
+from helpers.audit_store import (
+    is_unlinked,
+    locked,
+    query_segments,
+    seal_segment,
+    seal_stale_segments,
+    segment_key,
+    segment_path,
+)
 
 _BASE_DIR = Path(__file__).resolve().parent.parent
-_AUDIT_DIR = _BASE_DIR.parent / "database" / "audit-logs"
+_AUDIT_DIR = Path(os.environ.get("MEDILINK_AUDIT_DIR", _BASE_DIR.parent / "database" / "audit-logs"))
+# Pre-segment logs; no longer written, but still searched by query_audit_log.
 _AUDIT_FILES = {
     "patient": _AUDIT_DIR / "patientLog.json",
     "doctor": _AUDIT_DIR / "doctorLog.json",
     "pharmacist": _AUDIT_DIR / "pharmacyLog.json",
 }
+_AUDIT_DIRS = {
+    "patient": _AUDIT_DIR / "patient",
+    "doctor": _AUDIT_DIR / "doctor",
+    "pharmacist": _AUDIT_DIR / "pharmacy",
+}
 
+# Entries are queued by the request thread and written in batches by one
+# background thread per process that keeps the log files open. Each batch
+# is appended with a single locked write, so lines from different worker
+# processes never interleave (see helpers.audit_store).
+#   MEDILINK_AUDIT_FLUSH_INTERVAL  seconds a batch may wait before it is written
+#   MEDILINK_AUDIT_QUEUE_SIZE      entries held before callers block
+#   MEDILINK_AUDIT_DURABILITY      "batch" flushes each batch to the OS,
+#                                  "fsync" also fsyncs it, "sync" writes inline
+AUDIT_FLUSH_INTERVAL = float(os.environ.get("MEDILINK_AUDIT_FLUSH_INTERVAL", "0.5"))
+AUDIT_QUEUE_SIZE = int(os.environ.get("MEDILINK_AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_DURABILITY = os.environ.get("MEDILINK_AUDIT_DURABILITY", "batch")
+AUDIT_BATCH_SIZE = 500
 
-def append_audit_log(role: Optional[str], user_id: Optional[str], route: str, success: bool) -> bool:
-    if not role or not user_id or not route:
-        return False
+_queue: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=AUDIT_QUEUE_SIZE)
+_writer: Optional[threading.Thread] = None
+_writer_pid: Optional[int] = None
+_writer_lock = threading.Lock()
+_handles: Dict[str, Tuple[str, Path, int]] = {}
+_metrics_lock = threading.Lock()
+_metrics = {
+    "enqueued": 0,
+    "written": 0,
+    "batches": 0,
+    "blocked": 0,
+    "blocked_seconds": 0.0,
+    "max_queue_depth": 0,
+    "write_errors": 0,
+}
 
-    path = _AUDIT_FILES.get(role)
-    if path is None:
-        return False
 
-    entry = (
+def _format_entry(user_id: str, route: str, success: bool) -> str:
+    return (
         "{"
         f"\"route\":\"{route}\","
         f"\"userID\":\"{user_id}\","
         f"\"success\":{str(bool(success)).lower()},"
         f"\"time\":\"{datetime.now(timezone.utc).isoformat()}\""
-        "}"
+        "}\n"
     )
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("a", encoding="utf-8") as handle:
-        handle.write(entry)
-        handle.write("\n")
+
+
+def _close_handle(role: str) -> None:
+    _, _, fd = _handles.pop(role)
+    os.close(fd)
+
+
+def _handle_for(role: str) -> int:
+    # Segments are chosen by write time; when the segment period rolls over
+    # the old file is closed, compressed and indexed.
+    key = segment_key()
+    current = _handles.get(role)
+    if current is not None and current[0] == key:
+        return current[2]
+    role_dir = _AUDIT_DIRS[role]
+    if current is not None:
+        _close_handle(role)
+        seal_segment(current[1])
+    else:
+        role_dir.mkdir(parents=True, exist_ok=True)
+        seal_stale_segments(role_dir, key)
+    path = segment_path(role_dir, key)
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    _handles[role] = (key, path, fd)
+    return fd
+
+
+def _append(role: str, data: bytes) -> None:
+    while True:
+        fd = _handle_for(role)
+        with locked(fd):
+            # Sealed by another worker since we opened it: reopen and retry.
+            if is_unlinked(fd):
+                _close_handle(role)
+                continue
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+            if AUDIT_DURABILITY == "fsync":
+                os.fsync(fd)
+        return
+
+
+def _write_batch(batch) -> None:
+    lines: Dict[str, list] = {}
+    for role, line in batch:
+        lines.setdefault(role, []).append(line)
+    for role, path_lines in lines.items():
+        try:
+            _append(role, "".join(path_lines).encode("utf-8"))
+        except OSError:
+            with _metrics_lock:
+                _metrics["write_errors"] += 1
+            continue
+        with _metrics_lock:
+            _metrics["written"] += len(path_lines)
+    with _metrics_lock:
+        _metrics["batches"] += 1
+
+
+def _writer_loop() -> None:
+    running = True
+    while running:
+        try:
+            item = _queue.get(timeout=AUDIT_FLUSH_INTERVAL)
+        except queue.Empty:
+            continue
+        batch = []
+        taken = 1
+        # Give a burst a moment to accumulate, then drain what is waiting.
+        deadline = time.monotonic() + AUDIT_FLUSH_INTERVAL
+        while True:
+            if item is None:
+                running = False
+            else:
+                batch.append(item)
+            if not running or len(batch) >= AUDIT_BATCH_SIZE:
+                break
+            try:
+                item = _queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            taken += 1
+        if batch:
+            _write_batch(batch)
+        for _ in range(taken):
+            _queue.task_done()
+    for role in list(_handles):
+        _close_handle(role)
+
+
+def _reset_after_fork() -> None:
+    # A forked worker inherits the parent's queue and open segments but not
+    # its writer thread. Entries queued in the parent are the parent's to
+    # write, and the segment descriptors must be reopened: a flock is shared
+    # by every process holding the same open file.
+    global _queue, _writer, _writer_pid
+    for _, _, fd in _handles.values():
+        os.close(fd)
+    _handles.clear()
+    _queue = queue.Queue(maxsize=AUDIT_QUEUE_SIZE)
+    _writer = None
+    _writer_pid = os.getpid()
+
+
+def _ensure_writer() -> None:
+    global _writer
+    if _writer is not None and _writer_pid == os.getpid() and _writer.is_alive():
+        return
+    with _writer_lock:
+        if _writer_pid != os.getpid():
+            _reset_after_fork()
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_writer_loop, name="audit-writer", daemon=True)
+            _writer.start()
+
+
+def append_audit_log(role: Optional[str], user_id: Optional[str], route: str, success: bool) -> bool:
+    if not role or not user_id or not route:
+        return False
+
+    if role not in _AUDIT_DIRS:
+        return False
+
+    item = (role, _format_entry(user_id, route, success))
+    if AUDIT_DURABILITY == "sync":
+        with _writer_lock:
+            if _writer_pid != os.getpid():
+                _reset_after_fork()
+            _write_batch([item])
+        return True
+
+    _ensure_writer()
+    try:
+        _queue.put_nowait(item)
+    except queue.Full:
+        # Back-pressure: wait for the writer rather than drop the entry.
+        started = time.monotonic()
+        _queue.put(item)
+        with _metrics_lock:
+            _metrics["blocked"] += 1
+            _metrics["blocked_seconds"] += time.monotonic() - started
+    with _metrics_lock:
+        _metrics["enqueued"] += 1
+        _metrics["max_queue_depth"] = max(_metrics["max_queue_depth"], _queue.qsize())
     return True
+
+
+def flush_audit_log() -> None:
+    if _writer is not None and _writer_pid == os.getpid() and _writer.is_alive():
+        _queue.join()
+
+
+def shutdown_audit_log(timeout: float = 10.0) -> None:
+    global _writer
+    writer = _writer
+    if writer is None or _writer_pid != os.getpid() or not writer.is_alive():
+        return
+    _queue.put(None)
+    writer.join(timeout)
+    _writer = None
+
+
+def audit_metrics() -> Dict[str, float]:
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    metrics["queue_depth"] = _queue.qsize()
+    metrics["queue_capacity"] = AUDIT_QUEUE_SIZE
+    return metrics
+
+
+def query_audit_log(
+    role: str,
+    user_id: Optional[str] = None,
+    route: Optional[str] = None,
+    since: Any = None,
+    until: Any = None,
+    limit: int = 1000,
+) -> List[Dict[str, Any]]:
+    if role not in _AUDIT_DIRS:
+        raise ValueError("Invalid role")
+    # Make sure entries queued before the query are on disk.
+    flush_audit_log()
+    return query_segments(
+        _AUDIT_DIRS[role],
+        _AUDIT_FILES[role],
+        user_id=user_id,
+        route=route,
+        since=since,
+        until=until,
+        limit=limit,
+    )
+
+
+atexit.register(shutdown_audit_log)
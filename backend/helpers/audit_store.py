@@ -0,0 +1,240 @@
+import gzip
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the single-process dev server runs there.
+    fcntl = None
+
+# Audit logs are stored per role as time-based segments:
+#   <role>/<YYYYMMDDTHHMMSS>.json      the open segment, plain NDJSON
+#   <role>/<YYYYMMDDTHHMMSS>.json.gz   a sealed segment
+#   <role>/<YYYYMMDDTHHMMSS>.idx.json  its sidecar index
+# The index records the time range, entry count and per-user and per-route
+# counts, so queries only open segments that can contain a match.
+#
+# Several worker processes append to the same open segment. Each batch is
+# one O_APPEND write made under an exclusive flock on the segment, and a
+# segment is sealed under the same lock, so a writer that was waiting for it
+# sees the file unlinked and moves on to a fresh one.
+
+SEGMENT_SECONDS = int(os.environ.get("MEDILINK_AUDIT_SEGMENT_SECONDS", "3600"))
+_KEY_FORMAT = "%Y%m%dT%H%M%S"
+
+
+def segment_key(now: Optional[float] = None) -> str:
+    now = time.time() if now is None else now
+    start = int(now // SEGMENT_SECONDS) * SEGMENT_SECONDS
+    return datetime.fromtimestamp(start, timezone.utc).strftime(_KEY_FORMAT)
+
+
+def segment_path(role_dir: Path, key: str) -> Path:
+    return role_dir / f"{key}.json"
+
+
+def _index_path(data_path: Path) -> Path:
+    name = data_path.name
+    for suffix in (".json.gz", ".json"):
+        if name.endswith(suffix):
+            name = name[: -len(suffix)]
+            break
+    return data_path.with_name(f"{name}.idx.json")
+
+
+def _read_lines(path: Path) -> Iterator[str]:
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "rt", encoding="utf-8") as handle:
+        for line in handle:
+            if line.strip():
+                yield line
+
+
+def build_index(path: Path) -> Dict[str, Any]:
+    index: Dict[str, Any] = {"start": None, "end": None, "count": 0, "users": {}, "routes": {}}
+    for line in _read_lines(path):
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        entry_time = entry.get("time")
+        if entry_time:
+            if index["start"] is None or entry_time < index["start"]:
+                index["start"] = entry_time
+            if index["end"] is None or entry_time > index["end"]:
+                index["end"] = entry_time
+        user_id = entry.get("userID")
+        route = entry.get("route")
+        index["users"][user_id] = index["users"].get(user_id, 0) + 1
+        index["routes"][route] = index["routes"].get(route, 0) + 1
+        index["count"] += 1
+    return index
+
+
+def _write_json_atomic(path: Path, data: Any) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w", encoding="utf-8") as handle:
+        json.dump(data, handle)
+    os.replace(tmp, path)
+
+
+@contextmanager
+def locked(fd: int) -> Iterator[None]:
+    if fcntl is None:
+        yield
+        return
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def is_unlinked(fd: int) -> bool:
+    return os.fstat(fd).st_nlink == 0
+
+
+def seal_segment(path: Path) -> Optional[Path]:
+    # Compress a closed segment and write its index. The gzip and index are
+    # written to temp names first, so a crash never leaves half a segment.
+    # Returns None if another process sealed it first. Entries appended after
+    # an earlier seal are added to the existing .gz as another gzip member.
+    sealed = path.with_name(path.name + ".gz")
+    tmp = sealed.with_name(sealed.name + ".tmp")
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    try:
+        with locked(fd):
+            if is_unlinked(fd):
+                return None
+            with open(tmp, "wb") as target:
+                if sealed.exists():
+                    with sealed.open("rb") as previous:
+                        shutil.copyfileobj(previous, target)
+                with os.fdopen(os.dup(fd), "rb") as source, gzip.GzipFile(fileobj=target, mode="wb") as member:
+                    shutil.copyfileobj(source, member, 1 << 20)
+            os.replace(tmp, sealed)
+            _write_json_atomic(_index_path(sealed), build_index(sealed))
+            path.unlink()
+    finally:
+        os.close(fd)
+    return sealed
+
+
+def seal_stale_segments(role_dir: Path, current_key: str) -> None:
+    if not role_dir.is_dir():
+        return
+    for path in sorted(role_dir.glob("*.json")):
+        if path.name.endswith(".idx.json"):
+            continue
+        if path.stem < current_key:
+            seal_segment(path)
+
+
+def _load_index(data_path: Path) -> Optional[Dict[str, Any]]:
+    index_path = _index_path(data_path)
+    try:
+        with index_path.open("r", encoding="utf-8") as handle:
+            return json.load(handle)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _segment_matches(
+    index: Optional[Dict[str, Any]],
+    user_id: Optional[str],
+    route: Optional[str],
+    since: Optional[str],
+    until: Optional[str],
+) -> bool:
+    if index is None:
+        return True
+    if index["count"] == 0:
+        return False
+    if user_id is not None and user_id not in index["users"]:
+        return False
+    if route is not None and route not in index["routes"]:
+        return False
+    if since is not None and index["end"] is not None and index["end"] < since:
+        return False
+    if until is not None and index["start"] is not None and index["start"] > until:
+        return False
+    return True
+
+
+def _normalise_time(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat()
+
+
+def query_segments(
+    role_dir: Path,
+    legacy_file: Optional[Path],
+    user_id: Optional[str] = None,
+    route: Optional[str] = None,
+    since: Any = None,
+    until: Any = None,
+    limit: int = 1000,
+) -> List[Dict[str, Any]]:
+    since = _normalise_time(since)
+    until = _normalise_time(until)
+
+    segments: List[Path] = []
+    if legacy_file is not None and legacy_file.exists():
+        # The pre-segment log file is indexed once, then pruned like the rest.
+        if _load_index(legacy_file) is None:
+            _write_json_atomic(_index_path(legacy_file), build_index(legacy_file))
+        segments.append(legacy_file)
+    if role_dir.is_dir():
+        segments.extend(
+            sorted(
+                path for path in role_dir.iterdir()
+                if path.name.endswith((".json", ".json.gz")) and not path.name.endswith(".idx.json")
+            )
+        )
+
+    needle = f"\"userID\":\"{user_id}\"" if user_id is not None else None
+    results: List[Dict[str, Any]] = []
+    for path in segments:
+        open_segment = path.suffix == ".json" and path != legacy_file
+        index = None if open_segment else _load_index(path)
+        if not _segment_matches(index, user_id, route, since, until):
+            continue
+        try:
+            lines = list(_read_lines(path))
+        except FileNotFoundError:
+            # Sealed between listing and reading; the .gz is picked up next time.
+            continue
+        for line in lines:
+            if needle is not None and needle not in line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if user_id is not None and entry.get("userID") != user_id:
+                continue
+            if route is not None and entry.get("route") != route:
+                continue
+            entry_time = entry.get("time") or ""
+            if since is not None and entry_time < since:
+                continue
+            if until is not None and entry_time > until:
+                continue
+            results.append(entry)
+            if len(results) >= limit:
+                return results
+    return results
@@ -2,8 +2,15 @@ import json
 import random
 import string
 
-from werkzeug.security import check_password_hash, generate_password_hash
-from helpers.db import get_db, ROLE_ID_COLUMN
+from helpers.db import get_db, index_patient, invalidate_profile, ROLE_ID_COLUMN
+from helpers.ids import next_id
+from helpers.passwords import HashingUnavailable, hash_password, needs_rehash, verify_password
+from helpers.versions import bump_versions, patient_list_resource
+
+LOGIN_SQL = "SELECT * FROM {table} WHERE email = ?"
+EMAIL_TAKEN_SQL = "SELECT 1 FROM {table} WHERE Email = ? LIMIT 1"
+DOCTOR_EXISTS_SQL = "SELECT 1 FROM Doctors WHERE doctorID = ? LIMIT 1"
+REHASH_SQL = "UPDATE {table} SET PasswordHash = ? WHERE {id_column} = ? AND PasswordHash = ?"
 
 def login_user(email:str, password:str, role: str):
     db = get_db()
@@ -18,39 +25,42 @@ def login_user(email:str, password:str, role: str):
     if not table:
         return None
     
-    user = db.execute(
-        f"SELECT * FROM {table} WHERE email = ?", (email,)
-    ).fetchone()
+    user = db.execute(LOGIN_SQL.format(table=table), (email,)).fetchone()
 
-    if user and check_password_hash(user["PasswordHash"], password):
+    if user and verify_password(user["PasswordHash"], password):
+        if needs_rehash(user["PasswordHash"]):
+            _upgrade_password_hash(table, role, user, password)
         return dict(user)
     return None
 
 
+def _upgrade_password_hash(table: str, role: str, user, password: str) -> None:
+    # The KDF settings changed since this hash was stored; replace it while
+    # we have the plaintext. A failure here must not fail the login.
+    id_column = ROLE_ID_COLUMN[role]
+    try:
+        new_hash = hash_password(password)
+    except HashingUnavailable:
+        return
+    db = get_db()
+    db.execute(
+        REHASH_SQL.format(table=table, id_column=id_column),
+        (new_hash, user[id_column], user["PasswordHash"]),
+    )
+    db.commit()
+
+
 def _name_prefix(_: str) -> str:
     return "".join(random.choice(string.ascii_uppercase) for _ in range(2))
 
 
 def _next_user_id(table: str, id_column: str, prefix: str) -> str:
-    db = get_db()
-    row = db.execute(
-        f"""
-        SELECT MAX(CAST(SUBSTR({id_column}, 3) AS INTEGER)) AS max_num
-        FROM {table}
-        WHERE {id_column} LIKE ?
-        """,
-        (f"{prefix}%",),
-    ).fetchone()
-    next_num = (row["max_num"] or 0) + 1
-    return f"{prefix}{next_num:05d}"
+    return next_id(table, id_column, prefix)
 
 
 def _doctor_exists(doctor_id: str) -> bool:
     db = get_db()
-    row = db.execute(
-        "SELECT 1 FROM Doctors WHERE doctorID = ? LIMIT 1",
-        (doctor_id,),
-    ).fetchone()
+    row = db.execute(DOCTOR_EXISTS_SQL, (doctor_id,)).fetchone()
     return row is not None
 
 
@@ -73,17 +83,14 @@ def register_user(data: dict, role: str):
             return None, "Invalid doctorID", 400
 
     db = get_db()
-    existing = db.execute(
-        f"SELECT 1 FROM {table} WHERE Email = ? LIMIT 1",
-        (email,),
-    ).fetchone()
+    existing = db.execute(EMAIL_TAKEN_SQL.format(table=table), (email,)).fetchone()
     if existing:
         return None, "Email already registered", 409
 
     prefix = _name_prefix(name)
     id_column = ROLE_ID_COLUMN[role]
     user_id = _next_user_id(table, id_column, prefix)
-    password_hash = generate_password_hash(password)
+    password_hash = hash_password(password)
 
     if role == "patient":
         patient_history = data.get("PatientHistory")
@@ -127,15 +134,18 @@ def register_user(data: dict, role: str):
         if role == "patient":
             db.execute(
                 """
-                INSERT INTO DPEnrole (doctorID, patientID, msgHistory)
-                VALUES (?, ?, ?)
+                INSERT INTO DPEnrole (doctorID, patientID)
+                VALUES (?, ?)
                 """,
-                (data.get("doctorID"), user_id, json.dumps([])),
+                (data.get("doctorID"), user_id),
             )
+            index_patient(db, user_id)
+            bump_versions(db, [patient_list_resource(data.get("doctorID"))])
         db.commit()
     except Exception:
         db.rollback()
         return None, "Registration failed", 500
 
+    invalidate_profile(role, user_id, email)
     safe_user = {k: v for k, v in zip(insert_columns, insert_values) if k != "PasswordHash"}
     return safe_user, None, 201
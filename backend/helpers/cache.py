@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+
+
+class LRUCache:
+    # Thread-safe LRU cache whose entries also expire `ttl` seconds after
+    # they were stored.
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class PageCache:
+    # LRU cache of serialized pages bounded by total bytes rather than entry
+    # count. Entries are grouped by an owner key (a conversation) so all of
+    # an owner's pages can be dropped at once. With encrypt=True each value
+    # is sealed with AES-GCM under a key that only exists in this process.
+
+    def __init__(self, max_bytes: int, encrypt: bool = False):
+        self.max_bytes = max_bytes
+        self.encrypt = encrypt
+        self._key = get_random_bytes(32) if encrypt else None
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._owners: Dict[Hashable, set] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _seal(self, value: bytes) -> bytes:
+        nonce = get_random_bytes(12)
+        cipher = AES.new(self._key, AES.MODE_GCM, nonce=nonce)
+        ciphertext, tag = cipher.encrypt_and_digest(value)
+        return nonce + tag + ciphertext
+
+    def _open(self, value: bytes) -> bytes:
+        cipher = AES.new(self._key, AES.MODE_GCM, nonce=value[:12])
+        return cipher.decrypt_and_verify(value[28:], value[12:28])
+
+    def _remove(self, key: Hashable) -> None:
+        value = self._entries.pop(key)
+        self.bytes -= len(value)
+        owner_keys = self._owners.get(key[0])
+        if owner_keys is not None:
+            owner_keys.discard(key)
+            if not owner_keys:
+                del self._owners[key[0]]
+
+    def get(self, owner: Hashable, key: Hashable) -> Optional[bytes]:
+        full_key = (owner, key)
+        with self._lock:
+            value = self._entries.get(full_key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(full_key)
+            self.hits += 1
+        return self._open(value) if self.encrypt else value
+
+    def set(self, owner: Hashable, key: Hashable, value: bytes) -> None:
+        if self.encrypt:
+            value = self._seal(value)
+        if len(value) > self.max_bytes:
+            return
+        full_key = (owner, key)
+        with self._lock:
+            if full_key in self._entries:
+                self._remove(full_key)
+            self._entries[full_key] = value
+            self._owners.setdefault(owner, set()).add(full_key)
+            self.bytes += len(value)
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, owner: Hashable) -> None:
+        with self._lock:
+            for full_key in list(self._owners.get(owner, ())):
+                self._remove(full_key)
+                self.invalidations += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "encrypted": self.encrypt,
+            }
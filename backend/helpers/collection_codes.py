@@ -0,0 +1,37 @@
+import hashlib
+import hmac
+import os
+import random
+import sqlite3
+
+# Prescriptions are found from the code a patient presents through
+# CollectionCodeHash, an HMAC of the pharmID and the code, indexed with
+# pharmID (migration 9). Every write of CollectionCode must also write the
+# hash. Changing MEDILINK_COLLECTION_CODE_KEY invalidates the stored hashes:
+# clear the column and run hash_missing_collection_codes after a change.
+
+COLLECTION_CODE_KEY = os.environ.get(
+    "MEDILINK_COLLECTION_CODE_KEY", "ThisIsACollectionCodeKey"
+).encode("utf-8")
+
+
+def new_collection_code() -> str:
+    return f"{random.randint(0, 999999):06d}"
+
+
+def collection_code_hash(pharm_id: str, collection_code: str) -> bytes:
+    message = f"{pharm_id}\0{collection_code}".encode("utf-8")
+    return hmac.new(COLLECTION_CODE_KEY, message, hashlib.sha256).digest()
+
+
+def hash_missing_collection_codes(conn: sqlite3.Connection) -> int:
+    # Fills in CollectionCodeHash for rows written without it (migration
+    # backfill, sample data). Does not commit.
+    rows = conn.execute(
+        "SELECT prescriptionID, pharmID, CollectionCode FROM Prescriptions WHERE CollectionCodeHash IS NULL"
+    ).fetchall()
+    conn.executemany(
+        "UPDATE Prescriptions SET CollectionCodeHash = ? WHERE prescriptionID = ?",
+        [(collection_code_hash(pharm_id, code), prescription_id) for prescription_id, pharm_id, code in rows],
+    )
+    return len(rows)
@@ -1,24 +1,214 @@
+import atexit
+import os
+import queue
 import sqlite3
+import threading
+import time
 from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
 from flask import g
 
+from helpers.cache import LRUCache
+from helpers.metrics import note_sql_time, note_statement
+from helpers.slow_queries import SLOW_QUERY_SECONDS, record_slow_query
+from helpers.versions import bump_versions, patient_list_resource, profile_resource, profile_resource_sql
+
 BASE_DIR = Path(__file__).resolve().parent.parent
-DB_PATH = BASE_DIR.parent / "database" / "MediLink.db"
+DB_PATH = Path(os.environ.get("MEDILINK_DB_PATH", BASE_DIR.parent / "database" / "MediLink.db"))
+
+DB_POOL_SIZE = int(os.environ.get("MEDILINK_DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.environ.get("MEDILINK_DB_POOL_TIMEOUT", "5"))
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("MEDILINK_DB_STATEMENT_CACHE_SIZE", "256"))
+# Idle connections older than this are checked with SELECT 1 before reuse.
+DB_HEALTH_CHECK_SECONDS = 30.0
+
+PROFILE_CACHE_SIZE = int(os.environ.get("MEDILINK_PROFILE_CACHE_SIZE", "10000"))
+PROFILE_CACHE_TTL = float(os.environ.get("MEDILINK_PROFILE_CACHE_TTL", "60"))
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class _TimedConnection(sqlite3.Connection):
+    # Times statements run through the connection's execute helpers, which
+    # is how the helpers query. The time includes stepping to the first
+    # row, not fetching the rest. Statements over the slow-query threshold
+    # are handed to helpers.slow_queries.
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            cursor = super().execute(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            note_sql_time(elapsed)
+        if SLOW_QUERY_SECONDS is not None and elapsed >= SLOW_QUERY_SECONDS:
+            record_slow_query(self, sql, parameters, elapsed)
+        return cursor
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        if SLOW_QUERY_SECONDS is not None and not isinstance(seq_of_parameters, list):
+            seq_of_parameters = list(seq_of_parameters)
+        try:
+            cursor = super().executemany(sql, seq_of_parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            note_sql_time(elapsed)
+        if SLOW_QUERY_SECONDS is not None and elapsed >= SLOW_QUERY_SECONDS and seq_of_parameters:
+            record_slow_query(self, sql, seq_of_parameters[0], elapsed, rows=len(seq_of_parameters))
+        return cursor
+
+
+class ConnectionPool:
+    def __init__(self, size: int, timeout: float):
+        self.size = size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._pid = os.getpid()
+        self._idle: "queue.LifoQueue[tuple]" = queue.LifoQueue()
+        self._created = 0
+        self.metrics: Dict[str, float] = {
+            "created": 0,
+            "borrowed": 0,
+            "discarded": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "timeouts": 0,
+        }
+
+    def _count(self, name: str, amount: float = 1) -> None:
+        with self._lock:
+            self.metrics[name] += amount
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            DB_PATH,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE_SIZE,
+            factory=_TimedConnection,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.set_trace_callback(note_statement)
+        conn.execute("PRAGMA foreign_keys = ON;")
+        conn.execute("PRAGMA busy_timeout = 5000;")
+        self._count("created")
+        return conn
+
+    def _healthy(self, conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn: sqlite3.Connection) -> None:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+            self.metrics["discarded"] += 1
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            # Connections must not cross a fork; start a fresh pool in the child.
+            if self._pid != os.getpid():
+                self._reset()
+        while True:
+            try:
+                conn, returned_at = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        conn = self._connect()
+                    except sqlite3.Error:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                    self._count("borrowed")
+                    return conn
+                started = time.monotonic()
+                self._count("waits")
+                try:
+                    conn, returned_at = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    self._count("timeouts")
+                    raise PoolExhausted("No database connection available")
+                finally:
+                    self._count("wait_seconds", time.monotonic() - started)
+            if time.monotonic() - returned_at > DB_HEALTH_CHECK_SECONDS and not self._healthy(conn):
+                self._discard(conn)
+                continue
+            self._count("borrowed")
+            return conn
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        if self._pid != os.getpid():
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        self._idle.put((conn, time.monotonic()))
 
+    def close_all(self) -> None:
+        # Closes the idle connections; ones still borrowed are closed when
+        # they come back. Connections inherited over a fork are left alone.
+        if self._pid != os.getpid():
+            return
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self) -> Dict[str, float]:
+        stats = dict(self.metrics)
+        idle = self._idle.qsize()
+        stats["size"] = self.size
+        stats["open"] = self._created
+        stats["idle"] = idle
+        stats["in_use"] = self._created - idle
+        return stats
+
+
+_pool = ConnectionPool(DB_POOL_SIZE, DB_POOL_TIMEOUT)
 
 
 def get_db():
     if "db" not in g:
-        g.db = sqlite3.connect(DB_PATH)
-        g.db.row_factory = sqlite3.Row
-        g.db.execute("PRAGMA foreign_keys = ON;")
-    return g.db 
+        g.db = _pool.acquire()
+    return g.db
 
 
 def close_db(e=None):
     db = g.pop("db", None)
     if db is not None:
-        db.close()
+        _pool.release(db)
+
+
+def db_pool_stats() -> Dict[str, float]:
+    return _pool.stats()
+
+
+def close_pool() -> None:
+    _pool.close_all()
+
+
+atexit.register(close_pool)
 
 
 ROLE_ID_COLUMN = {
@@ -33,36 +223,187 @@ TABLE_ID_COLUMN = {
     "Pharmacies": "pharmID"
 }
 
+ROLE_TABLE = {
+    "patient": "Patients",
+    "doctor": "Doctors",
+    "pharmacist": "Pharmacies"
+}
+
+TABLE_ROLE = {table: role for role, table in ROLE_TABLE.items()}
+
+# Redacted profiles keyed by (role, id), stored with the profile's resource
+# version (helpers/versions.py) read in the same statement as the row. Email
+# lookups are cached as (role, "email", email) -> id pointers, so
+# invalidating the id entry is enough to drop both. Another worker's write
+# only clears this process's entry when it expires, so callers that tag a
+# response with the current version pass it in and a cached entry with any
+# other version is reloaded.
+_profile_cache = LRUCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL)
 
-def user_info(userID, role):
-    db = get_db()
 
-    table_map = {
-        "patient": "Patients",
-        "doctor": "Doctors",
-        "pharmacist": "Pharmacies"
-    }
+def _redact_user(row) -> Dict[str, Any]:
+    return {k: v for k, v in dict(row).items() if k not in ("PasswordHash", "_version")}
 
-    table = table_map.get(role)
+
+def _cache_profile(role: str, profile: Dict[str, Any], version: int) -> None:
+    user_id = profile[ROLE_ID_COLUMN[role]]
+    _profile_cache.set((role, user_id), (version, profile))
+    if profile.get("Email"):
+        _profile_cache.set((role, "email", profile["Email"]), user_id)
+
+
+def _cached_profile(role: str, user_id: str, version: Optional[int]) -> Optional[Dict[str, Any]]:
+    cached = _profile_cache.get((role, user_id))
+    if cached is None or (version is not None and cached[0] != version):
+        return None
+    return cached[1]
+
+
+# The SQL the helpers run is kept in module constants and builders, which
+# helpers/query_plans.py checks, so the checked statements are the ones
+# that run.
+
+def user_info_sql(role: str, column: str) -> str:
+    # A profile with its version, by id or Email column.
+    table = ROLE_TABLE[role]
+    id_column = ROLE_ID_COLUMN[role]
+    return f"""
+        SELECT {table}.*, (
+            SELECT version FROM ResourceVersions
+            WHERE name = {profile_resource_sql(role, f"{table}.{id_column}")}
+        ) AS _version
+        FROM {table}
+        WHERE {table}.{column} = ?
+    """
+
+
+def invalidate_profile(role: str, userID: str, email: Optional[str] = None) -> None:
+    _profile_cache.delete((role, userID))
+    if email:
+        _profile_cache.delete((role, "email", email))
+
+
+def profile_cache_stats() -> Dict[str, float]:
+    return _profile_cache.stats()
+
+
+def user_info(userID, role, version: Optional[int] = None):
+    # With `version`, only a cached profile stored at that version is used.
+    table = ROLE_TABLE.get(role)
     id_column = ROLE_ID_COLUMN.get(role)
+    if table is None:
+        return None
+
+    cached = _cached_profile(role, userID, version)
+    if cached is None and isinstance(userID, str) and "@" in userID:
+        cached_id = _profile_cache.get((role, "email", userID))
+        if cached_id is not None:
+            cached = _cached_profile(role, cached_id, version)
+            # The pointer outlives an email change; only trust a match.
+            if cached is not None and cached.get("Email") != userID:
+                cached = None
+    if cached is not None:
+        return dict(cached)
 
-    user = db.execute(
-        f"SELECT * FROM {table} WHERE {id_column} = ?", (userID,)
-    ).fetchone()
+    db = get_db()
+    user = db.execute(user_info_sql(role, id_column), (userID,)).fetchone()
 
     if not user and isinstance(userID, str) and "@" in userID:
-        user = db.execute(
-            f"SELECT * FROM {table} WHERE Email = ?", (userID,)
-        ).fetchone()
+        user = db.execute(user_info_sql(role, "Email"), (userID,)).fetchone()
 
     if not user:
         return None
 
-    safe_user = {k:v for k, v in dict(user).items() if k != "PasswordHash"}
-
+    safe_user = _redact_user(user)
+    _cache_profile(role, safe_user, user["_version"] or 0)
     return dict(safe_user)
 
 
+PATIENT_SEARCH_PAGE_SIZE = 20
+MAX_PATIENT_SEARCH_PAGE_SIZE = 100
+PATIENT_SEARCH_FIELDS = ("patientID", "Name", "Email", "DOB")
+
+INDEX_PATIENT_DELETE_SQL = "DELETE FROM PatientSearch WHERE rowid = (SELECT rowid FROM Patients WHERE patientID = ?)"
+INDEX_PATIENT_INSERT_SQL = """
+    INSERT INTO PatientSearch (rowid, patientID, Name, Email, DOB)
+    SELECT rowid, patientID, Name, Email, DOB FROM Patients WHERE patientID = ?
+"""
+SEARCH_PATIENTS_SQL = """
+    SELECT Patients.patientID, Patients.Name, Patients.Email, Patients.DOB
+    FROM PatientSearch
+    JOIN Patients ON Patients.rowid = PatientSearch.rowid
+    JOIN DPEnrole ON DPEnrole.patientID = Patients.patientID AND DPEnrole.doctorID = ?
+    WHERE PatientSearch MATCH ?
+    ORDER BY bm25(PatientSearch, 10.0, 5.0, 2.0, 1.0), Patients.patientID
+    LIMIT ? OFFSET ?
+"""
+ASSIGNED_DOCTOR_SQL = "SELECT doctorID FROM DPEnrole WHERE patientID = ? LIMIT 1"
+ASSIGNED_PATIENTS_SQL = """
+    SELECT Patients.patientID, Patients.Name
+    FROM DPEnrole
+    JOIN Patients ON Patients.patientID = DPEnrole.patientID
+    WHERE DPEnrole.doctorID = ?
+    ORDER BY Patients.Name
+"""
+PATIENT_DOCTORS_SQL = "SELECT doctorID FROM DPEnrole WHERE patientID = ?"
+IS_DOCTOR_ENROLLED_SQL = "SELECT 1 FROM DPEnrole WHERE doctorID = ? AND patientID = ? LIMIT 1"
+
+
+def index_patient(db: sqlite3.Connection, patientID: str) -> None:
+    # Re-indexes one patient in PatientSearch. Does not commit; call it in
+    # the same transaction as the write it follows.
+    db.execute(INDEX_PATIENT_DELETE_SQL, (patientID,))
+    db.execute(INDEX_PATIENT_INSERT_SQL, (patientID,))
+
+
+def index_missing_patients(db: sqlite3.Connection) -> None:
+    # For bulk loaders that insert into Patients directly.
+    db.execute(
+        """
+        INSERT INTO PatientSearch (rowid, patientID, Name, Email, DOB)
+        SELECT rowid, patientID, Name, Email, DOB FROM Patients
+        WHERE rowid NOT IN (SELECT rowid FROM PatientSearch)
+        """
+    )
+
+
+def _patient_search_query(query: str, field: Optional[str]) -> str:
+    # Every word of the input must match as a prefix. Words are quoted, so
+    # FTS5 operators typed by the user are searched for literally.
+    column = f"{{{field}}} : " if field else ""
+    terms = []
+    for word in query.split():
+        word = word.replace('"', "")
+        if any(ch.isalnum() for ch in word):
+            terms.append(f'{column}"{word}"*')
+    return " ".join(terms)
+
+
+def search_patients(
+    doctorID: str,
+    query: str,
+    field: Optional[str] = None,
+    limit: int = PATIENT_SEARCH_PAGE_SIZE,
+    offset: int = 0,
+) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    # Best matches first among the doctor's enrolled patients. Returns the
+    # page and the offset of the next one, if any.
+    if field is not None and field not in PATIENT_SEARCH_FIELDS:
+        raise ValueError("Invalid search field")
+    match = _patient_search_query(query, field)
+    if not match:
+        return [], None
+    limit = max(1, min(limit, MAX_PATIENT_SEARCH_PAGE_SIZE))
+    offset = max(0, offset)
+
+    rows = get_db().execute(
+        SEARCH_PATIENTS_SQL, (doctorID, match, limit + 1, offset)
+    ).fetchall()
+    patients = [dict(row) for row in rows[:limit]]
+    next_offset = offset + limit if len(rows) > limit else None
+    return patients, next_offset
+
+
 UPDATEABLE_COLUMNS = {
     "Patients": {"Name", "Email", "PasswordHash", "PatientHistory"},
     "Doctors": {"Name", "Email", "PasswordHash", "Specialisation"},
@@ -70,6 +411,13 @@ UPDATEABLE_COLUMNS = {
 }
 
 from typing import Any, Dict
+
+
+def update_by_id_sql(table: str, columns: List[str]) -> str:
+    set_clause = ", ".join([f"{col} = ?" for col in columns])
+    return f"UPDATE {table} SET {set_clause} WHERE {TABLE_ID_COLUMN[table]} = ?"
+
+
 def update_by_id(table: str, userID: str, updates: Dict[str,Any]):
     if table not in UPDATEABLE_COLUMNS:
         raise ValueError("Invalid table name") 
@@ -80,31 +428,30 @@ def update_by_id(table: str, userID: str, updates: Dict[str,Any]):
     if not clean_update:
         raise ValueError("No valid columns to update")
     
-    set_clause = ", ".join([f"{col} = ?" for col in clean_update.keys()])
     values = list(clean_update.values()) + [userID]
 
     db = get_db()
-    id_column = TABLE_ID_COLUMN.get(table)
-    if not id_column:
+    if not TABLE_ID_COLUMN.get(table):
         raise ValueError("Invalid table name") 
 
-    cur = db.execute(
-        f"UPDATE {table} SET {set_clause} WHERE {id_column} = ?", values
-    )
+    cur = db.execute(update_by_id_sql(table, list(clean_update)), values)
+    if cur.rowcount and table == "Patients":
+        index_patient(db, userID)
+    if cur.rowcount and table in TABLE_ROLE:
+        changed = [profile_resource(TABLE_ROLE[table], userID)]
+        if table == "Patients":
+            # Doctors' patient lists show each patient's name.
+            rows = db.execute(PATIENT_DOCTORS_SQL, (userID,)).fetchall()
+            changed += [patient_list_resource(row["doctorID"]) for row in rows]
+        bump_versions(db, changed)
     db.commit()
+    if table in TABLE_ROLE:
+        invalidate_profile(TABLE_ROLE[table], userID, clean_update.get("Email"))
 
     return cur.rowcount
 
 
 def is_doctor_enrolled(doctorID: str, patientID: str) -> bool:
     db = get_db()
-    row = db.execute(
-        """
-        SELECT 1
-        FROM DPEnrole
-        WHERE doctorID = ? AND patientID = ?
-        LIMIT 1
-        """,
-        (doctorID, patientID),
-    ).fetchone()
+    row = db.execute(IS_DOCTOR_ENROLLED_SQL, (doctorID, patientID)).fetchone()
     return row is not None
@@ -0,0 +1,174 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from helpers.db import get_db, invalidate_profile
+from helpers.versions import bump_versions, profile_resource
+
+# Partial PatientHistory updates and cohort queries. A patch is a list of
+# JSON Patch style operations (add, replace, remove) that is compiled into
+# one UPDATE built from SQLite's json_set/json_replace/json_remove, so the
+# document is never read into Python. The allergy and family history tables
+# it is queried through are maintained by triggers (migration 8).
+
+MAX_PATCH_OPERATIONS = 50
+COHORT_LIMIT = 1000
+
+_BASE_HISTORY = "COALESCE(NULLIF(PatientHistory, ''), '{}')"
+PATIENT_EXISTS_SQL = "SELECT 1 FROM Patients WHERE patientID = ? LIMIT 1"
+
+
+def _pointer_tokens(pointer: Any) -> List[str]:
+    if not isinstance(pointer, str) or not pointer.startswith("/"):
+        raise ValueError("path must be a JSON pointer")
+    tokens = [token.replace("~1", "/").replace("~0", "~") for token in pointer[1:].split("/")]
+    for token in tokens:
+        if not token or '"' in token:
+            raise ValueError(f"Unsupported path segment: {token!r}")
+    return tokens
+
+
+def compile_patch(patientID: str, operations: Any) -> Tuple[str, List[Any]]:
+    # The patch as one UPDATE. Each step of the WITH chain holds the
+    # document as the operations so far leave it (doc), whether the patch
+    # still applies (ok) and the SQLite JSON path being built (path). Steps
+    # are materialized so later ones refer to doc by name instead of
+    # repeating its expression.
+    #
+    # A JSON Pointer ("/allergies/0") becomes an SQLite JSON path
+    # ('$."allergies"[0]'). JSON Pointer is defined against the document, so
+    # an all-digit token is resolved against the node it applies to: [0]
+    # under an array, ."0" under an object. "-" as the last token of an add
+    # appends to an array. An add that names an array index conflicts, as
+    # json_set would overwrite the element instead of inserting.
+    if not isinstance(operations, list) or not operations:
+        raise ValueError("Patch must be a non-empty list of operations")
+    if len(operations) > MAX_PATCH_OPERATIONS:
+        raise ValueError(f"At most {MAX_PATCH_OPERATIONS} operations per patch")
+
+    steps = [
+        f"s0 AS MATERIALIZED (SELECT {_BASE_HISTORY} AS doc, "
+        f"json_type({_BASE_HISTORY}) = 'object' AS ok, NULL AS path "
+        f"FROM Patients WHERE patientID = ?)"
+    ]
+    params: List[Any] = [patientID]
+
+    def step(columns: str, step_params: List[Any]) -> None:
+        steps.append(f"s{len(steps)} AS MATERIALIZED (SELECT {columns} FROM s{len(steps) - 1})")
+        params.extend(step_params)
+
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise ValueError("Each operation must be an object")
+        op = operation.get("op")
+        if op not in ("add", "replace", "remove"):
+            raise ValueError("op must be add, replace or remove")
+        tokens = _pointer_tokens(operation.get("path"))
+        if op != "remove" and "value" not in operation:
+            raise ValueError(f"{op} needs a value")
+
+        # Member names accumulate in `pending` until a token has to be
+        # resolved against the document; `started` says whether the path
+        # column already holds the start of this operation's path.
+        pending, started = "$", False
+        for i, token in enumerate(tokens):
+            last = i == len(tokens) - 1
+            append = token == "-" and op == "add" and last
+            if not token.isdigit() and not append:
+                pending += f'."{token}"'
+                continue
+            parent = "(path || ?)" if started else "?"
+            ok = "ok"
+            ok_params: List[Any] = []
+            if op == "add" and last and not append:
+                ok = f"ok AND json_type(doc, {parent}) IS NOT 'array'"
+                ok_params = [pending]
+            step(
+                f"doc, {ok} AS ok, {parent} || "
+                f"CASE json_type(doc, {parent}) WHEN 'array' THEN ? ELSE ? END AS path",
+                ok_params + [pending, pending, "[#]" if append else f"[{token}]", f'."{token}"'],
+            )
+            pending, started = "", True
+        path = "(path || ?)" if started else "?"
+
+        if op == "remove":
+            step(
+                f"json_remove(doc, {path}) AS doc, ok AND json_type(doc, {path}) IS NOT NULL AS ok, NULL AS path",
+                [pending, pending],
+            )
+        elif op == "replace":
+            step(
+                f"json_replace(doc, {path}, json(?)) AS doc, ok AND json_type(doc, {path}) IS NOT NULL AS ok, NULL AS path",
+                [pending, json.dumps(operation["value"]), pending],
+            )
+        else:
+            step(
+                f"json_set(doc, {path}, json(?)) AS doc, ok, NULL AS path",
+                [pending, json.dumps(operation["value"])],
+            )
+
+    # The chain sits in a FROM subquery so the statement still starts with
+    # UPDATE, which is what sqlite3 needs to report rowcount.
+    sql = (
+        "UPDATE Patients SET PatientHistory = patch.doc FROM (WITH "
+        + ",\n".join(steps)
+        + f"\nSELECT doc, ok FROM s{len(steps) - 1}) AS patch"
+        + " WHERE Patients.patientID = ? AND patch.ok"
+    )
+    return sql, params + [patientID]
+
+
+def patch_patient_history(patientID: str, operations: Any) -> str:
+    # Returns "patched", "not_found" or "conflict" (a replace/remove target
+    # is missing, an add names an array index, or the stored history is not
+    # a JSON object). Raises ValueError for a malformed patch.
+    sql, params = compile_patch(patientID, operations)
+    db = get_db()
+    cur = db.execute(sql, params)
+    if cur.rowcount == 0:
+        exists = db.execute(PATIENT_EXISTS_SQL, (patientID,)).fetchone()
+        return "conflict" if exists else "not_found"
+    bump_versions(db, [profile_resource("patient", patientID)])
+    db.commit()
+    invalidate_profile("patient", patientID)
+    return "patched"
+
+
+def cohort_sql(allergies: int, family_history: int) -> str:
+    # One indexed join per criterion; parameters are the allergies, then the
+    # family history conditions, then doctorID and the row limit.
+    joins = [
+        f"JOIN PatientAllergies a{i} ON a{i}.patientID = DPEnrole.patientID AND a{i}.allergy = ?"
+        for i in range(allergies)
+    ] + [
+        f"JOIN PatientFamilyHistory f{i} ON f{i}.patientID = DPEnrole.patientID AND f{i}.condition = ?"
+        for i in range(family_history)
+    ]
+    return f"""
+        SELECT Patients.patientID, Patients.Name
+        FROM DPEnrole
+        {" ".join(joins)}
+        JOIN Patients ON Patients.patientID = DPEnrole.patientID
+        WHERE DPEnrole.doctorID = ?
+        ORDER BY Patients.Name
+        LIMIT ?
+    """
+
+
+def patient_cohort(
+    doctorID: str,
+    allergies: Optional[List[str]] = None,
+    family_history: Optional[List[str]] = None,
+) -> List[Dict[str, Any]]:
+    # The doctor's patients with every given allergy and family history
+    # condition. Each criterion is an indexed join, so the planner can start
+    # from whichever side is smaller.
+    allergies = [a.strip().lower() for a in allergies or [] if a.strip()]
+    family_history = [f.strip().lower() for f in family_history or [] if f.strip()]
+    if not allergies and not family_history:
+        raise ValueError("Give at least one allergy or family_history condition")
+
+    rows = get_db().execute(
+        cohort_sql(len(allergies), len(family_history)),
+        allergies + family_history + [doctorID, COHORT_LIMIT],
+    ).fetchall()
+    return [dict(row) for row in rows]
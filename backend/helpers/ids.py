@@ -0,0 +1,91 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+import helpers.db as db_module
+
+# IDs are a two-letter prefix plus a 5-digit number, numbered per
+# (table, prefix). The next number lives in the IdSequences table and is
+# claimed with one short write transaction on a dedicated connection, so it
+# never commits a caller's pending work. Each process may claim a block of
+# numbers at a time (MEDILINK_ID_BLOCK_SIZE); unused numbers in a block are
+# skipped when the process exits.
+
+ID_BLOCK_SIZE = int(os.environ.get("MEDILINK_ID_BLOCK_SIZE", "1"))
+
+NEXT_VALUE_SQL = "SELECT next_value FROM IdSequences WHERE name = ?"
+START_SEQUENCE_SQL = "INSERT INTO IdSequences (name, next_value) VALUES (?, ?)"
+ADVANCE_SEQUENCE_SQL = "UPDATE IdSequences SET next_value = ? WHERE name = ?"
+
+_lock = threading.Lock()
+_conn: Optional[sqlite3.Connection] = None
+_conn_pid: Optional[int] = None
+_blocks: Dict[str, List[int]] = {}
+
+
+def _connection() -> sqlite3.Connection:
+    global _conn, _conn_pid
+    if _conn is None or _conn_pid != os.getpid():
+        _conn = sqlite3.connect(db_module.DB_PATH, isolation_level=None, check_same_thread=False)
+        _conn.execute("PRAGMA busy_timeout = 5000;")
+        _conn_pid = os.getpid()
+        _blocks.clear()
+    return _conn
+
+
+def _claim(conn: sqlite3.Connection, table: str, id_column: str, prefix: str, count: int) -> int:
+    name = f"{table}:{prefix}"
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(NEXT_VALUE_SQL, (name,)).fetchone()
+        if row is None:
+            # First use of this prefix: start after any IDs created before
+            # the sequence table existed. This scan runs once per prefix.
+            max_num = conn.execute(
+                f"""
+                SELECT MAX(CAST(SUBSTR({id_column}, 3) AS INTEGER))
+                FROM {table}
+                WHERE {id_column} LIKE ?
+                """,
+                (f"{prefix}%",),
+            ).fetchone()[0]
+            start = (max_num or 0) + 1
+            conn.execute(START_SEQUENCE_SQL, (name, start + count))
+        else:
+            start = row[0]
+            conn.execute(ADVANCE_SEQUENCE_SQL, (start + count, name))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return start
+
+
+def next_ids(table: str, id_column: str, prefix: str, count: int = 1) -> List[str]:
+    name = f"{table}:{prefix}"
+    numbers: List[int] = []
+    with _lock:
+        conn = _connection()
+        block = _blocks.get(name)
+        while len(numbers) < count:
+            if block is None or block[0] >= block[1]:
+                size = max(ID_BLOCK_SIZE, count - len(numbers))
+                start = _claim(conn, table, id_column, prefix, size)
+                block = [start, start + size]
+                _blocks[name] = block
+            numbers.append(block[0])
+            block[0] += 1
+    return [f"{prefix}{number:05d}" for number in numbers]
+
+
+def reserve_ids(conn: sqlite3.Connection, table: str, id_column: str, prefix: str, count: int) -> List[str]:
+    # Claims `count` consecutive IDs on the caller's own connection, for bulk
+    # loaders writing to a database other than DB_PATH. The connection must
+    # not have a transaction open.
+    start = _claim(conn, table, id_column, prefix, count)
+    return [f"{prefix}{number:05d}" for number in range(start, start + count)]
+
+
+def next_id(table: str, id_column: str, prefix: str) -> str:
+    return next_ids(table, id_column, prefix, 1)[0]
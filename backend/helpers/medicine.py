@@ -1,8 +1,176 @@
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from datetime import date, datetime, timezone
+import os
 import random
 import string
+import time
 
+from helpers.collection_codes import collection_code_hash, new_collection_code
 from helpers.db import get_db
+from helpers.ids import next_id, next_ids
+from helpers.versions import bump_versions, prescriptions_resource
+
+
+ROLE_PRESCRIPTION_COLUMN = {
+    "patient": "patientID",
+    "doctor": "doctorID",
+    "pharmacist": "pharmID",
+}
+
+# Columns each role may see, so redaction happens in the SELECT itself.
+ROLE_PRESCRIPTION_FIELDS = {
+    "patient": [
+        "patientID", "prescriptionID", "doctorID", "pharmID", "MedicineName",
+        "Instructions", "DatePrescribed", "DurationType", "CollectionCode",
+    ],
+    "doctor": [
+        "patientID", "prescriptionID", "doctorID", "pharmID", "MedicineName",
+        "Instructions", "DatePrescribed", "DurationType",
+    ],
+    "pharmacist": [
+        "patientID", "prescriptionID", "pharmID", "MedicineName",
+        "Instructions", "DatePrescribed", "DurationType",
+    ],
+}
+
+PRESCRIPTION_PAGE_SIZE = 100
+MAX_PRESCRIPTION_PAGE_SIZE = 500
+PRESCRIPTION_CHANGES_PAGE_SIZE = 500
+MAX_PRESCRIPTION_CHANGES_PAGE_SIZE = 2000
+MAX_PRESCRIPTION_BATCH_SIZE = 100
+MAX_COLLECTION_BATCH_SIZE = 100
+MAX_CODE_MATCHES = 20
+
+# Collection codes are six digits, so lookups by code alone that match
+# nothing are counted per pharmacy, and lookups stop for the rest of the
+# window once there are too many.
+#   MEDILINK_CODE_MAX_FAILURES     unmatched lookups allowed per window
+#   MEDILINK_CODE_FAILURE_WINDOW   window length in seconds
+CODE_MAX_FAILURES = int(os.environ.get("MEDILINK_CODE_MAX_FAILURES", "10"))
+CODE_FAILURE_WINDOW = int(os.environ.get("MEDILINK_CODE_FAILURE_WINDOW", "900"))
+
+DURATION_TYPES = ("Lifetime", "Temporary")
+
+
+# The SQL below is what the helpers run; helpers/query_plans.py checks the
+# same constants and builders.
+
+def _placeholders(count: int) -> str:
+    return ", ".join("?" * count)
+
+
+def fetch_prescription_sql(role: str) -> str:
+    return f"""
+        SELECT {", ".join(ROLE_PRESCRIPTION_FIELDS[role])}
+        FROM Prescriptions
+        WHERE prescriptionID = ? AND {ROLE_PRESCRIPTION_COLUMN[role]} = ?
+    """
+
+
+def list_prescriptions_sql(
+    role: str,
+    cursor: bool = False,
+    duration_type: bool = False,
+    prescribed_from: bool = False,
+    prescribed_to: bool = False,
+) -> str:
+    # Parameters: user id, then one per filter given, in argument order,
+    # then the row limit.
+    conditions = [f"{ROLE_PRESCRIPTION_COLUMN[role]} = ?"]
+    if cursor:
+        conditions.append("prescriptionID > ?")
+    if duration_type:
+        conditions.append("DurationType = ?")
+    if prescribed_from:
+        conditions.append("DatePrescribed >= ?")
+    if prescribed_to:
+        conditions.append("DatePrescribed <= ?")
+    return f"""
+        SELECT {", ".join(ROLE_PRESCRIPTION_FIELDS[role])}
+        FROM Prescriptions
+        WHERE {" AND ".join(conditions)}
+        ORDER BY prescriptionID
+        LIMIT ?
+    """
+
+
+def latest_change_sql(role: str) -> str:
+    return f"SELECT MAX(seq) FROM PrescriptionChanges WHERE {ROLE_PRESCRIPTION_COLUMN[role]} = ?"
+
+
+def changes_sql(role: str) -> str:
+    return f"""
+        SELECT seq, prescriptionID, deleted
+        FROM PrescriptionChanges
+        WHERE {ROLE_PRESCRIPTION_COLUMN[role]} = ? AND seq > ?
+        ORDER BY seq
+        LIMIT ?
+    """
+
+
+def prescriptions_by_id_sql(role: str, count: int) -> str:
+    return f"""
+        SELECT {", ".join(ROLE_PRESCRIPTION_FIELDS[role])}
+        FROM Prescriptions
+        WHERE prescriptionID IN ({_placeholders(count)}) AND {ROLE_PRESCRIPTION_COLUMN[role]} = ?
+    """
+
+
+def enrolled_patients_sql(count: int) -> str:
+    return f"SELECT patientID FROM DPEnrole WHERE doctorID = ? AND patientID IN ({_placeholders(count)})"
+
+
+def pharmacies_sql(count: int) -> str:
+    return f"SELECT pharmID FROM Pharmacies WHERE pharmID IN ({_placeholders(count)})"
+
+
+def collectable_sql(count: int) -> str:
+    return f"""
+        SELECT prescriptionID, patientID, doctorID, pharmID, DurationType, CollectionCode
+        FROM Prescriptions
+        WHERE prescriptionID IN ({_placeholders(count)}) AND pharmID = ?
+    """
+
+
+INSERT_PRESCRIPTION_SQL = """
+    INSERT INTO Prescriptions (
+        patientID,
+        prescriptionID,
+        doctorID,
+        pharmID,
+        MedicineName,
+        Instructions,
+        DatePrescribed,
+        DurationType,
+        CollectionCode,
+        CollectionCodeHash
+    )
+    VALUES (
+        :patientID, :prescriptionID, :doctorID, :pharmID, :MedicineName,
+        :Instructions, :DatePrescribed, :DurationType, :CollectionCode, :CollectionCodeHash
+    )
+"""
+RECORD_CHANGE_SQL = """
+    INSERT INTO PrescriptionChanges (prescriptionID, patientID, doctorID, pharmID, deleted, changed_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+ROTATE_CODE_SQL = "UPDATE Prescriptions SET CollectionCode = ?, CollectionCodeHash = ? WHERE prescriptionID = ?"
+DELETE_PRESCRIPTION_SQL = "DELETE FROM Prescriptions WHERE prescriptionID = ?"
+FIND_BY_CODE_SQL = f"""
+    SELECT {", ".join(ROLE_PRESCRIPTION_FIELDS["pharmacist"])}
+    FROM Prescriptions
+    WHERE pharmID = ? AND CollectionCodeHash = ?
+    ORDER BY prescriptionID
+    LIMIT ?
+"""
+TAKE_CODE_ATTEMPT_SQL = """
+    INSERT INTO CollectionCodeFailures (pharmID, window_start, failures) VALUES (?, ?, 1)
+    ON CONFLICT (pharmID) DO UPDATE SET
+        failures = CASE WHEN window_start <= ? THEN 1 ELSE MIN(failures + 1, ?) END,
+        window_start = CASE WHEN window_start <= ? THEN excluded.window_start ELSE window_start END
+    RETURNING failures
+"""
+REFUND_CODE_ATTEMPT_SQL = "UPDATE CollectionCodeFailures SET failures = failures - 1 WHERE pharmID = ? AND failures > 0"
 
 
 def _name_prefix(_: str) -> str:
@@ -10,52 +178,119 @@ def _name_prefix(_: str) -> str:
 
 
 def _next_prescription_id(prefix: str) -> str:
-    db = get_db()
-    row = db.execute(
-        """
-        SELECT MAX(CAST(SUBSTR(prescriptionID, 3) AS INTEGER)) AS max_num
-        FROM Prescriptions
-        WHERE prescriptionID LIKE ?
-        """,
-        (f"{prefix}%",),
-    ).fetchone()
-    next_num = (row["max_num"] or 0) + 1
-    return f"{prefix}{next_num:05d}"
+    return next_id("Prescriptions", "prescriptionID", prefix)
 
 
 def fetch_prescription_details(user_id: str, role: str, prescription_id: str) -> Optional[Dict[str, Any]]:
     db = get_db()
     # Get correct column based on role
-    if role == "patient":
-        role_column = "patientID"
-    elif role == "doctor":
-        role_column = "doctorID"
-    elif role == "pharmacist":
-        role_column = "pharmID"
-    else:
+    role_column = ROLE_PRESCRIPTION_COLUMN.get(role)
+    if role_column is None:
         raise ValueError("Invalid role")
 
-    row = db.execute(
-        f"""
-        SELECT *
-        FROM Prescriptions
-        WHERE prescriptionID = ? AND {role_column} = ?
-        """,
-        (prescription_id, user_id),
-    ).fetchone()
+    row = db.execute(fetch_prescription_sql(role), (prescription_id, user_id)).fetchone()
 
     if row is None:
         return None
+    return dict(row)
 
-    result = dict(row)
-    # Remove sensitive fields based on role
-    if role == "doctor":
-        result.pop("CollectionCode", None)
-    elif role == "pharmacist":
-        result.pop("doctorID", None)
-        result.pop("CollectionCode", None)
 
-    return result
+def list_prescriptions(
+    user_id: str,
+    role: str,
+    limit: int = PRESCRIPTION_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    duration_type: Optional[str] = None,
+    prescribed_from: Optional[str] = None,
+    prescribed_to: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    # One query per page, ordered by prescriptionID. next_cursor is the last
+    # prescriptionID on the page while more rows remain.
+    role_column = ROLE_PRESCRIPTION_COLUMN.get(role)
+    if role_column is None:
+        raise ValueError("Invalid role")
+    limit = max(1, min(limit, MAX_PRESCRIPTION_PAGE_SIZE))
+
+    filters = [cursor, duration_type, prescribed_from, prescribed_to]
+    params: List[Any] = [user_id] + [value for value in filters if value] + [limit + 1]
+    db = get_db()
+    rows = db.execute(
+        list_prescriptions_sql(role, *(bool(value) for value in filters)),
+        params,
+    ).fetchall()
+
+    prescriptions = [dict(row) for row in rows[:limit]]
+    next_cursor = prescriptions[-1]["prescriptionID"] if len(rows) > limit else None
+    return prescriptions, next_cursor
+
+
+def _prescription_resources(row: Any) -> List[str]:
+    # The listings a prescription appears in, one per role.
+    return [
+        prescriptions_resource(role, row[column])
+        for role, column in ROLE_PRESCRIPTION_COLUMN.items()
+    ]
+
+
+def _record_changes(db, changes: Iterable[Tuple[Any, str, bool]]) -> None:
+    # One change-feed row per (row, prescriptionID, deleted).
+    changed_at = datetime.now(timezone.utc).isoformat()
+    db.executemany(
+        RECORD_CHANGE_SQL,
+        [
+            (prescription_id, row["patientID"], row["doctorID"], row["pharmID"], int(deleted), changed_at)
+            for row, prescription_id, deleted in changes
+        ],
+    )
+
+
+def _record_change(db, row: Any, prescription_id: str, deleted: bool) -> None:
+    _record_changes(db, [(row, prescription_id, deleted)])
+
+
+def latest_prescription_change(user_id: str, role: str) -> int:
+    role_column = ROLE_PRESCRIPTION_COLUMN.get(role)
+    if role_column is None:
+        raise ValueError("Invalid role")
+    row = get_db().execute(latest_change_sql(role), (user_id,)).fetchone()
+    return row[0] or 0
+
+
+def prescription_changes(
+    user_id: str,
+    role: str,
+    since: int,
+    limit: int = PRESCRIPTION_CHANGES_PAGE_SIZE,
+) -> Tuple[List[Dict[str, Any]], List[str], int, bool]:
+    # Returns (upserts, deleted prescriptionIDs, change_seq, has_more) for the
+    # user's changes after `since`. Several changes to one prescription
+    # collapse into its current row, or a tombstone if it is gone.
+    role_column = ROLE_PRESCRIPTION_COLUMN.get(role)
+    if role_column is None:
+        raise ValueError("Invalid role")
+    limit = max(1, min(limit, MAX_PRESCRIPTION_CHANGES_PAGE_SIZE))
+
+    db = get_db()
+    rows = db.execute(changes_sql(role), (user_id, since, limit + 1)).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    change_seq = rows[-1]["seq"] if rows else since
+
+    latest: Dict[str, bool] = {}
+    for row in rows:
+        latest[row["prescriptionID"]] = bool(row["deleted"])
+    changed_ids = [pid for pid, deleted in latest.items() if not deleted]
+
+    current: Dict[str, Dict[str, Any]] = {}
+    for start in range(0, len(changed_ids), 500):
+        chunk = changed_ids[start:start + 500]
+        for row in db.execute(prescriptions_by_id_sql(role, len(chunk)), chunk + [user_id]).fetchall():
+            current[row["prescriptionID"]] = dict(row)
+
+    # A prescription deleted by a change past this page is already a tombstone.
+    upserts = [current[pid] for pid in changed_ids if pid in current]
+    deleted_ids = [pid for pid, deleted in latest.items() if deleted or pid not in current]
+    return upserts, deleted_ids, change_seq, has_more
 
 
 def create_prescription(data: Dict[str, Any]) -> None:
@@ -67,37 +302,197 @@ def create_prescription(data: Dict[str, Any]) -> None:
 
     collection_code = data.get("CollectionCode")
     if not collection_code:
-        collection_code = f"{random.randint(0, 999999):06d}"
+        collection_code = new_collection_code()
 
     db = get_db()
     db.execute(
-        """
-        INSERT INTO Prescriptions (
-            patientID,
-            prescriptionID,
-            doctorID,
-            pharmID,
-            MedicineName,
-            Instructions,
-            DatePrescribed,
-            DurationType,
-            CollectionCode
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            data.get("patientID"),
-            prescription_id,
-            data.get("doctorID"),
-            data.get("pharmID"),
-            data.get("MedicineName"),
-            data.get("Instructions"),
-            data.get("DatePrescribed"),
-            data.get("DurationType"),
-            collection_code,
-        ),
+        INSERT_PRESCRIPTION_SQL,
+        {
+            "patientID": data.get("patientID"),
+            "prescriptionID": prescription_id,
+            "doctorID": data.get("doctorID"),
+            "pharmID": data.get("pharmID"),
+            "MedicineName": data.get("MedicineName"),
+            "Instructions": data.get("Instructions"),
+            "DatePrescribed": data.get("DatePrescribed"),
+            "DurationType": data.get("DurationType"),
+            "CollectionCode": collection_code,
+            "CollectionCodeHash": collection_code_hash(str(data.get("pharmID")), collection_code),
+        },
     )
+    _record_change(db, data, prescription_id, deleted=False)
+    bump_versions(db, _prescription_resources(data))
+    db.commit()
+
+
+def _validate_prescription(item: Any) -> Optional[str]:
+    # The problem with one batch item, or None if it is well formed.
+    if not isinstance(item, dict):
+        return "Each prescription must be an object"
+    for field in ("patientID", "pharmID", "MedicineName", "DatePrescribed", "DurationType"):
+        if not isinstance(item.get(field), str) or not item[field].strip():
+            return f"Missing {field}"
+    if item.get("Instructions") is not None and not isinstance(item["Instructions"], str):
+        return "Instructions must be a string"
+    if item["DurationType"] not in DURATION_TYPES:
+        return f"DurationType must be one of {', '.join(DURATION_TYPES)}"
+    try:
+        date.fromisoformat(item["DatePrescribed"])
+    except ValueError:
+        return "DatePrescribed must be an ISO date"
+    return None
+
+
+def create_prescriptions(doctor_id: str, items: Any, atomic: bool = True) -> Tuple[List[Dict[str, Any]], int]:
+    # Validates every item first (fields, enrolment, pharmacy), then inserts
+    # the valid ones with one executemany in one transaction. Returns a
+    # result per item, in order, and how many were created. With atomic set,
+    # nothing is created unless every item is valid.
+    if not isinstance(items, list) or not items:
+        raise ValueError("prescriptions must be a non-empty list")
+    if len(items) > MAX_PRESCRIPTION_BATCH_SIZE:
+        raise ValueError(f"At most {MAX_PRESCRIPTION_BATCH_SIZE} prescriptions per batch")
+
+    errors: List[Optional[str]] = [_validate_prescription(item) for item in items]
+    db = get_db()
+    patient_ids = sorted({item["patientID"] for item, error in zip(items, errors) if error is None})
+    pharm_ids = sorted({item["pharmID"] for item, error in zip(items, errors) if error is None})
+    enrolled = {
+        row[0] for row in db.execute(enrolled_patients_sql(len(patient_ids)), [doctor_id] + patient_ids)
+    } if patient_ids else set()
+    pharmacies = {
+        row[0] for row in db.execute(pharmacies_sql(len(pharm_ids)), pharm_ids)
+    } if pharm_ids else set()
+    for i, item in enumerate(items):
+        if errors[i] is not None:
+            continue
+        if item["patientID"] not in enrolled:
+            errors[i] = "Patient is not enrolled with this doctor"
+        elif item["pharmID"] not in pharmacies:
+            errors[i] = "Pharmacy not found"
+
+    valid = [i for i, error in enumerate(errors) if error is None]
+    if atomic and len(valid) < len(items):
+        valid = []
+
+    rows: Dict[int, Dict[str, Any]] = {}
+    if valid:
+        # One ID claim for the whole batch, under a single random prefix.
+        ids = next_ids("Prescriptions", "prescriptionID", _name_prefix("RX"), len(valid))
+        for i, prescription_id in zip(valid, ids):
+            item = items[i]
+            code = new_collection_code()
+            rows[i] = {
+                "patientID": item["patientID"],
+                "prescriptionID": prescription_id,
+                "doctorID": doctor_id,
+                "pharmID": item["pharmID"],
+                "MedicineName": item["MedicineName"],
+                "Instructions": item.get("Instructions"),
+                "DatePrescribed": item["DatePrescribed"],
+                "DurationType": item["DurationType"],
+                "CollectionCode": code,
+                "CollectionCodeHash": collection_code_hash(item["pharmID"], code),
+            }
+        try:
+            db.executemany(INSERT_PRESCRIPTION_SQL, list(rows.values()))
+            _record_changes(db, [(row, row["prescriptionID"], False) for row in rows.values()])
+            bump_versions(db, [name for row in rows.values() for name in _prescription_resources(row)])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+    results: List[Dict[str, Any]] = []
+    for i, error in enumerate(errors):
+        if i in rows:
+            results.append({"index": i, "status": "created", "prescriptionID": rows[i]["prescriptionID"]})
+        elif error is not None:
+            results.append({"index": i, "status": "invalid", "error": error})
+        else:
+            results.append({"index": i, "status": "skipped"})
+    return results, len(rows)
+
+
+def take_code_attempt(pharm_id: str) -> bool:
+    # Counts one code lookup against the pharmacy's window and says whether
+    # it is within the limit. Check and increment are one statement, so
+    # workers racing on the last attempt cannot both get it.
+    now = int(time.time())
+    expired = now - CODE_FAILURE_WINDOW
+    db = get_db()
+    failures = db.execute(
+        TAKE_CODE_ATTEMPT_SQL,
+        (pharm_id, now, expired, CODE_MAX_FAILURES + 1, expired),
+    ).fetchone()[0]
     db.commit()
+    return failures <= CODE_MAX_FAILURES
+
+
+def refund_code_attempt(pharm_id: str) -> None:
+    # The looked-up code matched, so it was not a failure after all.
+    db = get_db()
+    db.execute(REFUND_CODE_ATTEMPT_SQL, (pharm_id,))
+    db.commit()
+
+
+def collect_prescriptions(pharm_id: str, items: List[Tuple[str, str]]) -> List[str]:
+    # Bulk collection: one status per (prescriptionID, CollectionCode), as
+    # delete_prescription_if_collectable would give them one after another.
+    # Lifetime prescriptions get a new code and Temporary ones are deleted,
+    # all in one transaction.
+    if len(items) > MAX_COLLECTION_BATCH_SIZE:
+        raise ValueError(f"At most {MAX_COLLECTION_BATCH_SIZE} prescriptions per collection")
+    db = get_db()
+    ids = sorted({prescription_id for prescription_id, _ in items})
+    # Take the write lock before reading the codes, so two counters (or
+    # workers) collecting the same prescription cannot both see its old code.
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        rows = {
+            row["prescriptionID"]: row
+            for row in db.execute(collectable_sql(len(ids)), ids + [pharm_id]).fetchall()
+        } if ids else {}
+
+        codes = {prescription_id: row["CollectionCode"] for prescription_id, row in rows.items()}
+        rotated: Dict[str, str] = {}
+        deleted: List[str] = []
+        statuses: List[str] = []
+        for prescription_id, collection_code in items:
+            if prescription_id not in codes:
+                statuses.append("not_found")
+            elif codes[prescription_id] != collection_code:
+                statuses.append("invalid_code")
+            elif rows[prescription_id]["DurationType"] != "Temporary":
+                codes[prescription_id] = rotated[prescription_id] = new_collection_code()
+                statuses.append("code_changed")
+            else:
+                del codes[prescription_id]
+                deleted.append(prescription_id)
+                statuses.append("deleted")
+
+        if rotated or deleted:
+            db.executemany(
+                ROTATE_CODE_SQL,
+                [
+                    (code, collection_code_hash(pharm_id, code), prescription_id)
+                    for prescription_id, code in rotated.items()
+                ],
+            )
+            db.executemany(
+                DELETE_PRESCRIPTION_SQL,
+                [(prescription_id,) for prescription_id in deleted],
+            )
+            _record_changes(
+                db,
+                [(rows[pid], pid, False) for pid in rotated] + [(rows[pid], pid, True) for pid in deleted],
+            )
+            bump_versions(db, [name for pid in [*rotated, *deleted] for name in _prescription_resources(rows[pid])])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return statuses
 
 
 def delete_prescription_if_collectable(
@@ -105,31 +500,15 @@ def delete_prescription_if_collectable(
     pharm_id: str,
     collection_code: str,
 ) -> str:
-    db = get_db()
-    row = db.execute(
-        """
-        SELECT DurationType, CollectionCode
-        FROM Prescriptions
-        WHERE prescriptionID = ? AND pharmID = ?
-        """,
-        (prescription_id, pharm_id),
-    ).fetchone()
+    return collect_prescriptions(pharm_id, [(prescription_id, collection_code)])[0]
 
-    if row is None:
-        return "not_found"
-
-    if row["CollectionCode"] != collection_code:
-        return "invalid_code"
 
-    if row["DurationType"] != "Temporary":
-        new_code = f"{random.randint(0, 999999):06d}"
-        db.execute(
-            "UPDATE Prescriptions SET CollectionCode = ? WHERE prescriptionID = ?",
-            (new_code, prescription_id),
-        )
-        db.commit()
-        return "code_changed"
-
-    db.execute("DELETE FROM Prescriptions WHERE prescriptionID = ?", (prescription_id,))
-    db.commit()
-    return "deleted"
+def find_prescriptions_by_code(pharm_id: str, collection_code: str) -> List[Dict[str, Any]]:
+    # The pharmacy's prescriptions with this collection code, found through
+    # the (pharmID, CollectionCodeHash) index. Codes are six digits, so more
+    # than one prescription can share one.
+    rows = get_db().execute(
+        FIND_BY_CODE_SQL,
+        (pharm_id, collection_code_hash(pharm_id, collection_code), MAX_CODE_MATCHES),
+    ).fetchall()
+    return [dict(row) for row in rows]
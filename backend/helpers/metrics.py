@@ -0,0 +1,142 @@
+import bisect
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+# Per-route request metrics in Prometheus text format. The request hooks in
+# app.py call start_request/finish_request; pool connections report each
+# statement through note_statement (from the sqlite3 trace callback) and the
+# time spent executing it through note_sql_time. Counts are per process:
+# with several workers, scrape each one or sum them.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_local = threading.local()
+_lock = threading.Lock()
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _RouteMetrics:
+    def __init__(self):
+        self.latency = _Histogram(LATENCY_BUCKETS)
+        self.sql_statements = _Histogram(SQL_STATEMENT_BUCKETS)
+        self.sql_seconds = 0.0
+        self.response_bytes = 0
+        self.statuses: Dict[int, int] = {}
+
+
+_routes: Dict[Tuple[str, str], _RouteMetrics] = {}
+
+
+class _RequestStats:
+    __slots__ = ("started", "statements", "sql_seconds")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.sql_seconds = 0.0
+
+
+def start_request() -> None:
+    _local.request = _RequestStats()
+
+
+def note_statement(statement: str) -> None:
+    # Trigger bodies are traced as "-- TRIGGER ..." lines; they run inside
+    # the statement that fired them and are not counted separately.
+    stats = getattr(_local, "request", None)
+    if stats is not None and not statement.startswith("--"):
+        stats.statements += 1
+
+
+def note_sql_time(seconds: float) -> None:
+    stats = getattr(_local, "request", None)
+    if stats is not None:
+        stats.sql_seconds += seconds
+
+
+def finish_request(method: str, route: str, status: int, response_bytes: Optional[int]) -> None:
+    stats = getattr(_local, "request", None)
+    if stats is None:
+        return
+    _local.request = None
+    elapsed = time.perf_counter() - stats.started
+    with _lock:
+        metrics = _routes.get((method, route))
+        if metrics is None:
+            metrics = _routes[(method, route)] = _RouteMetrics()
+        metrics.latency.observe(elapsed)
+        metrics.sql_statements.observe(stats.statements)
+        metrics.sql_seconds += stats.sql_seconds
+        metrics.response_bytes += response_bytes or 0
+        metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _histogram_lines(name: str, labels: str, histogram: _Histogram) -> List[str]:
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.6f}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return lines
+
+
+def render_metrics() -> str:
+    sections = {
+        "latency": [
+            "# HELP medilink_http_request_duration_seconds Time from request start to response.",
+            "# TYPE medilink_http_request_duration_seconds histogram",
+        ],
+        "status": [
+            "# HELP medilink_http_responses_total Responses by status code.",
+            "# TYPE medilink_http_responses_total counter",
+        ],
+        "bytes": [
+            "# HELP medilink_http_response_bytes_total Response body bytes serialized.",
+            "# TYPE medilink_http_response_bytes_total counter",
+        ],
+        "statements": [
+            "# HELP medilink_sql_statements_per_request SQL statements run per request.",
+            "# TYPE medilink_sql_statements_per_request histogram",
+        ],
+        "sql_seconds": [
+            "# HELP medilink_sql_seconds_total Time spent executing SQL statements.",
+            "# TYPE medilink_sql_seconds_total counter",
+        ],
+    }
+    with _lock:
+        for (method, route), metrics in sorted(_routes.items()):
+            labels = f'method="{_label(method)}",route="{_label(route)}"'
+            sections["latency"] += _histogram_lines(
+                "medilink_http_request_duration_seconds", labels, metrics.latency
+            )
+            for status, count in sorted(metrics.statuses.items()):
+                sections["status"].append(
+                    f'medilink_http_responses_total{{{labels},status="{status}"}} {count}'
+                )
+            sections["bytes"].append(f"medilink_http_response_bytes_total{{{labels}}} {metrics.response_bytes}")
+            sections["statements"] += _histogram_lines(
+                "medilink_sql_statements_per_request", labels, metrics.sql_statements
+            )
+            sections["sql_seconds"].append(f"medilink_sql_seconds_total{{{labels}}} {metrics.sql_seconds:.6f}")
+    return "\n".join(line for lines in sections.values() for line in lines) + "\n"
@@ -0,0 +1,383 @@
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+from datetime import datetime, timezone
+from typing import Callable, List, Tuple
+
+
+# Versioned schema changes. Each migration runs in its own transaction and is
+# recorded in SchemaVersion; apply_migrations only runs the ones a database
+# has not seen yet. Append new migrations to the end, never edit old ones.
+#
+# The early migrations use IF NOT EXISTS so they can adopt databases created
+# by the old database/__init__db.py script.
+
+
+def _base_schema(c: sqlite3.Connection) -> None:
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS Doctors(
+            doctorID TEXT NOT NULL PRIMARY KEY,
+            Name TEXT NOT NULL,
+            Email TEXT UNIQUE NOT NULL,
+            PasswordHash TEXT NOT NULL,
+            Specialisation TEXT
+        );
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS Patients(
+            patientID TEXT NOT NULL PRIMARY KEY,
+            Name TEXT NOT NULL,
+            Email TEXT UNIQUE NOT NULL,
+            PasswordHash TEXT NOT NULL,
+            PatientHistory TEXT,
+            DOB DATE NOT NULL
+        );
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS Pharmacies(
+            pharmID TEXT NOT NULL PRIMARY KEY,
+            Email TEXT UNIQUE NOT NULL,
+            PasswordHash TEXT NOT NULL,
+            Name TEXT NOT NULL
+        );
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS DPEnrole(
+            doctorID TEXT NOT NULL,
+            patientID TEXT NOT NULL,
+            msgHistory TEXT,
+            PRIMARY KEY (doctorID, patientID)
+            FOREIGN KEY (doctorID)
+                REFERENCES Doctors (doctorID),
+            FOREIGN KEY (patientID)
+                REFERENCES Patients (patientID)
+        );
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS Prescriptions(
+            patientID TEXT NOT NULL,
+            prescriptionID TEXT NOT NULL PRIMARY KEY,
+            doctorID TEXT NOT NULL,
+            pharmID TEXT NOT NULL,
+            MedicineName TEXT NOT NULL,
+            Instructions TEXT,
+            DatePrescribed DATE NOT NULL,
+            DurationType TEXT NOT NULL,
+            CollectionCode TEXT NOT NULL,
+            FOREIGN KEY (patientID)
+                REFERENCES Patients (patientID),
+            FOREIGN KEY (doctorID)
+                REFERENCES Doctors (doctorID),
+            FOREIGN KEY (pharmID)
+                REFERENCES Pharmacies (pharmID)
+        );
+    """)
+
+
+def _load_history(raw) -> list:
+    if not isinstance(raw, str) or not raw.strip():
+        return []
+    try:
+        items = json.loads(raw)
+    except json.JSONDecodeError:
+        return []
+    return items if isinstance(items, list) else []
+
+
+def _messages_table(c: sqlite3.Connection) -> None:
+    # One row per message, replacing the DPEnrole.msgHistory JSON blob.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS Messages(
+            messageID INTEGER PRIMARY KEY AUTOINCREMENT,
+            doctorID TEXT NOT NULL,
+            patientID TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            senderID TEXT NOT NULL,
+            message TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            UNIQUE (doctorID, patientID, seq),
+            FOREIGN KEY (doctorID, patientID)
+                REFERENCES DPEnrole (doctorID, patientID)
+        );
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_Messages_patient ON Messages (patientID, messageID);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_Messages_timestamp ON Messages (timestamp);")
+
+    # Move any remaining blobs across, clearing each one as it goes.
+    rows = c.execute("""
+        SELECT doctorID, patientID, msgHistory
+        FROM DPEnrole
+        WHERE msgHistory IS NOT NULL
+    """).fetchall()
+    for doctorID, patientID, msgHistory in rows:
+        last_seq = c.execute("""
+            SELECT COALESCE(MAX(seq), 0)
+            FROM Messages
+            WHERE doctorID = ? AND patientID = ?
+        """, (doctorID, patientID)).fetchone()[0]
+        message_data = []
+        for item in _load_history(msgHistory):
+            if not isinstance(item, dict) or not item.get("message"):
+                continue
+            last_seq += 1
+            message_data.append((
+                doctorID,
+                patientID,
+                last_seq,
+                item.get("sender") or "",
+                item["message"],
+                item.get("timestamp") or "",
+            ))
+        c.executemany("""
+            INSERT INTO Messages (doctorID, patientID, seq, senderID, message, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, message_data)
+        c.execute("""
+            UPDATE DPEnrole SET msgHistory = NULL
+            WHERE doctorID = ? AND patientID = ?
+        """, (doctorID, patientID))
+
+
+def _id_sequences(c: sqlite3.Connection) -> None:
+    # Next number for each (table, two-letter prefix), e.g. name = "Patients:AB"
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS IdSequences(
+            name TEXT NOT NULL PRIMARY KEY,
+            next_value INTEGER NOT NULL
+        );
+    """)
+
+
+def _query_indexes(c: sqlite3.Connection) -> None:
+    # Prescription listings filter by one role column and page by
+    # prescriptionID; DPEnrole is also looked up by patient alone.
+    c.execute("CREATE INDEX IF NOT EXISTS idx_Prescriptions_patient ON Prescriptions (patientID, prescriptionID);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_Prescriptions_doctor ON Prescriptions (doctorID, prescriptionID);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_Prescriptions_pharm ON Prescriptions (pharmID, prescriptionID);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_DPEnrole_patient ON DPEnrole (patientID);")
+
+
+def _resource_versions(c: sqlite3.Connection) -> None:
+    # Per-resource change counters for conditional GETs, see helpers/versions.py.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS ResourceVersions(
+            name TEXT NOT NULL PRIMARY KEY,
+            version INTEGER NOT NULL
+        );
+    """)
+
+
+def _prescription_changes(c: sqlite3.Connection) -> None:
+    # Append-only feed of prescription writes. seq only grows, so a client
+    # holding the last seq it saw can fetch just what changed since.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS PrescriptionChanges(
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            prescriptionID TEXT NOT NULL,
+            patientID TEXT NOT NULL,
+            doctorID TEXT NOT NULL,
+            pharmID TEXT NOT NULL,
+            deleted INTEGER NOT NULL,
+            changed_at TEXT NOT NULL
+        );
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_PrescriptionChanges_patient ON PrescriptionChanges (patientID, seq);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_PrescriptionChanges_doctor ON PrescriptionChanges (doctorID, seq);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_PrescriptionChanges_pharm ON PrescriptionChanges (pharmID, seq);")
+
+
+def _patient_search(c: sqlite3.Connection) -> None:
+    # Full-text index over the searchable patient fields, keyed by the
+    # Patients rowid. helpers/db.py keeps it in step with the table.
+    c.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS PatientSearch USING fts5(
+            patientID, Name, Email, DOB,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        );
+    """)
+    c.execute("DELETE FROM PatientSearch;")
+    c.execute("""
+        INSERT INTO PatientSearch (rowid, patientID, Name, Email, DOB)
+        SELECT rowid, patientID, Name, Email, DOB FROM Patients;
+    """)
+
+
+_HISTORY_SOURCE = "CASE WHEN json_valid(NEW.PatientHistory) THEN NEW.PatientHistory ELSE '{}' END"
+
+
+def _patient_history_index(c: sqlite3.Connection) -> None:
+    # Allergies and positive family_history flags pulled out of the
+    # PatientHistory JSON into indexed tables. Triggers keep them current
+    # whichever code path writes the column.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS PatientAllergies(
+            patientID TEXT NOT NULL,
+            allergy TEXT NOT NULL,
+            PRIMARY KEY (patientID, allergy)
+        ) WITHOUT ROWID;
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_PatientAllergies_allergy ON PatientAllergies (allergy, patientID);")
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS PatientFamilyHistory(
+            patientID TEXT NOT NULL,
+            condition TEXT NOT NULL,
+            PRIMARY KEY (patientID, condition)
+        ) WITHOUT ROWID;
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_PatientFamilyHistory_condition ON PatientFamilyHistory (condition, patientID);")
+
+    extract = f"""
+        INSERT OR IGNORE INTO PatientAllergies (patientID, allergy)
+        SELECT NEW.patientID, lower(trim(value))
+        FROM json_each({_HISTORY_SOURCE}, '$.allergies')
+        WHERE type = 'text' AND lower(trim(value)) NOT IN ('', 'n/a');
+        INSERT OR IGNORE INTO PatientFamilyHistory (patientID, condition)
+        SELECT NEW.patientID, lower(key)
+        FROM json_each({_HISTORY_SOURCE}, '$.family_history')
+        WHERE type = 'true';
+    """
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_Patients_history_insert AFTER INSERT ON Patients
+        BEGIN
+            {extract}
+        END;
+    """)
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_Patients_history_update AFTER UPDATE OF PatientHistory ON Patients
+        BEGIN
+            DELETE FROM PatientAllergies WHERE patientID = NEW.patientID;
+            DELETE FROM PatientFamilyHistory WHERE patientID = NEW.patientID;
+            {extract}
+        END;
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_Patients_history_delete AFTER DELETE ON Patients
+        BEGIN
+            DELETE FROM PatientAllergies WHERE patientID = OLD.patientID;
+            DELETE FROM PatientFamilyHistory WHERE patientID = OLD.patientID;
+        END;
+    """)
+
+    # Backfill existing patients through the update trigger.
+    c.execute("UPDATE Patients SET PatientHistory = PatientHistory;")
+
+
+def _collection_code_hashes(c: sqlite3.Connection) -> None:
+    # Keyed hash of each collection code, so a pharmacy can look a
+    # prescription up from its code alone; see helpers/collection_codes.py.
+    c.execute("ALTER TABLE Prescriptions ADD COLUMN CollectionCodeHash BLOB;")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_Prescriptions_code_hash ON Prescriptions (pharmID, CollectionCodeHash);")
+    # The backfill is written out here rather than calling the helper, so
+    # this migration keeps doing what it did when it shipped.
+    key = os.environ.get("MEDILINK_COLLECTION_CODE_KEY", "ThisIsACollectionCodeKey").encode("utf-8")
+    rows = c.execute("SELECT prescriptionID, pharmID, CollectionCode FROM Prescriptions").fetchall()
+    c.executemany(
+        "UPDATE Prescriptions SET CollectionCodeHash = ? WHERE prescriptionID = ?",
+        [
+            (hmac.new(key, f"{pharm_id}\0{code}".encode("utf-8"), hashlib.sha256).digest(), prescription_id)
+            for prescription_id, pharm_id, code in rows
+        ],
+    )
+
+
+def _code_failures(c: sqlite3.Connection) -> None:
+    # Wrong collection codes per pharmacy in the current window, shared by
+    # every worker, so guessing codes is throttled; see helpers/medicine.py.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS CollectionCodeFailures(
+            pharmID TEXT NOT NULL PRIMARY KEY,
+            window_start INTEGER NOT NULL,
+            failures INTEGER NOT NULL
+        );
+    """)
+
+
+def _message_blobs(c: sqlite3.Connection) -> None:
+    # Messages.message holds ciphertext (helpers/msg.py) but was declared
+    # TEXT. SQLite cannot change a column type, so rebuild the table with
+    # the same rows, ids and AUTOINCREMENT counter.
+    sequence = c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'Messages'").fetchone()
+    c.execute("""
+        CREATE TABLE Messages_new(
+            messageID INTEGER PRIMARY KEY AUTOINCREMENT,
+            doctorID TEXT NOT NULL,
+            patientID TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            senderID TEXT NOT NULL,
+            message BLOB NOT NULL,
+            timestamp TEXT NOT NULL,
+            UNIQUE (doctorID, patientID, seq),
+            FOREIGN KEY (doctorID, patientID)
+                REFERENCES DPEnrole (doctorID, patientID)
+        );
+    """)
+    c.execute("""
+        INSERT INTO Messages_new (messageID, doctorID, patientID, seq, senderID, message, timestamp)
+        SELECT messageID, doctorID, patientID, seq, senderID, message, timestamp
+        FROM Messages
+    """)
+    c.execute("DROP TABLE Messages;")
+    c.execute("ALTER TABLE Messages_new RENAME TO Messages;")
+    if sequence is not None:
+        c.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'Messages'", (sequence[0],))
+    c.execute("CREATE INDEX IF NOT EXISTS idx_Messages_patient ON Messages (patientID, messageID);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_Messages_timestamp ON Messages (timestamp);")
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "base schema", _base_schema),
+    (2, "messages table", _messages_table),
+    (3, "id sequences", _id_sequences),
+    (4, "query indexes", _query_indexes),
+    (5, "resource versions", _resource_versions),
+    (6, "prescription changes", _prescription_changes),
+    (7, "patient search", _patient_search),
+    (8, "patient history index", _patient_history_index),
+    (9, "collection code hashes", _collection_code_hashes),
+    (10, "collection code failures", _code_failures),
+    (11, "message blobs", _message_blobs),
+]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS SchemaVersion(
+            version INTEGER NOT NULL PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        );
+    """)
+    row = conn.execute("SELECT MAX(version) FROM SchemaVersion").fetchone()
+    return row[0] or 0
+
+
+def apply_migrations(conn: sqlite3.Connection) -> List[int]:
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    applied: List[int] = []
+    try:
+        conn.execute("PRAGMA foreign_keys = ON;")
+        for version, name, migrate in MIGRATIONS:
+            # Re-read the version under the write lock, so several workers
+            # starting together apply each migration once.
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if schema_version(conn) >= version:
+                    conn.execute("COMMIT")
+                    continue
+                migrate(conn)
+                conn.execute(
+                    "INSERT INTO SchemaVersion (version, name, applied_at) VALUES (?, ?, ?)",
+                    (version, name, datetime.now(timezone.utc).isoformat()),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            applied.append(version)
+    finally:
+        conn.isolation_level = isolation_level
+    return applied
@@ -1,102 +1,270 @@
 import json
-from typing import Any, Dict, List
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
 from Crypto.Cipher import AES
-from Crypto.Util.Padding import pad, unpad
+from Crypto.Random import get_random_bytes
+from Crypto.Util.Padding import unpad
 
-from helpers.db import get_db
+from helpers.cache import PageCache
+from helpers.db import get_db, close_db
+from helpers.notify import patient_version, notify_patient, wait_for_patient
 
 # TODO: replace test key/iv with secure key management before production.
 KEY = b"0123456789abcdef0123456789abcdef"
 IV = b"abcdef0123456789"
 
+MESSAGE_PAGE_SIZE = 50
+MAX_MESSAGE_PAGE_SIZE = 200
+# Waiters recheck the database at least this often, which picks up messages
+# sent through another worker process.
+MESSAGE_RECHECK_SECONDS = 5.0
 
-def _safe_json_loads(raw: Any) -> Any:
-    if raw is None:
-        return []
-    if isinstance(raw, (list, dict)):
-        return raw
-    if not isinstance(raw, str) or not raw.strip():
-        return []
-    try:
-        return json.loads(raw)
-    except json.JSONDecodeError:
-        return []
+# Decrypted pages, bounded by their serialized size in bytes. Pages are keyed
+# by the conversation's latest messageID, so a send from any process makes
+# older pages unreachable; sends through this process also drop them at once.
+MESSAGE_CACHE_BYTES = int(os.environ.get("MEDILINK_MESSAGE_CACHE_BYTES", str(32 * 1024 * 1024)))
+MESSAGE_CACHE_ENCRYPT = os.environ.get("MEDILINK_MESSAGE_CACHE_ENCRYPT", "0") == "1"
+_page_cache = PageCache(MESSAGE_CACHE_BYTES, encrypt=MESSAGE_CACHE_ENCRYPT)
 
 
-def _decrypt_message(ciphertext_hex: str) -> str:
+# Stored format, version 1 (a BLOB):
+#   0x01 | 12-byte nonce | 16-byte GCM tag | ciphertext
+# AES-256-GCM with a fresh random nonce per message and the patientID as
+# associated data, so a record cannot be replayed into another patient's
+# thread. Older records are hex TEXT encrypted with AES-CBC under the fixed
+# IV above (e.g. from database/seeder.py); they are still readable.
+_FORMAT_V1 = 1
+_NONCE_SIZE = 12
+_TAG_SIZE = 16
+_HEADER_SIZE = 1 + _NONCE_SIZE + _TAG_SIZE
+
+
+_MESSAGE_COLUMNS = "messageID, senderID, message, timestamp"
+MESSAGE_HISTORY_SQL = f"SELECT {_MESSAGE_COLUMNS} FROM Messages WHERE patientID = ? ORDER BY messageID"
+MESSAGE_PAGE_LATEST_SQL = f"""
+    SELECT {_MESSAGE_COLUMNS} FROM Messages
+    WHERE patientID = ?
+    ORDER BY messageID DESC
+    LIMIT ?
+"""
+MESSAGE_PAGE_BEFORE_SQL = f"""
+    SELECT {_MESSAGE_COLUMNS} FROM Messages
+    WHERE patientID = ? AND messageID < ?
+    ORDER BY messageID DESC
+    LIMIT ?
+"""
+MESSAGE_PAGE_AFTER_SQL = f"""
+    SELECT {_MESSAGE_COLUMNS} FROM Messages
+    WHERE patientID = ? AND messageID > ?
+    ORDER BY messageID
+    LIMIT ?
+"""
+LATEST_MESSAGE_ID_SQL = "SELECT MAX(messageID) AS last_id FROM Messages WHERE patientID = ?"
+APPEND_MESSAGE_SQL = """
+    INSERT INTO Messages (doctorID, patientID, seq, senderID, message, timestamp)
+    SELECT
+        DPEnrole.doctorID,
+        DPEnrole.patientID,
+        (
+            SELECT COALESCE(MAX(seq), 0) + 1
+            FROM Messages
+            WHERE Messages.doctorID = DPEnrole.doctorID
+              AND Messages.patientID = DPEnrole.patientID
+        ),
+        :sender,
+        :message,
+        :timestamp
+    FROM DPEnrole
+    WHERE DPEnrole.patientID = :patient
+      AND (DPEnrole.doctorID = :sender OR :sender = :patient)
+"""
+
+
+def _decrypt_legacy_message(ciphertext_hex: str) -> str:
     ciphertext = bytes.fromhex(ciphertext_hex)
     cipher = AES.new(KEY, AES.MODE_CBC, iv=IV)
     plaintext = unpad(cipher.decrypt(ciphertext), AES.block_size)
     return plaintext.decode("utf-8")
 
 
-def _encrypt_message(plaintext: str) -> str:
-    cipher = AES.new(KEY, AES.MODE_CBC, iv=IV)
-    ciphertext = cipher.encrypt(pad(plaintext.encode("utf-8"), AES.block_size))
-    return ciphertext.hex()
+def _encrypt_message(plaintext: str, patientID: str) -> bytes:
+    nonce = get_random_bytes(_NONCE_SIZE)
+    cipher = AES.new(KEY, AES.MODE_GCM, nonce=nonce, mac_len=_TAG_SIZE)
+    cipher.update(patientID.encode("utf-8"))
+    ciphertext, tag = cipher.encrypt_and_digest(plaintext.encode("utf-8"))
+    return b"".join((bytes((_FORMAT_V1,)), nonce, tag, ciphertext))
+
 
+def _encrypt_messages(items: List[Tuple[str, str]]) -> List[bytes]:
+    # Bulk counterpart of _encrypt_message for (plaintext, patientID) pairs:
+    # all nonces come from one read of the random source.
+    nonces = get_random_bytes(_NONCE_SIZE * len(items))
+    new_cipher = AES.new
+    mode = AES.MODE_GCM
+    header = bytes((_FORMAT_V1,))
+    join = b"".join
+    records: List[bytes] = []
+    append = records.append
+    for i, (plaintext, patientID) in enumerate(items):
+        nonce = nonces[i * _NONCE_SIZE:(i + 1) * _NONCE_SIZE]
+        cipher = new_cipher(KEY, mode, nonce=nonce, mac_len=_TAG_SIZE)
+        cipher.update(patientID.encode("utf-8"))
+        ciphertext, tag = cipher.encrypt_and_digest(plaintext.encode("utf-8"))
+        append(join((header, nonce, tag, ciphertext)))
+    return records
 
-def _decrypt_history(msg_history: Any) -> List[Dict[str, Any]]:
-    items = _safe_json_loads(msg_history)
-    if not isinstance(items, list):
-        return []
 
+def _decrypt_message(record: Any, patientID: str) -> str:
+    if isinstance(record, str):
+        return _decrypt_legacy_message(record)
+    view = memoryview(record)
+    if len(view) < _HEADER_SIZE or view[0] != _FORMAT_V1:
+        raise ValueError("Unknown message format")
+    cipher = AES.new(KEY, AES.MODE_GCM, nonce=view[1:1 + _NONCE_SIZE], mac_len=_TAG_SIZE)
+    cipher.update(patientID.encode("utf-8"))
+    plaintext = cipher.decrypt_and_verify(view[_HEADER_SIZE:], view[1 + _NONCE_SIZE:_HEADER_SIZE])
+    return plaintext.decode("utf-8")
+
+
+def _decrypt_messages(rows: List[Any], patientID: str) -> List[Dict[str, Any]]:
+    # Bulk path for a page of rows: the per-call constants are hoisted out of
+    # the loop and records are sliced through memoryviews, not copied.
+    # Unreadable records come back with message set to None.
+    aad = patientID.encode("utf-8")
+    new_cipher = AES.new
+    mode = AES.MODE_GCM
     decrypted: List[Dict[str, Any]] = []
-    for item in items:
-        if not isinstance(item, dict):
-            continue
-        msg = item.get("message")
-        if isinstance(msg, str):
-            try:
-                item = dict(item)
-                item["message"] = _decrypt_message(msg)
-            except Exception:
-                pass
-        decrypted.append(item)
+    append = decrypted.append
+    for row in rows:
+        record = row["message"]
+        try:
+            if isinstance(record, str):
+                message = _decrypt_legacy_message(record)
+            else:
+                view = memoryview(record)
+                if len(view) < _HEADER_SIZE or view[0] != _FORMAT_V1:
+                    raise ValueError("Unknown message format")
+                cipher = new_cipher(KEY, mode, nonce=view[1:1 + _NONCE_SIZE], mac_len=_TAG_SIZE)
+                cipher.update(aad)
+                message = cipher.decrypt_and_verify(
+                    view[_HEADER_SIZE:], view[1 + _NONCE_SIZE:_HEADER_SIZE]
+                ).decode("utf-8")
+        except (ValueError, KeyError, UnicodeDecodeError):
+            message = None
+        append({
+            "id": row["messageID"],
+            "sender": row["senderID"],
+            "message": message,
+            "timestamp": row["timestamp"],
+        })
     return decrypted
 
 
 def get_patient_msg_history(patientID: str, decrypt: bool = True) -> List[Dict[str, Any]]:
     db = get_db()
-    rows = db.execute(
-        """
-        SELECT doctorID, patientID, msgHistory
-        FROM DPEnrole
-        WHERE patientID = ?
-        """,
-        (patientID,),
-    ).fetchall()
-
-    results: List[Dict[str, Any]] = []
-    for row in rows:
-        if decrypt:
-            results.extend(_decrypt_history(row["msgHistory"]))
+    rows = db.execute(MESSAGE_HISTORY_SQL, (patientID,)).fetchall()
+
+    if decrypt:
+        return _decrypt_messages(rows, patientID)
+    return [
+        {
+            "id": row["messageID"],
+            "sender": row["senderID"],
+            "message": row["message"],
+            "timestamp": row["timestamp"],
+        }
+        for row in rows
+    ]
+
+
+def get_patient_msg_page(
+    patientID: str,
+    limit: int = MESSAGE_PAGE_SIZE,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    # Messages come back oldest first. Without a cursor, or with `before`, the
+    # page is the newest `limit` messages older than the cursor and
+    # next_cursor points further back. With `after` the page walks forward and
+    # next_cursor is the last id on the page while newer messages remain.
+    # Only the rows on the page are read and decrypted.
+    limit = max(1, min(limit, MAX_MESSAGE_PAGE_SIZE))
+    cache_key = (latest_message_id(patientID), limit, before, after)
+    cached = _page_cache.get(patientID, cache_key)
+    if cached is not None:
+        page = json.loads(cached)
+        return page["messages"], page["next_cursor"]
+
+    db = get_db()
+    if after is not None:
+        rows = db.execute(MESSAGE_PAGE_AFTER_SQL, (patientID, after, limit + 1)).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = rows[-1]["messageID"] if has_more else None
+    else:
+        if before is not None:
+            rows = db.execute(MESSAGE_PAGE_BEFORE_SQL, (patientID, before, limit + 1)).fetchall()
         else:
-            results.extend(_safe_json_loads(row["msgHistory"]))
-    return results
+            rows = db.execute(MESSAGE_PAGE_LATEST_SQL, (patientID, limit + 1)).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+        next_cursor = rows[0]["messageID"] if has_more else None
 
+    messages = _decrypt_messages(rows, patientID)
+    _page_cache.set(
+        patientID,
+        cache_key,
+        json.dumps({"messages": messages, "next_cursor": next_cursor}).encode("utf-8"),
+    )
+    return messages, next_cursor
 
-def append_message_history(patientID: str, senderID: str, message: str, timestamp: str) -> int:
-    new_item = {
-        "sender": senderID,
-        "message": _encrypt_message(message),
-        "timestamp": timestamp,
-    }
-    items = get_patient_msg_history(patientID, decrypt=False)
-    if not isinstance(items, list):
-        items = []
-    items.extend([new_item])
-    new_history = json.dumps(items)
 
+def latest_message_id(patientID: str) -> int:
+    db = get_db()
+    row = db.execute(LATEST_MESSAGE_ID_SQL, (patientID,)).fetchone()
+    return row["last_id"] or 0
+
+
+def wait_for_messages(patientID: str, after: int, timeout: float) -> Tuple[List[Dict[str, Any]], int]:
+    deadline = time.monotonic() + timeout
+    while True:
+        # Read the version before querying so a send that lands in between
+        # makes the wait below return straight away.
+        version = patient_version(patientID)
+        messages, _ = get_patient_msg_page(patientID, MAX_MESSAGE_PAGE_SIZE, after=after)
+        if messages:
+            return messages, messages[-1]["id"]
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return [], after
+        # Don't hold a database connection while idle.
+        close_db()
+        wait_for_patient(patientID, version, min(remaining, MESSAGE_RECHECK_SECONDS))
+
+
+def message_cache_stats() -> Dict[str, float]:
+    return _page_cache.stats()
+
+
+def append_message_history(patientID: str, senderID: str, message: str, timestamp: str) -> int:
+    # A doctor writes to their own conversation, a patient to each of their
+    # enrolments. seq comes from the (doctorID, patientID, seq) unique index,
+    # so a send is one INSERT regardless of how long the conversation is.
     db = get_db()
     cur = db.execute(
-        """
-        UPDATE DPEnrole
-        SET msgHistory = ?
-        WHERE patientID = ?
-        """,
-        (new_history, patientID),
+        APPEND_MESSAGE_SQL,
+        {
+            "patient": patientID,
+            "sender": senderID,
+            "message": _encrypt_message(message, patientID),
+            "timestamp": timestamp,
+        },
     )
     db.commit()
+    if cur.rowcount > 0:
+        _page_cache.invalidate(patientID)
+        notify_patient(patientID)
     return cur.rowcount
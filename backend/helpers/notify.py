@@ -0,0 +1,27 @@
+import threading
+from typing import Dict
+
+# In-process wake-ups for message subscribers. Each patient has a version
+# number that append_message_history bumps; waiters block until it moves.
+# Other worker processes are not notified, so waiters should still recheck
+# the database when their wait times out.
+
+_condition = threading.Condition()
+_versions: Dict[str, int] = {}
+
+
+def patient_version(patientID: str) -> int:
+    with _condition:
+        return _versions.get(patientID, 0)
+
+
+def notify_patient(patientID: str) -> None:
+    with _condition:
+        _versions[patientID] = _versions.get(patientID, 0) + 1
+        _condition.notify_all()
+
+
+def wait_for_patient(patientID: str, version: int, timeout: float) -> int:
+    with _condition:
+        _condition.wait_for(lambda: _versions.get(patientID, 0) != version, timeout)
+        return _versions.get(patientID, 0)
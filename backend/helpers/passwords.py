@@ -0,0 +1,99 @@
+import multiprocessing
+import os
+import threading
+from functools import lru_cache
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Password KDFs are deliberately slow, so they run in a process pool instead
+# of on the request thread.
+#   MEDILINK_HASH_WORKERS      pool processes; 0 hashes inline. Each server
+#                              worker has its own pool, so the default
+#                              splits the CPUs across MEDILINK_WORKERS
+#   MEDILINK_HASH_QUEUE_SIZE   hashes running or queued before callers get a 503
+#   MEDILINK_HASH_TIMEOUT      seconds to wait for a result
+#   MEDILINK_PASSWORD_HASH_METHOD  Werkzeug method string for new hashes
+_default_hash_workers = max(1, (os.cpu_count() or 2) // int(os.environ.get("MEDILINK_WORKERS", "1")))
+HASH_WORKERS = int(os.environ.get("MEDILINK_HASH_WORKERS", str(_default_hash_workers)))
+HASH_QUEUE_SIZE = int(os.environ.get("MEDILINK_HASH_QUEUE_SIZE", "64"))
+HASH_TIMEOUT = float(os.environ.get("MEDILINK_HASH_TIMEOUT", "10"))
+PASSWORD_HASH_METHOD = os.environ.get("MEDILINK_PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+
+
+class HashingUnavailable(Exception):
+    pass
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_pid: Optional[int] = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(HASH_QUEUE_SIZE)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            # spawn rather than fork: the server process is multi-threaded.
+            _executor = ProcessPoolExecutor(
+                max_workers=HASH_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _run(fn: Callable[..., Any], *args: Any) -> Any:
+    if HASH_WORKERS <= 0:
+        return fn(*args)
+    if not _slots.acquire(blocking=False):
+        raise HashingUnavailable("Too many password operations in progress")
+    try:
+        future: Future = _get_executor().submit(fn, *args)
+    except BrokenProcessPool:
+        _slots.release()
+        shutdown_hashing()
+        raise HashingUnavailable("Password workers restarting")
+    except Exception:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=HASH_TIMEOUT)
+    except TimeoutError:
+        future.cancel()
+        raise HashingUnavailable("Password operation timed out")
+    except BrokenProcessPool:
+        # A worker died; start a fresh pool on the next call.
+        shutdown_hashing()
+        raise HashingUnavailable("Password workers restarting")
+
+
+def hash_password(password: str) -> str:
+    return _run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+def verify_password(password_hash: str, password: str) -> bool:
+    return _run(check_password_hash, password_hash, password)
+
+
+@lru_cache(maxsize=None)
+def _method_prefix() -> str:
+    # Werkzeug fills in defaults ("pbkdf2" is stored as
+    # "pbkdf2:sha256:1000000"), so compare against a real hash's prefix.
+    return generate_password_hash("", PASSWORD_HASH_METHOD).split("$", 1)[0]
+
+
+def needs_rehash(password_hash: str) -> bool:
+    return password_hash.split("$", 1)[0] != _method_prefix()
+
+
+def shutdown_hashing() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None and _executor_pid == os.getpid():
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
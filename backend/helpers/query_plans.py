@@ -0,0 +1,104 @@
+import sqlite3
+from typing import List, Tuple
+
+from helpers import auth, db, history, ids, medicine, msg, versions
+from helpers.db import ROLE_ID_COLUMN, ROLE_TABLE
+from helpers.medicine import ROLE_PRESCRIPTION_COLUMN
+
+# The hot queries issued by app.py and helpers/*.py, with placeholder
+# parameters. The statements are the constants and builders the helpers
+# execute, so a changed query is checked as it runs: check_query_plans fails
+# if any of them has to scan one of LARGE_TABLES.
+#
+# Not listed: the one-off MAX(SUBSTR(...)) scan helpers/ids.py runs the first
+# time a prefix is used, and the collection code hash backfills (migration 9
+# and hash_missing_collection_codes).
+
+LARGE_TABLES = {
+    "Patients", "Doctors", "Pharmacies", "DPEnrole", "Messages", "Prescriptions",
+    "PrescriptionChanges", "PatientAllergies", "PatientFamilyHistory",
+}
+
+
+def known_queries() -> List[Tuple[str, str, tuple]]:
+    queries: List[Tuple[str, str, tuple]] = []
+
+    for role, table in ROLE_TABLE.items():
+        id_column = ROLE_ID_COLUMN[role]
+        queries += [
+            (f"user_info {role}", db.user_info_sql(role, id_column), ("x",)),
+            (f"user_info {role} by email", db.user_info_sql(role, "Email"), ("x",)),
+            (f"login_user {role}", auth.LOGIN_SQL.format(table=table), ("x",)),
+            (f"login_user {role} rehash", auth.REHASH_SQL.format(table=table, id_column=id_column), ("x", "y", "z")),
+            (f"register_user {role} email check", auth.EMAIL_TAKEN_SQL.format(table=table), ("x",)),
+            (f"update_by_id {table}", db.update_by_id_sql(table, ["Name"]), ("x", "y")),
+        ]
+    queries += [
+        ("register_user doctor check", auth.DOCTOR_EXISTS_SQL, ("x",)),
+        ("is_doctor_enrolled", db.IS_DOCTOR_ENROLLED_SQL, ("x", "y")),
+        ("get_assigned_doctor", db.ASSIGNED_DOCTOR_SQL, ("x",)),
+        ("get_assigned_patients", db.ASSIGNED_PATIENTS_SQL, ("x",)),
+        ("search_patients", db.SEARCH_PATIENTS_SQL, ("x", '"y"*', 21, 0)),
+        ("index_patient delete", db.INDEX_PATIENT_DELETE_SQL, ("x",)),
+        ("index_patient insert", db.INDEX_PATIENT_INSERT_SQL, ("x",)),
+        ("patient list versions", db.PATIENT_DOCTORS_SQL, ("x",)),
+        ("patch_patient_history", *history.compile_patch("x", [
+            {"op": "replace", "path": "/allergies/0", "value": "x"},
+            {"op": "add", "path": "/allergies/-", "value": "y"},
+        ])),
+        ("patch_patient_history exists", history.PATIENT_EXISTS_SQL, ("x",)),
+        # Bodies of the PatientHistory triggers (helpers/migrations.py).
+        ("history trigger allergies", "DELETE FROM PatientAllergies WHERE patientID = ?", ("x",)),
+        ("history trigger family history", "DELETE FROM PatientFamilyHistory WHERE patientID = ?", ("x",)),
+        ("patient_cohort", history.cohort_sql(1, 1), ("x", "y", "z", history.COHORT_LIMIT)),
+        ("id sequence", ids.NEXT_VALUE_SQL, ("x",)),
+        ("id sequence advance", ids.ADVANCE_SEQUENCE_SQL, (1, "x")),
+        ("resource version", versions.RESOURCE_VERSION_SQL, ("x",)),
+        ("bump version", versions.BUMP_VERSION_SQL, ("x",)),
+    ]
+
+    queries += [
+        ("message page latest", msg.MESSAGE_PAGE_LATEST_SQL, ("x", 51)),
+        ("message page before", msg.MESSAGE_PAGE_BEFORE_SQL, ("x", 1, 51)),
+        ("message page after", msg.MESSAGE_PAGE_AFTER_SQL, ("x", 1, 51)),
+        ("message history", msg.MESSAGE_HISTORY_SQL, ("x",)),
+        ("latest message id", msg.LATEST_MESSAGE_ID_SQL, ("x",)),
+        (
+            "append message",
+            msg.APPEND_MESSAGE_SQL,
+            {"sender": "x", "message": b"m", "timestamp": "t", "patient": "y"},
+        ),
+    ]
+
+    for role in ROLE_PRESCRIPTION_COLUMN:
+        queries += [
+            (f"list_prescriptions {role}", medicine.list_prescriptions_sql(role), ("x", 101)),
+            (f"list_prescriptions {role} cursor", medicine.list_prescriptions_sql(role, cursor=True), ("x", "y", 101)),
+            (f"latest_prescription_change {role}", medicine.latest_change_sql(role), ("x",)),
+            (f"prescription_changes {role}", medicine.changes_sql(role), ("x", 0, 501)),
+            (f"prescription_changes {role} rows", medicine.prescriptions_by_id_sql(role, 2), ("x", "y", "z")),
+            (f"fetch_prescription_details {role}", medicine.fetch_prescription_sql(role), ("x", "y")),
+        ]
+    queries += [
+        ("create_prescriptions enrolment", medicine.enrolled_patients_sql(2), ("x", "y", "z")),
+        ("create_prescriptions pharmacies", medicine.pharmacies_sql(2), ("x", "y")),
+        ("collect lookup", medicine.collectable_sql(2), ("x", "y", "z")),
+        ("collect rotate", medicine.ROTATE_CODE_SQL, ("x", b"y", "z")),
+        ("collect delete", medicine.DELETE_PRESCRIPTION_SQL, ("x",)),
+        ("find_prescriptions_by_code", medicine.FIND_BY_CODE_SQL, ("x", b"y", medicine.MAX_CODE_MATCHES)),
+        ("take_code_attempt", medicine.TAKE_CODE_ATTEMPT_SQL, ("x", 0, 0, medicine.CODE_MAX_FAILURES + 1, 0)),
+        ("refund_code_attempt", medicine.REFUND_CODE_ATTEMPT_SQL, ("x",)),
+    ]
+    return queries
+
+
+def check_query_plans(conn: sqlite3.Connection) -> List[Tuple[str, str]]:
+    # Returns (query name, plan line) for every full scan of a large table.
+    failures: List[Tuple[str, str]] = []
+    for name, sql, params in known_queries():
+        for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall():
+            detail = row[-1]
+            words = detail.split()
+            if len(words) >= 2 and words[0] == "SCAN" and words[1] in LARGE_TABLES:
+                failures.append((name, detail))
+    return failures
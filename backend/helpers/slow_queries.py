@@ -0,0 +1,150 @@
+import json
+import logging
+import logging.handlers
+import os
+import re
+import sqlite3
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from flask import has_request_context, request
+
+# Opt-in slow-query log. With MEDILINK_SLOW_QUERY_MS set, every statement a
+# pool connection runs for at least that long is written as one JSON line:
+# normalized SQL, parameter types, route, elapsed time and the statement's
+# EXPLAIN QUERY PLAN. database/slow_query_report.py ranks the result.
+#
+#   MEDILINK_SLOW_QUERY_MS         threshold in milliseconds (unset: off)
+#   MEDILINK_SLOW_QUERY_LOG        log file path
+#   MEDILINK_SLOW_QUERY_MAX_BYTES  rotate after this many bytes
+#   MEDILINK_SLOW_QUERY_BACKUPS    rotated files to keep
+#
+# Each worker process should get its own log path; rotation is not safe
+# across processes.
+
+_threshold = os.environ.get("MEDILINK_SLOW_QUERY_MS")
+SLOW_QUERY_SECONDS: Optional[float] = float(_threshold) / 1000 if _threshold else None
+SLOW_QUERY_LOG = Path(os.environ.get(
+    "MEDILINK_SLOW_QUERY_LOG",
+    Path(__file__).resolve().parent.parent.parent / "database" / "slow-queries.jsonl",
+))
+SLOW_QUERY_MAX_BYTES = int(os.environ.get("MEDILINK_SLOW_QUERY_MAX_BYTES", str(10 * 1024 * 1024)))
+SLOW_QUERY_BACKUPS = int(os.environ.get("MEDILINK_SLOW_QUERY_BACKUPS", "5"))
+
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+_logger: Optional[logging.Logger] = None
+
+
+def _get_logger() -> logging.Logger:
+    global _logger
+    if _logger is None:
+        SLOW_QUERY_LOG.parent.mkdir(parents=True, exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(
+            SLOW_QUERY_LOG,
+            maxBytes=SLOW_QUERY_MAX_BYTES,
+            backupCount=SLOW_QUERY_BACKUPS,
+            encoding="utf-8",
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger = logging.getLogger("medilink.slow_queries")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(handler)
+        _logger = logger
+    return _logger
+
+
+def normalize_sql(sql: str) -> str:
+    # Literals become ?, IN lists collapse, whitespace is squeezed, so one
+    # statement shape maps to one key whatever its values or list length.
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"(?<![\w.])-?\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", "IN (?...)", sql, flags=re.IGNORECASE)
+    return " ".join(sql.split())
+
+
+def param_shape(params: Any) -> Any:
+    # Types of the bound values, with runs collapsed: ["str", "int*3"].
+    if isinstance(params, dict):
+        return {key: type(value).__name__ for key, value in params.items()}
+    shape: List[str] = []
+    previous, run = None, 0
+    for value in params or ():
+        name = type(value).__name__
+        if name == previous:
+            run += 1
+            continue
+        if previous is not None:
+            shape.append(previous if run == 1 else f"{previous}*{run}")
+        previous, run = name, 1
+    if previous is not None:
+        shape.append(previous if run == 1 else f"{previous}*{run}")
+    return shape
+
+
+def _query_plan(conn: sqlite3.Connection, sql: str, params: Any) -> List[str]:
+    if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+        return []
+    try:
+        # The base class execute, so the EXPLAIN is not itself timed.
+        rows = sqlite3.Connection.execute(conn, f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    except sqlite3.Error:
+        return []
+    return [row[-1] for row in rows]
+
+
+def record_slow_query(conn: sqlite3.Connection, sql: str, params: Any, elapsed: float, rows: Optional[int] = None) -> None:
+    route = None
+    if has_request_context():
+        route = f"{request.method} {request.url_rule.rule if request.url_rule else request.path}"
+    entry = {
+        "at": datetime.now(timezone.utc).isoformat(),
+        "elapsed_ms": round(elapsed * 1000, 3),
+        "sql": normalize_sql(sql),
+        "params": param_shape(params),
+        "route": route,
+        "plan": _query_plan(conn, sql, params),
+    }
+    if rows is not None:
+        entry["executemany_rows"] = rows
+    try:
+        _get_logger().info(json.dumps(entry))
+    except OSError:
+        pass
+
+
+def summarize(paths: Iterable[Path]) -> List[Dict[str, Any]]:
+    # One row per normalized statement, slowest total time first.
+    stats: Dict[str, Dict[str, Any]] = defaultdict(lambda: {
+        "count": 0, "total_ms": 0.0, "max_ms": 0.0, "routes": set(), "plan": [],
+    })
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                item = stats[entry["sql"]]
+                item["count"] += 1
+                item["total_ms"] += entry["elapsed_ms"]
+                if entry["elapsed_ms"] >= item["max_ms"]:
+                    item["max_ms"] = entry["elapsed_ms"]
+                    item["plan"] = entry.get("plan") or []
+                if entry.get("route"):
+                    item["routes"].add(entry["route"])
+    summary = []
+    for sql, item in stats.items():
+        summary.append({
+            "sql": sql,
+            "count": item["count"],
+            "total_ms": round(item["total_ms"], 3),
+            "mean_ms": round(item["total_ms"] / item["count"], 3),
+            "max_ms": item["max_ms"],
+            "routes": sorted(item["routes"]),
+            "plan": item["plan"],
+        })
+    summary.sort(key=lambda item: item["total_ms"], reverse=True)
+    return summary
@@ -0,0 +1,290 @@
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import string
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from werkzeug.security import generate_password_hash
+
+from helpers.collection_codes import collection_code_hash
+from helpers.db import index_missing_patients
+from helpers.ids import reserve_ids
+from helpers.migrations import apply_migrations
+from helpers.msg import _encrypt_messages
+from helpers.passwords import PASSWORD_HASH_METHOD
+
+# Synthetic data for staging, benchmarks and tests. Everything is drawn from
+# one random.Random(seed), so the same arguments give the same names, links
+# and message text (IDs also depend on what the database already holds).
+# Rows go in through executemany in transactions of `batch_size` rows, and
+# messages are encrypted in bulk on `workers` processes.
+#
+# Every generated account has the password GENERATED_PASSWORD and the email
+# synthetic_email(user_id); the password is hashed once and the hash shared.
+
+GENERATED_PASSWORD = "medilink-synthetic"
+EMAIL_DOMAIN = "synthetic.test"
+DEFAULT_BATCH_SIZE = 50000
+
+_FIRST_NAMES = [
+    "Alex", "Bea", "Chen", "Dana", "Emeka", "Fatima", "George", "Hana", "Ivan", "Jun",
+    "Kofi", "Lena", "Mateo", "Nia", "Omar", "Priya", "Quinn", "Rosa", "Sami", "Tariq",
+    "Uma", "Viktor", "Wen", "Ximena", "Yusuf", "Zoe",
+]
+_LAST_NAMES = [
+    "Adeyemi", "Brown", "Costa", "Dubois", "Evans", "Fischer", "Garcia", "Haddad", "Ito",
+    "Jensen", "Kim", "Lopez", "Murphy", "Nguyen", "Okafor", "Patel", "Rossi", "Silva",
+    "Tanaka", "Ward", "Yilmaz", "Zhang",
+]
+_SPECIALISATIONS = [None, "General Practice", "Cardiology", "Dermatology", "Endocrinology", "Paediatrics", "Psychiatry"]
+_PHARMACY_WORDS = ["Central", "Riverside", "Hillcrest", "Market", "Station", "Park", "Harbour", "Village"]
+_ALLERGIES = ["penicillin", "peanuts", "latex", "aspirin", "shellfish", "pollen", "sulfa drugs", "ibuprofen"]
+_ILLNESSES = ["asthma", "hypertension", "type 2 diabetes", "migraine", "eczema", "bronchitis", "anaemia"]
+_SURGERIES = ["appendectomy", "tonsillectomy", "knee arthroscopy", "cataract surgery", "hernia repair"]
+_FAMILY_CONDITIONS = ["diabetes", "heart_disease", "cancer", "stroke"]
+_MEDICINES = [
+    "Amoxicillin", "Atorvastatin", "Metformin", "Lisinopril", "Omeprazole", "Salbutamol",
+    "Sertraline", "Levothyroxine", "Amlodipine", "Cetirizine", "Ibuprofen", "Paracetamol",
+]
+_INSTRUCTIONS = [
+    "Take once daily with food",
+    "Take twice daily after meals",
+    "Take once daily before bed",
+    "Take as needed, no more than four times a day",
+    "Apply to the affected area twice daily",
+]
+_PHRASES = [
+    "How have you been feeling since our last appointment?",
+    "Much better, thank you.",
+    "The new dose seems to be working.",
+    "I have had some headaches this week.",
+    "Please book a follow-up for next month.",
+    "Can I take this with my other medication?",
+    "Yes, that is fine, but keep an eye on any dizziness.",
+    "Your test results came back normal.",
+    "I will send a new prescription to your pharmacy.",
+    "Thanks, I will pick it up tomorrow.",
+]
+
+
+def synthetic_email(user_id: str) -> str:
+    return f"{user_id.lower()}@{EMAIL_DOMAIN}"
+
+
+def _random_name(rng: random.Random) -> str:
+    return f"{rng.choice(_FIRST_NAMES)} {rng.choice(_LAST_NAMES)}"
+
+
+def _random_date(rng: random.Random, start: date, end: date) -> date:
+    return start + timedelta(days=rng.randint(0, (end - start).days))
+
+
+def _patient_history(rng: random.Random) -> str:
+    return json.dumps({
+        "allergies": rng.sample(_ALLERGIES, rng.randint(0, 2)) or ["N/A"],
+        "past_illnesses": rng.sample(_ILLNESSES, rng.randint(0, 2)) or ["N/A"],
+        "surgeries": rng.sample(_SURGERIES, rng.randint(0, 1)) or ["N/A"],
+        "family_history": {condition: rng.random() < 0.2 for condition in _FAMILY_CONDITIONS},
+    })
+
+
+def _assign_ids(conn: sqlite3.Connection, rng: random.Random, table: str, id_column: str, count: int) -> List[str]:
+    # Random two-letter prefixes like the app's own IDs, with the numbers for
+    # each prefix reserved through IdSequences in one claim.
+    prefixes = ["".join(rng.choices(string.ascii_uppercase, k=2)) for _ in range(count)]
+    reserved = {
+        prefix: iter(reserve_ids(conn, table, id_column, prefix, n))
+        for prefix, n in Counter(prefixes).items()
+    }
+    return [next(reserved[prefix]) for prefix in prefixes]
+
+
+def _insert_batched(conn: sqlite3.Connection, sql: str, rows, batch_size: int) -> int:
+    count = 0
+    batch: List[tuple] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            conn.executemany(sql, batch)
+            conn.commit()
+            count += len(batch)
+            batch = []
+    if batch:
+        conn.executemany(sql, batch)
+        conn.commit()
+        count += len(batch)
+    return count
+
+
+def _insert_messages(
+    conn: sqlite3.Connection,
+    rng: random.Random,
+    enrolments: List[Tuple[str, str]],
+    per_conversation: int,
+    batch_size: int,
+    workers: int,
+) -> int:
+    # Encryption is most of the cost, so with workers > 1 each batch is
+    # encrypted in a process pool while earlier batches are being written.
+    executor = None
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    pending: Deque[Tuple[list, Any]] = deque()
+    count = 0
+
+    def write(meta: list, records: List[bytes]) -> None:
+        conn.executemany(
+            """
+            INSERT INTO Messages (doctorID, patientID, seq, senderID, message, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [(d, p, seq, sender, record, ts) for (d, p, seq, sender, ts), record in zip(meta, records)],
+        )
+        conn.commit()
+
+    def submit(meta: list, plaintexts: List[Tuple[str, str]]) -> None:
+        if executor is None:
+            write(meta, _encrypt_messages(plaintexts))
+            return
+        pending.append((meta, executor.submit(_encrypt_messages, plaintexts)))
+        while len(pending) > workers:
+            done_meta, future = pending.popleft()
+            write(done_meta, future.result())
+
+    try:
+        meta: list = []
+        plaintexts: List[Tuple[str, str]] = []
+        for doctor_id, patient_id in enrolments:
+            sent = datetime(2024, 1, 1) + timedelta(minutes=rng.randint(0, 365 * 24 * 60))
+            for seq in range(1, per_conversation + 1):
+                sent += timedelta(minutes=rng.randint(1, 3 * 24 * 60))
+                sender = doctor_id if rng.random() < 0.5 else patient_id
+                meta.append((doctor_id, patient_id, seq, sender, sent.isoformat(timespec="seconds")))
+                plaintexts.append((rng.choice(_PHRASES), patient_id))
+                if len(meta) >= batch_size:
+                    count += len(meta)
+                    submit(meta, plaintexts)
+                    meta, plaintexts = [], []
+        if meta:
+            count += len(meta)
+            submit(meta, plaintexts)
+        while pending:
+            done_meta, future = pending.popleft()
+            write(done_meta, future.result())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    return count
+
+
+def generate(
+    conn: sqlite3.Connection,
+    patients: int = 1000,
+    doctors: int = 20,
+    pharmacies: int = 10,
+    messages_per_conversation: int = 20,
+    prescriptions_per_patient: int = 2,
+    seed: int = 1,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    workers: Optional[int] = None,
+) -> Dict[str, Any]:
+    if patients and not doctors:
+        raise ValueError("patients need at least one doctor")
+    if prescriptions_per_patient and patients and not pharmacies:
+        raise ValueError("prescriptions need at least one pharmacy")
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    rng = random.Random(seed)
+    apply_migrations(conn)
+    conn.commit()
+    # This connection only loads data that can be regenerated; skip fsyncs.
+    conn.execute("PRAGMA synchronous = OFF;")
+    password_hash = generate_password_hash(GENERATED_PASSWORD, method=PASSWORD_HASH_METHOD)
+
+    doctor_ids = _assign_ids(conn, rng, "Doctors", "doctorID", doctors)
+    pharmacy_ids = _assign_ids(conn, rng, "Pharmacies", "pharmID", pharmacies)
+    patient_ids = _assign_ids(conn, rng, "Patients", "patientID", patients)
+    enrolments = [(rng.choice(doctor_ids), patient_id) for patient_id in patient_ids]
+    prescription_count = patients * prescriptions_per_patient
+    prescription_ids = _assign_ids(conn, rng, "Prescriptions", "prescriptionID", prescription_count)
+
+    _insert_batched(
+        conn,
+        "INSERT INTO Doctors (doctorID, Name, Email, PasswordHash, Specialisation) VALUES (?, ?, ?, ?, ?)",
+        (
+            (d, f"Dr. {_random_name(rng)}", synthetic_email(d), password_hash, rng.choice(_SPECIALISATIONS))
+            for d in doctor_ids
+        ),
+        batch_size,
+    )
+    _insert_batched(
+        conn,
+        "INSERT INTO Pharmacies (pharmID, Email, PasswordHash, Name) VALUES (?, ?, ?, ?)",
+        (
+            (p, synthetic_email(p), password_hash, f"{rng.choice(_PHARMACY_WORDS)} Pharmacy")
+            for p in pharmacy_ids
+        ),
+        batch_size,
+    )
+    _insert_batched(
+        conn,
+        """
+        INSERT INTO Patients (patientID, Name, Email, PasswordHash, PatientHistory, DOB)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        (
+            (
+                p, _random_name(rng), synthetic_email(p), password_hash, _patient_history(rng),
+                _random_date(rng, date(1930, 1, 1), date(2020, 12, 31)).isoformat(),
+            )
+            for p in patient_ids
+        ),
+        batch_size,
+    )
+    index_missing_patients(conn)
+    conn.commit()
+    _insert_batched(conn, "INSERT INTO DPEnrole (doctorID, patientID) VALUES (?, ?)", enrolments, batch_size)
+
+    message_count = _insert_messages(conn, rng, enrolments, messages_per_conversation, batch_size, workers)
+
+    def prescription_rows():
+        ids = iter(prescription_ids)
+        for doctor_id, patient_id in enrolments:
+            for _ in range(prescriptions_per_patient):
+                row = (
+                    patient_id, next(ids), doctor_id, rng.choice(pharmacy_ids),
+                    ", ".join(rng.sample(_MEDICINES, rng.randint(1, 2))),
+                    rng.choice(_INSTRUCTIONS),
+                    _random_date(rng, date(2023, 1, 1), date(2025, 12, 31)).isoformat(),
+                    rng.choice(("Lifetime", "Temporary")),
+                    f"{rng.randint(0, 999999):06d}",
+                )
+                yield row + (collection_code_hash(row[3], row[8]),)
+
+    _insert_batched(
+        conn,
+        """
+        INSERT INTO Prescriptions (patientID, prescriptionID, doctorID, pharmID, MedicineName,
+            Instructions, DatePrescribed, DurationType, CollectionCode, CollectionCodeHash)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        prescription_rows(),
+        batch_size,
+    )
+    conn.execute("ANALYZE")
+    conn.commit()
+
+    return {
+        "patients": patient_ids,
+        "doctors": doctor_ids,
+        "pharmacies": pharmacy_ids,
+        "enrolments": {patient_id: doctor_id for doctor_id, patient_id in enrolments},
+        "messages": message_count,
+        "prescriptions": prescription_count,
+    }
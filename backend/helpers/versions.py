@@ -0,0 +1,44 @@
+import sqlite3
+from typing import Iterable
+
+# Version counters behind the ETags on read-heavy routes. Each write bumps
+# the counters of the resources it changes, in the same transaction, so any
+# worker process can answer a conditional GET with one primary-key lookup
+# instead of rebuilding the response. A missing row is version 0.
+#
+# Message threads need no counter of their own: a thread's latest messageID
+# already grows with every send (see helpers.msg.latest_message_id).
+
+RESOURCE_VERSION_SQL = "SELECT version FROM ResourceVersions WHERE name = ?"
+BUMP_VERSION_SQL = """
+    INSERT INTO ResourceVersions (name, version) VALUES (?, 1)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1
+"""
+
+
+def profile_resource(role: str, user_id: str) -> str:
+    return f"profile:{role}:{user_id}"
+
+
+def profile_resource_sql(role: str, id_column: str) -> str:
+    # profile_resource as an SQL expression over an id column, so a query can
+    # read a row and its version in one statement.
+    return f"'profile:{role}:' || {id_column}"
+
+
+def prescriptions_resource(role: str, user_id: str) -> str:
+    return f"prescriptions:{role}:{user_id}"
+
+
+def patient_list_resource(doctor_id: str) -> str:
+    return f"patients:{doctor_id}"
+
+
+def resource_version(db: sqlite3.Connection, name: str) -> int:
+    row = db.execute(RESOURCE_VERSION_SQL, (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def bump_versions(db: sqlite3.Connection, names: Iterable[str]) -> None:
+    # Does not commit; callers bump inside the write they are making.
+    db.executemany(BUMP_VERSION_SQL, [(name,) for name in set(names)])
@@ -0,0 +1,4 @@
+from app import app, migrate_database
+
+# WSGI entry point for production servers: gunicorn -c gunicorn.conf.py wsgi:app
+migrate_database()
@@ -1,90 +1,13 @@
 import sqlite3
+import sys
+from pathlib import Path
 
-conn = sqlite3.connect("database/MediLink.db")
-c = conn.cursor()
-c.execute("PRAGMA foreign_keys = ON;")
-# print(conn.total_changes)
-
-#---------------------- Start of Independant tables
-
-c.execute("""
-	CREATE TABLE IF NOT EXISTS Doctors(
-		doctorID TEXT NOT NULL PRIMARY KEY,
-		Name TEXT NOT NULL,
-		Email TEXT UNIQUE NOT NULL,
-        PasswordHash TEXT NOT NULL,
-		Specialisation TEXT
-		);
-""")
-
-c.execute("""
-	CREATE TABLE IF NOT EXISTS Patients(
-		patientID TEXT NOT NULL PRIMARY KEY,
-		Name TEXT NOT NULL,
-		Email TEXT UNIQUE NOT NULL,
-        PasswordHash TEXT NOT NULL,
-		PatientHistory TEXT,
-		DOB DATE NOT NULL 
-		);
-""")
-
-c.execute("""
-	CREATE TABLE IF NOT EXISTS Pharmacies(
-		pharmID TEXT NOT NULL PRIMARY KEY,
-        Email TEXT UNIQUE NOT NULL,
-        PasswordHash TEXT NOT NULL,
-		Name TEXT NOT NULL
-	);
-""") 
-
-#---------------------- End of Independant tables
-
-
-
-# Connecting doctors and patients with a table
-
-c.execute("""
-    CREATE TABLE IF NOT EXISTS DPEnrole(
-          doctorID TEXT NOT NULL,
-          patientID TEXT NOT NULL,
-          msgHistory TEXT,
-          PRIMARY KEY (doctorID, patientID)
-          FOREIGN KEY (doctorID)
-          	REFERENCES Doctors (doctorID),
-          FOREIGN KEY (patientID)
-			REFERENCES Patients (patientID) 
-	);
-""")
+# The schema itself lives in backend/helpers/migrations.py; this script
+# creates or upgrades database/MediLink.db to the latest version.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+from helpers.migrations import apply_migrations, schema_version
 
-
-#--------------------- Presctipions
-
-c.execute(""" 
-	CREATE TABLE IF NOT EXISTS Prescriptions(
-          patientID TEXT NOT NULL,
-          prescriptionID TEXT NOT NULL PRIMARY KEY,
-          doctorID TEXT NOT NULL,
-          pharmID TEXT NOT NULL,
-          MedicineName TEXT NOT NULL,
-          Instructions TEXT,
-          DatePrescribed DATE NOT NULL,
-          DurationType TEXT NOT NULL,
-          CollectionCode TEXT NOT NULL,
-          FOREIGN KEY (patientID)
-          	REFERENCES Patients (patientID),
-          FOREIGN KEY (doctorID)
-          	REFERENCES Doctors (doctorID),
-          FOREIGN KEY (pharmID)
-          	REFERENCES Pharmacies (pharmID)
-    );
-""")
-
-
-#---------------------------------------------------------
-
-
-conn.commit()
+conn = sqlite3.connect("database/MediLink.db")
+applied = apply_migrations(conn)
+print(f"Schema at version {schema_version(conn)}, applied {applied or 'nothing'}")
 conn.close()
-    
-
-
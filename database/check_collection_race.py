@@ -0,0 +1,55 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+# Collects the same Lifetime prescription from several threads at once, each
+# with its own pool connection, and fails unless exactly one of them rotates
+# the code and the stored code is the one that collection produced.
+workdir = tempfile.TemporaryDirectory(prefix="medilink-check-")
+os.environ["MEDILINK_DB_PATH"] = str(Path(workdir.name) / "check.db")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+from flask import Flask
+from helpers.db import close_db
+from helpers.medicine import collect_prescriptions
+from helpers.synthetic import generate
+
+COLLECTORS = 4
+
+conn = sqlite3.connect(os.environ["MEDILINK_DB_PATH"])
+generate(conn, patients=5, doctors=1, pharmacies=1, messages_per_conversation=0, prescriptions_per_patient=2)
+conn.commit()
+prescription_id, pharm_id, code = conn.execute(
+    "SELECT prescriptionID, pharmID, CollectionCode FROM Prescriptions WHERE DurationType = 'Lifetime' LIMIT 1"
+).fetchone()
+
+app = Flask(__name__)
+app.teardown_appcontext(close_db)
+start = threading.Barrier(COLLECTORS)
+statuses = []
+
+
+def collect():
+    with app.app_context():
+        start.wait()
+        statuses.extend(collect_prescriptions(pharm_id, [(prescription_id, code)]))
+
+
+threads = [threading.Thread(target=collect) for _ in range(COLLECTORS)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+
+stored = conn.execute(
+    "SELECT CollectionCode FROM Prescriptions WHERE prescriptionID = ?", (prescription_id,)
+).fetchone()[0]
+conn.close()
+workdir.cleanup()
+
+print(f"{COLLECTORS} concurrent collections: {sorted(statuses)}")
+ok = statuses.count("code_changed") == 1 and statuses.count("invalid_code") == COLLECTORS - 1 and stored != code
+print("OK" if ok else "FAIL: the same code was accepted more than once")
+sys.exit(0 if ok else 1)
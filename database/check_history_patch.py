@@ -0,0 +1,88 @@
+import json
+import sqlite3
+import sys
+from pathlib import Path
+
+# Applies PatientHistory patches (helpers/history.py) to sample documents in
+# a freshly migrated database and fails if any result differs from what the
+# JSON Pointer paths address in that document.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+from helpers.history import compile_patch
+from helpers.migrations import apply_migrations
+
+HISTORY = {
+    "allergies": ["peanuts", "latex"],
+    "past_illnesses_by_year": {"2022": "flu"},
+    "notes": [["a", "b"], {"0": "zero"}],
+}
+
+# (description, patch, rows updated, resulting history)
+CASES = [
+    (
+        "digit token under an object is a member name",
+        [{"op": "add", "path": "/past_illnesses_by_year/2023", "value": "measles"}],
+        1,
+        {**HISTORY, "past_illnesses_by_year": {"2022": "flu", "2023": "measles"}},
+    ),
+    (
+        "digit token under an array is an index",
+        [{"op": "replace", "path": "/allergies/1", "value": "pollen"}],
+        1,
+        {**HISTORY, "allergies": ["peanuts", "pollen"]},
+    ),
+    (
+        "- appends to an array",
+        [{"op": "add", "path": "/allergies/-", "value": "dust"}],
+        1,
+        {**HISTORY, "allergies": ["peanuts", "latex", "dust"]},
+    ),
+    (
+        "nested tokens are resolved level by level",
+        [
+            {"op": "replace", "path": "/notes/0/1", "value": "B"},
+            {"op": "replace", "path": "/notes/1/0", "value": "ZERO"},
+        ],
+        1,
+        {**HISTORY, "notes": [["a", "B"], {"0": "ZERO"}]},
+    ),
+    (
+        "tokens see members added earlier in the same patch",
+        [
+            {"op": "add", "path": "/by_year", "value": {"2021": []}},
+            {"op": "add", "path": "/by_year/2021/-", "value": "cold"},
+            {"op": "remove", "path": "/past_illnesses_by_year/2022"},
+        ],
+        1,
+        {**HISTORY, "past_illnesses_by_year": {}, "by_year": {"2021": ["cold"]}},
+    ),
+    (
+        "add at an array index conflicts",
+        [{"op": "add", "path": "/allergies/0", "value": "dust"}],
+        0,
+        HISTORY,
+    ),
+    (
+        "replace of a missing member conflicts",
+        [{"op": "replace", "path": "/past_illnesses_by_year/2023", "value": "x"}],
+        0,
+        HISTORY,
+    ),
+]
+
+conn = sqlite3.connect(":memory:")
+apply_migrations(conn)
+conn.execute("INSERT INTO Patients (patientID, Name, Email, PasswordHash, DOB) VALUES ('p', 'P', 'p@example.com', '', '2000-01-01')")
+
+failures = 0
+for description, patch, rows, expected in CASES:
+    conn.execute("UPDATE Patients SET PatientHistory = ? WHERE patientID = 'p'", (json.dumps(HISTORY),))
+    sql, params = compile_patch("p", patch)
+    updated = conn.execute(sql, params).rowcount
+    stored = json.loads(conn.execute("SELECT PatientHistory FROM Patients WHERE patientID = 'p'").fetchone()[0])
+    if updated != rows or stored != expected:
+        failures += 1
+        print(f"FAIL {description}: {updated} rows, {json.dumps(stored)}")
+conn.close()
+
+print(f"{len(CASES)} patches checked, {failures} failures")
+sys.exit(1 if failures else 0)
@@ -0,0 +1,19 @@
+import sqlite3
+import sys
+from pathlib import Path
+
+# Runs EXPLAIN QUERY PLAN on every query in helpers/query_plans.py against a
+# freshly migrated database and fails if any of them scans a large table.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+from helpers.migrations import apply_migrations
+from helpers.query_plans import check_query_plans, known_queries
+
+conn = sqlite3.connect(":memory:")
+apply_migrations(conn)
+failures = check_query_plans(conn)
+conn.close()
+
+for name, detail in failures:
+    print(f"FAIL {name}: {detail}")
+print(f"{len(known_queries())} queries checked, {len(failures)} table scans")
+sys.exit(1 if failures else 0)
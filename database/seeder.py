@@ -1,127 +1,201 @@
+import argparse
 import sqlite3
 import json
+import sys
+import time
+from pathlib import Path
 from werkzeug.security import generate_password_hash
 
-conn = sqlite3.connect("database/MediLink.db")
-c = conn.cursor()
-c.execute("PRAGMA foreign_keys = ON;")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
 
-#------------------------ Inserting sample data into the Patients table
+from helpers.collection_codes import hash_missing_collection_codes
+from helpers.db import index_missing_patients
+from helpers.synthetic import GENERATED_PASSWORD, EMAIL_DOMAIN, generate
 
-patientHist1 = {
-    "allergies": ["N/A"],
-    "past_illnesses": ["Gambling Addiction"],
-    "surgeries": ["ocular surgery"],
-    "family_history": {
-        "diabetes": False,
-        "heart_disease": True
-    }
-}
-
-patientHist2 = {
-    "allergies": ["N/A"],
-    "past_illnesses": ["Periodic Amnesia"],
-    "surgeries": ["N/A"],
-    "family_history": {
-        "diabetes": False,
-        "heart_disease": False
+# Loads the fixed sample accounts below, then optionally a synthetic data set
+# of any size from backend/helpers/synthetic.py, e.g. for staging:
+#
+#   python database/seeder.py --patients 50000 --doctors 500 --pharmacies 200 \
+#       --messages-per-conversation 20 --prescriptions-per-patient 3
+
+
+def insert_samples(c):
+    #------------------------ Inserting sample data into the Patients table
+
+    patientHist1 = {
+        "allergies": ["N/A"],
+        "past_illnesses": ["Gambling Addiction"],
+        "surgeries": ["ocular surgery"],
+        "family_history": {
+            "diabetes": False,
+            "heart_disease": True
+        }
     }
-}
-
-patientHist3 = {
-    "allergies": ["N/A"],
-    "past_illnesses": ["N/A"],
-    "surgeries": ["N/A"],
-    "family_history": {
-        "diabetes": False,
-        "heart_disease": False
+
+    patientHist2 = {
+        "allergies": ["N/A"],
+        "past_illnesses": ["Periodic Amnesia"],
+        "surgeries": ["N/A"],
+        "family_history": {
+            "diabetes": False,
+            "heart_disease": False
+        }
     }
-}
-
-patient_data = [
-    ("BM00001", "Baku \"Usogui\" Madarame", "patient1@example.com", generate_password_hash("password123"), json.dumps(patientHist1), "1970-01-01"),
-    ("SK00001", "Souichi Kiruma", "patient2@example.com", generate_password_hash("password456"), json.dumps(patientHist2), "1970-02-02"),
-    ("TK00001", "Takaomi Kaji", "patient3@example.com", generate_password_hash("password789"), json.dumps(patientHist3), "1970-03-03")
-]
-
-
-c.executemany("""
-    INSERT OR IGNORE INTO Patients (patientID, Name, Email, PasswordHash, PatientHistory, DOB)
-    VALUES (?, ?, ?, ?, ?, ?);
-""", 
-    patient_data
-)
-
-
-#--------------------- Inserting sample data into the Doctors table
-
-doctor_data = [
-    ("TC00001", "Dr. Shoko Ieiri", "doctor1@example.com", generate_password_hash("qwerty"), "Reversed Cursed Technique"),
-    ("GH00002", "Dr. Gregory House", "doctor2@example.com", generate_password_hash("password"), None)
-]
-
-c.executemany("""
-    INSERT OR IGNORE INTO Doctors (doctorID, Name, Email, PasswordHash, Specialisation)
-    VALUES (?, ?, ?, ?, ?);
-""", 
-    doctor_data
-)
-
-#--------------------- Inserting sample data into the Pharmacies table
-
-pharmacy_data = [
-    ("MC00001", "pharmacy1@example.com", generate_password_hash("asdfghjkl;"), "MediCare Pharmacy"),
-    ("PH00002", "pharmacy2@example.com", generate_password_hash("pingpong"), "HealthPlus Pharmacy")
-]
-
-c.executemany("""
-    INSERT OR IGNORE INTO Pharmacies (pharmID, Email, PasswordHash, Name)
-    VALUES (?, ?, ?, ?);
-""", 
-    pharmacy_data
-)
-
-#--------------------- Inserting sample data into the DPEnrole table
-
-msg1 = [
-    {
-        "sender": "TC00001",
-        "message": "43d91bbc04ed7ecfd0b92e9f2de94e7b889b7a1039aa7b402ca31ba2de0b9eccb5e3a367b7022d4cdb42714d8bc23a77077c4103bc6b68a483e1a6ac9e32007d",
-        "timestamp": "2024-01-15T10:00:00"
-    },
-    {
-        "sender": "BM00001",
-        "message": "0b8f5087f4c3cc516ce06150eb74e9467042ae2b4f864f465082d8ed3099ef0a",
-        "timestamp": "2024-01-15T10:05:00"
+
+    patientHist3 = {
+        "allergies": ["N/A"],
+        "past_illnesses": ["N/A"],
+        "surgeries": ["N/A"],
+        "family_history": {
+            "diabetes": False,
+            "heart_disease": False
+        }
     }
-]
-
-DP_enrole_data = [
-    ("TC00001", "BM00001", json.dumps(msg1)),
-    ("GH00002", "SK00001", json.dumps([])),
-    ("GH00002", "TK00001", json.dumps([]))
-]
-
-c.executemany("""
-    INSERT OR IGNORE INTO DPEnrole (doctorID, patientID, msgHistory)
-    VALUES (?, ?, ?);
-""", 
-    DP_enrole_data
-)
-
-#--------------------- Inserting sample data into the Prescriptions table
-prescription_data = [
-    ("BM00001", "RX00001", "TC00001", "MC00001", "Medicine A, Medicine B", "Take twice daily after meals", "2025-12-11", "Lifetime", "123456"),
-    ("SK00001", "RX00002", "GH00002", "PH00002", "Medicine C", "Take once daily before bed", "2025-06-30", "Temporary", "654321")
-]
-c.executemany("""
-    INSERT OR IGNORE INTO Prescriptions (patientID, prescriptionID, doctorID, pharmID, MedicineName, Instructions, DatePrescribed, DurationType, CollectionCode)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
-""", 
-    prescription_data
-)
-
-
-
-conn.commit()
-conn.close()
\ No newline at end of file
+
+    patient_data = [
+        ("BM00001", "Baku \"Usogui\" Madarame", "patient1@example.com", generate_password_hash("password123"), json.dumps(patientHist1), "1970-01-01"),
+        ("SK00001", "Souichi Kiruma", "patient2@example.com", generate_password_hash("password456"), json.dumps(patientHist2), "1970-02-02"),
+        ("TK00001", "Takaomi Kaji", "patient3@example.com", generate_password_hash("password789"), json.dumps(patientHist3), "1970-03-03")
+    ]
+
+
+    c.executemany("""
+        INSERT OR IGNORE INTO Patients (patientID, Name, Email, PasswordHash, PatientHistory, DOB)
+        VALUES (?, ?, ?, ?, ?, ?);
+    """, 
+        patient_data
+    )
+
+
+    #--------------------- Inserting sample data into the Doctors table
+
+    doctor_data = [
+        ("TC00001", "Dr. Shoko Ieiri", "doctor1@example.com", generate_password_hash("qwerty"), "Reversed Cursed Technique"),
+        ("GH00002", "Dr. Gregory House", "doctor2@example.com", generate_password_hash("password"), None)
+    ]
+
+    c.executemany("""
+        INSERT OR IGNORE INTO Doctors (doctorID, Name, Email, PasswordHash, Specialisation)
+        VALUES (?, ?, ?, ?, ?);
+    """, 
+        doctor_data
+    )
+
+    #--------------------- Inserting sample data into the Pharmacies table
+
+    pharmacy_data = [
+        ("MC00001", "pharmacy1@example.com", generate_password_hash("asdfghjkl;"), "MediCare Pharmacy"),
+        ("PH00002", "pharmacy2@example.com", generate_password_hash("pingpong"), "HealthPlus Pharmacy")
+    ]
+
+    c.executemany("""
+        INSERT OR IGNORE INTO Pharmacies (pharmID, Email, PasswordHash, Name)
+        VALUES (?, ?, ?, ?);
+    """, 
+        pharmacy_data
+    )
+
+    #--------------------- Inserting sample data into the DPEnrole table
+
+    msg1 = [
+        {
+            "sender": "TC00001",
+            "message": "43d91bbc04ed7ecfd0b92e9f2de94e7b889b7a1039aa7b402ca31ba2de0b9eccb5e3a367b7022d4cdb42714d8bc23a77077c4103bc6b68a483e1a6ac9e32007d",
+            "timestamp": "2024-01-15T10:00:00"
+        },
+        {
+            "sender": "BM00001",
+            "message": "0b8f5087f4c3cc516ce06150eb74e9467042ae2b4f864f465082d8ed3099ef0a",
+            "timestamp": "2024-01-15T10:05:00"
+        }
+    ]
+
+    DP_enrole_data = [
+        ("TC00001", "BM00001"),
+        ("GH00002", "SK00001"),
+        ("GH00002", "TK00001")
+    ]
+
+    c.executemany("""
+        INSERT OR IGNORE INTO DPEnrole (doctorID, patientID)
+        VALUES (?, ?);
+    """, 
+        DP_enrole_data
+    )
+
+    #--------------------- Inserting sample data into the Messages table
+
+    message_data = [
+        ("TC00001", "BM00001", seq, msg["sender"], msg["message"], msg["timestamp"])
+        for seq, msg in enumerate(msg1, start=1)
+    ]
+
+    c.executemany("""
+        INSERT OR IGNORE INTO Messages (doctorID, patientID, seq, senderID, message, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?);
+    """, 
+        message_data
+    )
+
+    #--------------------- Inserting sample data into the Prescriptions table
+    prescription_data = [
+        ("BM00001", "RX00001", "TC00001", "MC00001", "Medicine A, Medicine B", "Take twice daily after meals", "2025-12-11", "Lifetime", "123456"),
+        ("SK00001", "RX00002", "GH00002", "PH00002", "Medicine C", "Take once daily before bed", "2025-06-30", "Temporary", "654321")
+    ]
+    c.executemany("""
+        INSERT OR IGNORE INTO Prescriptions (patientID, prescriptionID, doctorID, pharmID, MedicineName, Instructions, DatePrescribed, DurationType, CollectionCode)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
+    """, 
+        prescription_data
+    )
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load sample and synthetic data into the MediLink database")
+    parser.add_argument("--db", default="database/MediLink.db")
+    parser.add_argument("--no-samples", action="store_true", help="skip the fixed sample accounts")
+    parser.add_argument("--patients", type=int, default=0)
+    parser.add_argument("--doctors", type=int, default=0)
+    parser.add_argument("--pharmacies", type=int, default=0)
+    parser.add_argument("--messages-per-conversation", type=int, default=20)
+    parser.add_argument("--prescriptions-per-patient", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=50000)
+    parser.add_argument("--workers", type=int, help="processes encrypting messages, default one per CPU")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    c = conn.cursor()
+    c.execute("PRAGMA foreign_keys = ON;")
+    if not args.no_samples:
+        insert_samples(c)
+        index_missing_patients(conn)
+        hash_missing_collection_codes(conn)
+        conn.commit()
+
+    if args.patients or args.doctors or args.pharmacies:
+        started = time.perf_counter()
+        summary = generate(
+            conn,
+            patients=args.patients,
+            doctors=args.doctors,
+            pharmacies=args.pharmacies,
+            messages_per_conversation=args.messages_per_conversation,
+            prescriptions_per_patient=args.prescriptions_per_patient,
+            seed=args.seed,
+            batch_size=args.batch_size,
+            workers=args.workers,
+        )
+        print(
+            f"Generated {len(summary['patients'])} patients, {len(summary['doctors'])} doctors, "
+            f"{len(summary['pharmacies'])} pharmacies, {summary['messages']} messages and "
+            f"{summary['prescriptions']} prescriptions in {time.perf_counter() - started:.1f}s"
+        )
+        print(f"Generated accounts log in as <id>@{EMAIL_DOMAIN} with password {GENERATED_PASSWORD}")
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import argparse
+import sys
+from pathlib import Path
+
+# Ranks the statements in the slow-query log (see helpers/slow_queries.py)
+# by total time, with their call count, mean and worst time, the routes that
+# ran them and the query plan of the slowest run.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+from helpers.slow_queries import SLOW_QUERY_LOG, summarize
+
+parser = argparse.ArgumentParser(description="Summarise the MediLink slow-query log.")
+parser.add_argument("logs", nargs="*", type=Path, help="log files (default: the configured log and its rotations)")
+parser.add_argument("--top", type=int, default=20, help="statements to show")
+args = parser.parse_args()
+
+paths = args.logs or sorted(SLOW_QUERY_LOG.parent.glob(SLOW_QUERY_LOG.name + "*"))
+if not paths:
+    print(f"No slow-query log at {SLOW_QUERY_LOG}")
+    sys.exit(0)
+
+summary = summarize(paths)
+for rank, item in enumerate(summary[:args.top], start=1):
+    print(
+        f"{rank:>3}. total {item['total_ms']:.1f} ms  count {item['count']}  "
+        f"mean {item['mean_ms']:.1f} ms  max {item['max_ms']:.1f} ms"
+    )
+    print(f"     {item['sql']}")
+    if item["routes"]:
+        print(f"     routes: {', '.join(item['routes'])}")
+    for line in item["plan"]:
+        print(f"     plan: {line}")
+print(f"{len(summary)} distinct statements in {len(paths)} file(s)")
@@ -1,5 +1,4 @@
-import { useEffect, useMemo, useState } from "react";
-import Fuse from "fuse.js";
+import { useEffect, useState } from "react";
 import { MessagePanelContainer } from "../components/MessagePanel";
 import { PrescriptionsPanelContainer } from "../components/PrescriptionsPanel";
 import DashboardHeader from "../components/DashboardHeader";
@@ -7,6 +6,9 @@ import SearchBar from "../components/SearchBar";
 import Modal from "../components/Modal";
 import styles from "./DoctorDashboard.module.css";
 
+// Search runs on the server once typing pauses for this long.
+const SEARCH_DEBOUNCE_MS = 250;
+
 interface DoctorDashboardProps {
   doctorName: string;
   doctorId: string | null;
@@ -54,7 +56,16 @@ function DoctorDashboard({
   const [patients, setPatients] = useState<PatientListItem[]>([]);
   const [patientsError, setPatientsError] = useState("");
   const [searchQuery, setSearchQuery] = useState("");
-  const [searchField, setSearchField] = useState<"Name" | "patientID">("Name");
+  const [searchField, setSearchField] = useState<
+    "Name" | "patientID" | "Email" | "DOB"
+  >("Name");
+  // null while the search box is empty, then the server's ranked matches.
+  const [searchResults, setSearchResults] = useState<
+    PatientListItem[] | null
+  >(null);
+  const [searchNextOffset, setSearchNextOffset] = useState<number | null>(
+    null,
+  );
   const [activePatientProfile, setActivePatientProfile] =
     useState<PatientProfile | null>(null);
   const [activePatientError, setActivePatientError] = useState("");
@@ -131,18 +142,71 @@ function DoctorDashboard({
     };
   }, [activePatientProfile, isProfileLoading, isMessageOpen]);
 
-  const filteredPatients = useMemo(() => {
+  async function searchPatients(query: string, offset: number) {
+    const params = new URLSearchParams({
+      q: query,
+      field: searchField,
+      offset: String(offset),
+    });
+    const response = await fetch(`/api/doctor/patients/search?${params}`);
+    const result = await response.json();
+    if (!response.ok) {
+      throw new Error(result.error || "Unable to search patients.");
+    }
+    return result as {
+      patients?: PatientListItem[];
+      next_offset?: number | null;
+    };
+  }
+
+  useEffect(() => {
     const trimmed = searchQuery.trim();
     if (!trimmed) {
-      return patients;
+      setSearchResults(null);
+      setSearchNextOffset(null);
+      return;
     }
-    const fuse = new Fuse(patients, {
-      keys: [searchField],
-      includeScore: true,
-      threshold: 0.4,
-    });
-    return fuse.search(trimmed).map((result) => result.item);
-  }, [patients, searchQuery, searchField]);
+    let isActive = true;
+    const timer = window.setTimeout(async () => {
+      try {
+        const result = await searchPatients(trimmed, 0);
+        if (!isActive) {
+          return;
+        }
+        setSearchResults(result.patients || []);
+        setSearchNextOffset(result.next_offset ?? null);
+        setPatientsError("");
+      } catch {
+        if (isActive) {
+          setPatientsError("Unable to search patients.");
+        }
+      }
+    }, SEARCH_DEBOUNCE_MS);
+
+    return () => {
+      isActive = false;
+      window.clearTimeout(timer);
+    };
+  }, [searchQuery, searchField]);
+
+  async function handleMoreResults() {
+    const trimmed = searchQuery.trim();
+    if (!trimmed || searchNextOffset === null) {
+      return;
+    }
+    try {
+      const result = await searchPatients(trimmed, searchNextOffset);
+      setSearchResults((current) => [
+        ...(current || []),
+        ...(result.patients || []),
+      ]);
+      setSearchNextOffset(result.next_offset ?? null);
+    } catch {
+      setPatientsError("Unable to search patients.");
+    }
+  }
+
+  const filteredPatients = searchResults ?? patients;
 
   async function handleExpandPatient(patientId?: string) {
     if (!patientId) {
@@ -433,6 +497,8 @@ function DoctorDashboard({
           options={[
             { value: "Name", label: "Name" },
             { value: "patientID", label: "Patient ID" },
+            { value: "Email", label: "Email" },
+            { value: "DOB", label: "Date of birth" },
           ]}
         />
         <section className={styles.card}>
@@ -482,11 +548,23 @@ function DoctorDashboard({
             ) : (
               <li className={styles.patientItem}>
                 <div className={styles.listSub}>
-                  {patientsError || "No patients assigned."}
+                  {patientsError ||
+                    (searchResults
+                      ? "No matching patients."
+                      : "No patients assigned.")}
                 </div>
               </li>
             )}
           </ul>
+          {searchNextOffset !== null && (
+            <button
+              className={styles.secondaryButton}
+              type="button"
+              onClick={handleMoreResults}
+            >
+              Show more results
+            </button>
+          )}
         </section>
       </main>
       {(activePatientProfile || activePatientError || isProfileLoading) && (
@@ -1,12 +1,18 @@
-import { useEffect, useMemo, useState } from "react";
+import { useEffect, useMemo, useRef, useState } from "react";
 import Fuse from "fuse.js";
 import PrescriptionsPanel, {
+  applyPrescriptionChanges,
+  fetchAllPrescriptions,
+  fetchPrescriptionChanges,
   type Prescription,
 } from "../components/PrescriptionsPanel";
 import DashboardHeader from "../components/DashboardHeader";
 import SearchBar from "../components/SearchBar";
 import styles from "./PharmacyDashboard.module.css";
 
+// An open terminal picks up prescriptions sent by doctors this often.
+const PRESCRIPTION_SYNC_INTERVAL_MS = 30000;
+
 interface PharmacyDashboardProps {
   pharmacistName: string;
   pharmId: string | null;
@@ -32,24 +38,57 @@ function PharmacyDashboard({
   const [collectError, setCollectError] = useState("");
   const [collectStatus, setCollectStatus] = useState("");
   const [isCollecting, setIsCollecting] = useState(false);
+  // change_seq of the loaded list, null until a full load has finished.
+  const changeSeqRef = useRef<number | null>(null);
+  // Set while a full load or a sync runs; they never overlap, so the change
+  // feed is only ever applied on top of the complete list.
+  const isSyncingRef = useRef(false);
 
   async function fetchPrescriptions() {
+    if (isSyncingRef.current) {
+      return;
+    }
+    isSyncingRef.current = true;
     try {
       setIsLoadingPrescriptions(true);
-      const response = await fetch("/api/prescriptions", {
-        credentials: "include",
-      });
-      const result = await response.json();
-      if (response.ok) {
-        setPrescriptions(result.prescriptions || []);
-        setPrescriptionsError("");
-      } else {
-        setPrescriptionsError(result.error || "Unable to load prescriptions.");
-      }
+      const result = await fetchAllPrescriptions("/api/prescriptions");
+      setPrescriptions(result.prescriptions);
+      changeSeqRef.current = result.changeSeq;
+      setPrescriptionsError("");
+    } catch (err) {
+      setPrescriptionsError(
+        err instanceof Error ? err.message : "Unable to load prescriptions.",
+      );
+    } finally {
+      setIsLoadingPrescriptions(false);
+      isSyncingRef.current = false;
+    }
+  }
+
+  // Applies only what changed since the last full load or sync.
+  async function syncPrescriptions() {
+    if (isSyncingRef.current) {
+      return;
+    }
+    if (changeSeqRef.current === null) {
+      await fetchPrescriptions();
+      return;
+    }
+    isSyncingRef.current = true;
+    try {
+      changeSeqRef.current = await fetchPrescriptionChanges(
+        "/api/prescriptions",
+        changeSeqRef.current,
+        (upserts, deleted) =>
+          setPrescriptions((current) =>
+            applyPrescriptionChanges(current, upserts, deleted),
+          ),
+      );
+      setPrescriptionsError("");
     } catch {
       setPrescriptionsError("Unable to load prescriptions.");
     } finally {
-      setIsLoadingPrescriptions(false);
+      isSyncingRef.current = false;
     }
   }
 
@@ -64,9 +103,15 @@ function PharmacyDashboard({
     }
 
     load();
+    const interval = window.setInterval(() => {
+      if (isActive) {
+        syncPrescriptions();
+      }
+    }, PRESCRIPTION_SYNC_INTERVAL_MS);
 
     return () => {
       isActive = false;
+      window.clearInterval(interval);
     };
   }, []);
 
@@ -88,7 +133,7 @@ function PharmacyDashboard({
     : prescriptionsError || "No prescriptions assigned yet.";
 
   const isCodeValid = /^\d{6}$/.test(collectionCode);
-  const canCollect = isCodeValid && !!selectedPrescriptionId && !isCollecting;
+  const canCollect = isCodeValid && !isCollecting;
 
   function handleCodeChange(value: string) {
     const digitsOnly = value.replace(/\D/g, "").slice(0, 6);
@@ -101,11 +146,32 @@ function PharmacyDashboard({
     }
   }
 
-  async function handleCollect() {
-    if (!selectedPrescriptionId) {
-      setCollectError("Select a prescription first.");
-      return;
+  // Resolves a code to the prescription it belongs to. Returns null, with
+  // the reason shown, unless exactly one prescription matches.
+  async function lookupPrescriptionId(): Promise<string | null> {
+    const response = await fetch("/api/prescriptions/lookup", {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({ CollectionCode: collectionCode }),
+    });
+    const result = await response.json();
+    if (!response.ok) {
+      setCollectError(result.error || "Unable to verify collection code.");
+      return null;
+    }
+    const matches: Prescription[] = result.prescriptions || [];
+    if (matches.length !== 1) {
+      setCollectError(
+        "Several prescriptions share this code. Select the right one first.",
+      );
+      return null;
     }
+    return matches[0].prescriptionID || null;
+  }
+
+  async function handleCollect() {
     if (!isCodeValid) {
       setCollectError("Enter a valid 6 digit collection code.");
       return;
@@ -114,8 +180,13 @@ function PharmacyDashboard({
     setCollectError("");
     setCollectStatus("");
     try {
+      const prescriptionId =
+        selectedPrescriptionId || (await lookupPrescriptionId());
+      if (!prescriptionId) {
+        return;
+      }
       const response = await fetch(
-        `/api/prescriptions/${selectedPrescriptionId}`,
+        `/api/prescriptions/${prescriptionId}`,
         {
           method: "DELETE",
           headers: {
@@ -129,7 +200,7 @@ function PharmacyDashboard({
         setCollectStatus(result.status || "Collection verified.");
         setCollectionCode("");
         setSelectedPrescriptionId(null);
-        await fetchPrescriptions();
+        await syncPrescriptions();
       } else {
         setCollectError(result.error || "Unable to verify collection code.");
       }
@@ -14,6 +14,8 @@ interface MessagePanelProps {
   messages: MessagePanelItem[];
   inputPlaceholder?: string;
   onSend?: (message: string) => Promise<void> | void;
+  onLoadOlder?: () => void;
+  isLoadingOlder?: boolean;
 }
 
 interface MessagePanelContainerProps {
@@ -34,13 +36,20 @@ function formatTimestamp(date: Date) {
   )}`;
 }
 
+interface ApiMessage {
+  id?: number;
+  sender?: string;
+  message?: string;
+  timestamp?: string;
+}
+
 function mapMessages(
-  messages: Array<{ sender?: string; message?: string; timestamp?: string }>,
+  messages: ApiMessage[],
   currentUserId: string | null | undefined,
   otherLabel: string,
 ): MessagePanelItem[] {
   return messages.map((message) => ({
-    id: `${message.sender || "unknown"}-${message.timestamp || ""}`,
+    id: message.id ?? `${message.sender || "unknown"}-${message.timestamp || ""}`,
     sender: currentUserId && message.sender === currentUserId ? "You" : otherLabel,
     body: message.message || "",
     time: message.timestamp || "",
@@ -59,6 +68,17 @@ export function MessagePanelContainer({
   const [messages, setMessages] = useState<MessagePanelItem[]>([]);
   const [messagesError, setMessagesError] = useState("");
   const [isLoading, setIsLoading] = useState(false);
+  // next_cursor of the oldest page loaded; null once the start is reached.
+  const [olderCursor, setOlderCursor] = useState<number | null>(null);
+  const [isLoadingOlder, setIsLoadingOlder] = useState(false);
+
+  function appendMessages(incoming: ApiMessage[]) {
+    const mapped = mapMessages(incoming, currentUserId, otherLabel);
+    setMessages((current) => {
+      const seen = new Set(current.map((message) => message.id));
+      return [...current, ...mapped.filter((message) => !seen.has(message.id))];
+    });
+  }
 
   async function loadMessages() {
     try {
@@ -66,40 +86,121 @@ export function MessagePanelContainer({
       const response = await fetch(fetchUrl, { credentials: "include" });
       const result = await response.json();
       if (response.ok) {
-        const mapped = mapMessages(result.messages || [], currentUserId, otherLabel);
-        setMessages(mapped);
+        const loaded: ApiMessage[] = result.messages || [];
+        setMessages(mapMessages(loaded, currentUserId, otherLabel));
+        setOlderCursor(result.next_cursor ?? null);
         setMessagesError("");
-      } else {
-        setMessagesError(result.error || "Unable to load messages.");
+        return loaded.length > 0 ? loaded[loaded.length - 1].id : undefined;
       }
+      setMessagesError(result.error || "Unable to load messages.");
     } catch {
       setMessagesError("Unable to load messages.");
     } finally {
       setIsLoading(false);
     }
+    return undefined;
+  }
+
+  // Pages back through the conversation with ?before=, one page at a time.
+  async function loadOlderMessages() {
+    if (olderCursor === null || isLoadingOlder) {
+      return;
+    }
+    try {
+      setIsLoadingOlder(true);
+      const response = await fetch(`${fetchUrl}?before=${olderCursor}`, {
+        credentials: "include",
+      });
+      const result = await response.json();
+      if (!response.ok) {
+        setMessagesError(result.error || "Unable to load messages.");
+        return;
+      }
+      const mapped = mapMessages(
+        result.messages || [],
+        currentUserId,
+        otherLabel,
+      );
+      setMessages((current) => {
+        const seen = new Set(current.map((message) => message.id));
+        return [
+          ...mapped.filter((message) => !seen.has(message.id)),
+          ...current,
+        ];
+      });
+      setOlderCursor(result.next_cursor ?? null);
+    } catch {
+      setMessagesError("Unable to load messages.");
+    } finally {
+      setIsLoadingOlder(false);
+    }
   }
 
   useEffect(() => {
     let isActive = true;
+    let source: EventSource | null = null;
 
-    async function fetchMessages() {
-      try {
-        await loadMessages();
-        if (!isActive) {
-          return;
-        }
-      } catch {
-        if (!isActive) {
-          return;
+    // New messages are pushed over server-sent events; browsers without
+    // EventSource, or clients the server has no stream slot for, fall back
+    // to long-polling the same conversation.
+    async function longPoll(after: number | undefined) {
+      let cursor = after;
+      while (isActive) {
+        try {
+          const query = cursor === undefined ? "" : `?after=${cursor}`;
+          const response = await fetch(`${fetchUrl}/poll${query}`, {
+            credentials: "include",
+          });
+          const result = await response.json();
+          if (!isActive) {
+            return;
+          }
+          if (!response.ok) {
+            setMessagesError(result.error || "Unable to load messages.");
+            return;
+          }
+          appendMessages(result.messages || []);
+          cursor = result.cursor;
+        } catch {
+          await new Promise((resolve) => setTimeout(resolve, 2000));
         }
-        setMessagesError("Unable to load messages.");
       }
     }
 
+    async function fetchMessages() {
+      const lastId = await loadMessages();
+      if (!isActive) {
+        return;
+      }
+      if (typeof EventSource === "undefined") {
+        longPoll(lastId);
+        return;
+      }
+      const query = lastId === undefined ? "" : `?after=${lastId}`;
+      source = new EventSource(`${fetchUrl}/stream${query}`, {
+        withCredentials: true,
+      });
+      let lastSeen = lastId;
+      source.addEventListener("message", (event) => {
+        lastSeen = Number(event.lastEventId);
+        appendMessages([JSON.parse(event.data)]);
+      });
+      source.onerror = () => {
+        // EventSource retries dropped streams itself; it gives up (CLOSED)
+        // only when the server refuses one.
+        if (source?.readyState === EventSource.CLOSED) {
+          source.close();
+          source = null;
+          longPoll(lastSeen);
+        }
+      };
+    }
+
     fetchMessages();
 
     return () => {
       isActive = false;
+      source?.close();
     };
   }, [fetchUrl, currentUserId, otherLabel]);
 
@@ -116,9 +217,7 @@ export function MessagePanelContainer({
     const result = await response.json();
     if (!response.ok) {
       setMessagesError(result.error || "Unable to send message.");
-      return;
     }
-    await loadMessages();
   }
 
   return (
@@ -129,6 +228,8 @@ export function MessagePanelContainer({
         messages={messages}
         inputPlaceholder={messagesError || inputPlaceholder}
         onSend={handleSendMessage}
+        onLoadOlder={olderCursor !== null ? loadOlderMessages : undefined}
+        isLoadingOlder={isLoadingOlder}
       />
     </>
   );
@@ -139,6 +240,8 @@ function MessagePanel({
   messages,
   inputPlaceholder = "Type your message...",
   onSend,
+  onLoadOlder,
+  isLoadingOlder = false,
 }: MessagePanelProps) {
   const [messageText, setMessageText] = useState("");
   const [isSending, setIsSending] = useState(false);
@@ -163,6 +266,16 @@ function MessagePanel({
       </div>
       <div className={styles.chatPanel}>
         <div className={styles.chatMessages}>
+          {onLoadOlder && (
+            <button
+              className={styles.loadOlderButton}
+              type="button"
+              onClick={onLoadOlder}
+              disabled={isLoadingOlder}
+            >
+              {isLoadingOlder ? "Loading..." : "Load older messages"}
+            </button>
+          )}
           {messages.map((message) => (
             <div
               key={message.id}
@@ -1,4 +1,4 @@
-import { useEffect, useState } from "react";
+import { useEffect, useMemo, useRef, useState } from "react";
 import styles from "./PrescriptionsPanel.module.css";
 
 export interface Prescription {
@@ -11,6 +11,101 @@ export interface Prescription {
   CollectionCode?: string;
 }
 
+interface PrescriptionChangesPage {
+  upserts?: Prescription[];
+  deleted?: string[];
+  change_seq: number;
+  has_more: boolean;
+  error?: string;
+}
+
+// Applies a page from GET /api/prescriptions/changes to a list, keeping the
+// server's prescriptionID order.
+export function applyPrescriptionChanges(
+  current: Prescription[],
+  upserts: Prescription[],
+  deleted: string[],
+): Prescription[] {
+  const byId = new Map(
+    current.map((prescription) => [prescription.prescriptionID, prescription]),
+  );
+  deleted.forEach((id) => byId.delete(id));
+  upserts.forEach((prescription) =>
+    byId.set(prescription.prescriptionID, prescription),
+  );
+  return Array.from(byId.values()).sort((a, b) => {
+    const left = a.prescriptionID || "";
+    const right = b.prescriptionID || "";
+    return left < right ? -1 : left > right ? 1 : 0;
+  });
+}
+
+interface PrescriptionsPage {
+  prescriptions?: Prescription[];
+  next_cursor?: string | null;
+  change_seq?: number;
+  error?: string;
+}
+
+// The server's largest page (MAX_PRESCRIPTION_PAGE_SIZE).
+const PRESCRIPTION_PAGE_LIMIT = 500;
+
+// Loads every prescription by following next_cursor. changeSeq comes from
+// the first page, which the server reads before listing, so syncing the
+// change feed from it cannot miss a change made while paging.
+export async function fetchAllPrescriptions(
+  fetchUrl: string,
+): Promise<{ prescriptions: Prescription[]; changeSeq: number }> {
+  const prescriptions: Prescription[] = [];
+  let changeSeq: number | null = null;
+  let cursor: string | null = null;
+  do {
+    const params = new URLSearchParams({
+      limit: String(PRESCRIPTION_PAGE_LIMIT),
+    });
+    if (cursor) {
+      params.set("cursor", cursor);
+    }
+    const response = await fetch(`${fetchUrl}?${params}`, {
+      credentials: "include",
+    });
+    const result: PrescriptionsPage = await response.json();
+    if (!response.ok) {
+      throw new Error(result.error || "Unable to load prescriptions.");
+    }
+    prescriptions.push(...(result.prescriptions || []));
+    if (changeSeq === null) {
+      changeSeq = result.change_seq || 0;
+    }
+    cursor = result.next_cursor || null;
+  } while (cursor);
+  return { prescriptions, changeSeq: changeSeq || 0 };
+}
+
+// Fetches every change after `since`, handing each page to onChanges, and
+// returns the change_seq to sync from next time.
+export async function fetchPrescriptionChanges(
+  fetchUrl: string,
+  since: number,
+  onChanges: (upserts: Prescription[], deleted: string[]) => void,
+): Promise<number> {
+  let changeSeq = since;
+  let hasMore = true;
+  while (hasMore) {
+    const response = await fetch(`${fetchUrl}/changes?since=${changeSeq}`, {
+      credentials: "include",
+    });
+    const result: PrescriptionChangesPage = await response.json();
+    if (!response.ok) {
+      throw new Error(result.error || "Unable to load prescriptions.");
+    }
+    onChanges(result.upserts || [], result.deleted || []);
+    changeSeq = result.change_seq;
+    hasMore = result.has_more;
+  }
+  return changeSeq;
+}
+
 interface PrescriptionsPanelProps {
   title: string;
   prescriptions: Prescription[];
@@ -119,6 +214,10 @@ export function PrescriptionsPanelContainer({
   const [prescriptions, setPrescriptions] = useState<Prescription[]>([]);
   const [error, setError] = useState("");
   const [isLoading, setIsLoading] = useState(false);
+  // Where the loaded list is up to; later reloads only fetch the changes.
+  const syncedRef = useRef<{ fetchUrl: string; changeSeq: number } | null>(
+    null,
+  );
 
   useEffect(() => {
     let isActive = true;
@@ -126,29 +225,20 @@ export function PrescriptionsPanelContainer({
     async function fetchPrescriptions() {
       try {
         setIsLoading(true);
-        const response = await fetch(fetchUrl, { credentials: "include" });
-        const result = await response.json();
+        const result = await fetchAllPrescriptions(fetchUrl);
         if (!isActive) {
           return;
         }
-        if (response.ok) {
-          const allPrescriptions = result.prescriptions || [];
-          const filtered = filterPatientId
-            ? allPrescriptions.filter(
-                (prescription: Prescription) =>
-                  prescription.patientID === filterPatientId,
-              )
-            : allPrescriptions;
-          setPrescriptions(filtered);
-          setError("");
-        } else {
-          setError(result.error || "Unable to load prescriptions.");
-        }
-      } catch {
+        setPrescriptions(result.prescriptions);
+        syncedRef.current = { fetchUrl, changeSeq: result.changeSeq };
+        setError("");
+      } catch (err) {
         if (!isActive) {
           return;
         }
-        setError("Unable to load prescriptions.");
+        setError(
+          err instanceof Error ? err.message : "Unable to load prescriptions.",
+        );
       } finally {
         if (isActive) {
           setIsLoading(false);
@@ -156,12 +246,51 @@ export function PrescriptionsPanelContainer({
       }
     }
 
-    fetchPrescriptions();
+    async function syncPrescriptions(since: number) {
+      try {
+        const changeSeq = await fetchPrescriptionChanges(
+          fetchUrl,
+          since,
+          (upserts, deleted) => {
+            if (isActive) {
+              setPrescriptions((current) =>
+                applyPrescriptionChanges(current, upserts, deleted),
+              );
+            }
+          },
+        );
+        if (isActive) {
+          syncedRef.current = { fetchUrl, changeSeq };
+          setError("");
+        }
+      } catch {
+        if (isActive) {
+          setError("Unable to load prescriptions.");
+        }
+      }
+    }
+
+    const synced = syncedRef.current;
+    if (synced && synced.fetchUrl === fetchUrl) {
+      syncPrescriptions(synced.changeSeq);
+    } else {
+      fetchPrescriptions();
+    }
 
     return () => {
       isActive = false;
     };
-  }, [fetchUrl, filterPatientId, reloadToken]);
+  }, [fetchUrl, reloadToken]);
+
+  const visiblePrescriptions = useMemo(
+    () =>
+      filterPatientId
+        ? prescriptions.filter(
+            (prescription) => prescription.patientID === filterPatientId,
+          )
+        : prescriptions,
+    [prescriptions, filterPatientId],
+  );
 
   const message =
     isLoading ? "Loading prescriptions..." : error || emptyMessage;
@@ -169,7 +298,7 @@ export function PrescriptionsPanelContainer({
   return (
     <PrescriptionsPanel
       title={title}
-      prescriptions={prescriptions}
+      prescriptions={visiblePrescriptions}
       emptyMessage={message}
     />
   );